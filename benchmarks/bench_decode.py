@@ -0,0 +1,39 @@
+"""
+Micro benchmark of sample frame decoding: list comprehension vs lib.codec.decode_frame
+run from the repository root: python -m benchmarks.bench_decode
+"""
+import timeit
+
+import numpy as np
+
+from lib.codec import decode_frame
+
+CR_STEPS = 128
+
+
+def make_frame(n_sample, seed=0):
+    values = np.random.default_rng(seed).integers(0, 5000, n_sample)
+    return (','.join(str(v) for v in values) + ',').encode()
+
+
+def list_comprehension(frame):  # what CimosDevice used to do per frame
+    return [int(raw) for raw in frame.decode().strip(',').split(',')]
+
+
+def bench(n_sample, number=200):
+    frame = make_frame(n_sample)
+    row = np.zeros(n_sample, dtype=np.int32)
+
+    res = {}
+    for name, fn in [("list comprehension", lambda: list_comprehension(frame)),
+                     ("decode_frame", lambda: decode_frame(frame, out=row))]:
+        res[name] = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    return res
+
+
+if __name__ == '__main__':
+    print(f"{'samples':>8} {'list comp (us)':>15} {'decode_frame (us)':>18} {'speedup':>8} {'per sweep (ms)':>15}")
+    for n_sample in [5, 50, 200, 1000]:
+        res = bench(n_sample)
+        lc, vec = res["list comprehension"], res["decode_frame"]
+        print(f"{n_sample:>8} {lc * 1e6:>15.1f} {vec * 1e6:>18.1f} {lc / vec:>8.1f} {vec * CR_STEPS * 1e3:>15.2f}")
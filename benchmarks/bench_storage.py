@@ -0,0 +1,85 @@
+"""
+Storage benchmark: bytes on disk and write throughput of every output format on a synthetic overnight run,
+slowly drifting pulse counts with sampling noise.
+run from the repository root: python -m benchmarks.bench_storage
+"""
+import os
+import time
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from lib.writer import OutputWriter
+from lib.archive import ArchiveWriter, RunArchive
+from lib.chunked import ChunkedWriter, ChunkedArchive
+
+CR_STEPS = 128
+CHANNEL, BIT = "Right", '1'
+
+
+def synthetic_run(reps, n_sample, seed=0):
+    """
+    yields (raw, row) per repetition the way CimosDevice hands them to a writer
+    """
+    rng = np.random.default_rng(seed)
+    curve = 60 * np.exp(-np.arange(CR_STEPS) / 40)
+    for rep in range(reps):
+        drift = 1 + 0.05 * np.sin(rep / 200)
+        raw = rng.poisson(curve[:, None] * drift, (CR_STEPS, n_sample)).astype(np.int32)
+        yield OrderedDict([(CHANNEL, raw)]), OrderedDict([(BIT, np.mean(raw, axis=1, dtype=np.int32))])
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def bench(reps, n_sample):
+    raw_dtype = np.dtype([(BIT, np.int32, (CR_STEPS,)), (CHANNEL, np.int32, (CR_STEPS, n_sample))])
+    vals = {"Measurment Channel": CHANNEL, "Number of Samples": n_sample, "reps": reps}
+    xlabels = list(range(CR_STEPS))
+
+    formats = [
+        ("CSV", lambda d: OutputWriter(os.path.join(d, "{channel}.csv"))),
+        ("Archive", lambda d: ArchiveWriter(os.path.join(d, "run.biosa"), vals, xlabels, raw_dtype)),
+        ("Compressed zlib", lambda d: ChunkedWriter(os.path.join(d, "run.biosaz"), vals, xlabels, raw_dtype)),
+        ("Compressed lzma", lambda d: ChunkedWriter(os.path.join(d, "run.biosaz"), vals, xlabels, raw_dtype, codec='lzma')),
+    ]
+    data = list(synthetic_run(reps, n_sample))
+    res = OrderedDict()
+    for name, make in formats:
+        with tempfile.TemporaryDirectory() as d:
+            t0 = time.perf_counter()
+            writer = make(d)
+            buffer = OrderedDict([(CHANNEL, np.empty_like(data[0][0][CHANNEL]))])
+            for raw, row in data:  # one reused buffer, like run_query's output arrays
+                buffer[CHANNEL][:] = raw[CHANNEL]
+                writer.write_repetition(buffer, row)
+            writer.close()
+            elapsed = time.perf_counter() - t0
+            res[name] = (dir_size(d), reps / elapsed)
+
+            if name.startswith("Compressed"):  # random access check
+                t0 = time.perf_counter()
+                reader = ChunkedArchive(os.path.join(d, "run.biosaz"))
+                rec = reader.repetition(reps // 2)
+                assert (rec[CHANNEL] == data[reps // 2][0][CHANNEL]).all()
+                reader.close()
+                res[name] += ((time.perf_counter() - t0),)
+            elif name == "Archive":
+                t0 = time.perf_counter()
+                reader = RunArchive(os.path.join(d, "run.biosa"))
+                assert (reader.channel(CHANNEL, reps // 2) == data[reps // 2][0][CHANNEL]).all()
+                res[name] += ((time.perf_counter() - t0),)
+    return res
+
+
+if __name__ == '__main__':
+    for reps, n_sample in [(500, 5), (100, 100)]:
+        res = bench(reps, n_sample)
+        csv_size = res["CSV"][0]
+        print(f"\n{reps} repetitions x {CR_STEPS} steps x {n_sample} samples")
+        print(f"{'format':>20} {'MB':>8} {'ratio vs csv':>13} {'reps/s':>9} {'1 rep read (ms)':>16}")
+        for name, (size, rate, *read) in res.items():
+            read = f"{read[0] * 1e3:16.2f}" if read else f"{'':>16}"
+            print(f"{name:>20} {size / 1e6:>8.2f} {csv_size / size:>13.1f} {rate:>9.0f} {read}")
@@ -0,0 +1,68 @@
+"""
+In-process stand in for a board: Serial wired to a FirmwareSimulator without a pty, no threads or syscalls,
+so a benchmark measures the acquisition code and not the link
+"""
+from lib.interfaces import Interface, Serial
+from lib.simulator import FirmwareSimulator
+
+
+class LoopbackSimulator(FirmwareSimulator):
+    """
+    FirmwareSimulator which answers into a buffer, without latency or throttling
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.rx = bytearray()
+
+    def reply(self, command: str, data: bytes):
+        self.rx += data
+
+
+class LoopbackPort:
+    """
+    The part of serial.Serial that Serial uses
+    """
+    name = "loopback"
+
+    def __init__(self, simulator: LoopbackSimulator, timeout=1):
+        self.simulator = simulator
+        self.timeout = timeout
+        self._pending = bytearray()  # command bytes the simulator couldn't use yet
+
+    def write(self, data: bytes):
+        self._pending += data
+        while self._pending:
+            used = self.simulator.handle(self._pending)
+            if not used:
+                break
+            del self._pending[:used]
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.simulator.rx)
+
+    def read(self, size=1) -> bytes:
+        res = bytes(self.simulator.rx[:size])
+        del self.simulator.rx[:size]
+        return res
+
+    def read_all(self) -> bytes:
+        return self.read(len(self.simulator.rx))
+
+    def reset_input_buffer(self):
+        self.simulator.rx.clear()
+
+    def close(self):
+        pass
+
+
+def fake_serial(**kwargs) -> Serial:
+    """
+    :param kwargs: FirmwareSimulator arguments
+    :return: a connected Serial talking to a LoopbackSimulator
+    """
+    interface = Serial()
+    interface.ser = LoopbackPort(LoopbackSimulator(**kwargs))
+    interface.status = Interface.CONNECTED
+    return interface
@@ -0,0 +1,385 @@
+"""
+Benchmark suite of the hot paths: query loop, many boards on threads or one event loop, wifi against serial, adaptive search, crossing analysis, frame parsing, postprocess, output writers, live plot ticks
+and startup. Runs on a plain Linux box, the board is an in-process fake (benchmarks.fake), plots use Agg.
+run from the repository root:
+python -m benchmarks.suite --output results.json
+python -m benchmarks.suite --baseline results.json  # exits with 1 if a metric regressed
+"""
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from datetime import datetime
+
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
+
+from lib.codec import decode_frame, encode_binary_frame
+from lib.results import ResultStore
+from lib.writer import OutputWriter
+from lib.archive import ArchiveWriter
+from lib.chunked import ChunkedWriter
+from lib.acquisition import CimosAcquisition
+from lib.simulator import FirmwareSimulator, TcpSimulator
+from lib.interfaces import Serial, Wifi
+from lib import aio
+from lib.search import CrossingSearch
+from lib.analysis import crossings, refrences
+from benchmarks.fake import fake_serial
+
+CR_STEPS = CimosAcquisition.CR_STEPS
+THRESHOLD = 0.15  # relative change counted as a regression
+LAN_RTT = 0.001  # seconds
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class NullLog:
+    class _Signal:
+        def emit(self, message, level=0):
+            pass
+
+    LOG = _Signal()
+
+
+def metric(value, unit: str, higher_is_better: bool) -> dict:
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def best_of(fn, number: int, repeat=5) -> float:
+    """
+    seconds per call
+    """
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def query_vals(channel="Left&Right", kind="Capacitance Sweep", n_sample=20, reps=20, readout="Binary") -> dict:
+    return {"Measurment Channel": channel, "Measurment Type": kind, "Refrence Value": 64, "CCO Resolution": "000",
+            "Number of Samples": n_sample, "Repeats": reps, "Repeat Interval": 0, "Stop Time": 0,
+            "Readout": readout, "Output Format": "CSV", "reps": reps}
+
+
+def bench_query(quick: bool) -> dict:
+    """
+    Repetitions per second through CimosAcquisition.run_query, firmware with and without the optional commands
+    """
+    res = OrderedDict()
+    reps = 5 if quick else 50
+    for name, capabilities, readout in [("batched binary", "BF", "Binary"), ("batched ascii", "BF", "ASCII"),
+                                        ("per step ascii", "", "ASCII")]:
+        device = CimosAcquisition("bench")
+        if not capabilities:  # an old firmware doesn't answer the probe, skip its timeout
+            device.capabilities = set()
+        interface = fake_serial(capabilities=capabilities, noise=0)
+        vals = query_vals(reps=reps, readout=readout)
+        t0 = time.perf_counter()
+        device.run_query(interface, vals, NullLog(), finish_query=False, save_config=False)
+        elapsed = time.perf_counter() - t0
+        assert len(device.results) == reps
+        res[f"query/{name}"] = metric(reps / elapsed, "sweeps/s", True)
+    return res
+
+
+def bench_boards(quick: bool) -> dict:
+    """
+    Sweeps per second of many simulated pty boards together, one query thread per board against one event loop
+    """
+    res = OrderedDict()
+    boards, reps = (8, 3) if quick else (32, 10)
+    simulators = [FirmwareSimulator(seed=i, latency=0.0002) for i in range(boards)]
+    ports = [simulator.start() for simulator in simulators]
+    try:
+        devices = [CimosAcquisition("bench") for _ in ports]
+        interfaces = [Serial() for _ in ports]
+        for interface, port in zip(interfaces, ports):
+            interface.open_port(port)
+        threads = [threading.Thread(target=device.run_query, args=(interface, query_vals(reps=reps), NullLog()),
+                                    kwargs={'finish_query': False, 'save_config': False})
+                   for device, interface in zip(devices, interfaces)]
+        t0 = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        res["boards/threads"] = metric(boards * reps / (time.perf_counter() - t0), "sweeps/s", True)
+        for interface in interfaces:
+            interface.close()
+        assert all(len(device.results) == reps for device in devices)
+
+        async def run():
+            interfaces = [aio.AsyncSerial() for _ in ports]
+            for interface, port in zip(interfaces, ports):
+                await interface.open(port)
+            t0 = time.perf_counter()
+            await asyncio.gather(*[aio.run_query(device, interface, query_vals(reps=reps), NullLog())
+                                   for device, interface in zip(devices, interfaces)])
+            elapsed = time.perf_counter() - t0
+            for interface in interfaces:
+                await interface.close()
+            return elapsed
+        devices = [CimosAcquisition("bench") for _ in ports]
+        res["boards/async"] = metric(boards * reps / asyncio.run(run()), "sweeps/s", True)
+        assert all(len(device.results) == reps for device in devices)
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+    return res
+
+
+def bench_wifi(quick: bool) -> dict:
+    """
+    Sweeps per second over TCP to a local board with LAN_RTT of round trip, batched and per step at several
+    pipeline depths, against a pty board at 115200 boud
+    """
+    res = OrderedDict()
+    reps = 2 if quick else 10
+    for name, capabilities, depth in [("batched", "BF", 1), ("per step", "F", 1), ("per step depth 4", "F", 4),
+                                      ("per step depth 16", "F", 16)]:
+        with TcpSimulator(rtt=LAN_RTT, seed=0, capabilities=capabilities) as simulator:
+            interface = Wifi()
+            interface.open_host(simulator.host, simulator.tcp_port, depth=depth)
+            device = CimosAcquisition("bench")
+            t0 = time.perf_counter()
+            device.run_query(interface, query_vals(reps=reps), NullLog(), finish_query=False, save_config=False)
+            res[f"wifi/{name}"] = metric(reps / (time.perf_counter() - t0), "sweeps/s", True)
+            interface.close()
+            assert len(device.results) == reps
+
+    with FirmwareSimulator(seed=0, boud=115200) as simulator:
+        interface = Serial()
+        interface.open_port(simulator.port)
+        device = CimosAcquisition("bench")
+        t0 = time.perf_counter()
+        device.run_query(interface, query_vals(reps=1), NullLog(), finish_query=False, save_config=False)
+        res["wifi/serial 115200 batched"] = metric(1 / (time.perf_counter() - t0), "sweeps/s", True)
+        interface.close()
+    return res
+
+
+def bench_parse(quick: bool) -> dict:
+    res = OrderedDict()
+    rng = np.random.default_rng(0)
+    for n_sample in [5, 200, 1000]:
+        values = rng.integers(0, 5000, n_sample)
+        row = np.zeros(n_sample, dtype=np.int32)
+        for name, frame in [("ascii", (','.join(str(v) for v in values) + ',').encode()),
+                            ("binary", encode_binary_frame(values))]:
+            seconds = best_of(lambda: decode_frame(frame, out=row), 100 if quick else 1000)
+            res[f"parse/{name} {n_sample} samples"] = metric(1 / seconds, "frames/s", True)
+    return res
+
+
+def bench_search(quick: bool) -> dict:
+    """
+    Adaptive crossing search against full sweeps of a drifting simulated curve (readouts per search and error),
+    and cide repetitions per second through run_query with a full and an adaptive search
+    """
+    res = OrderedDict()
+    level = 35  # half way down the curve
+    simulator = FirmwareSimulator(seed=0)
+    simulator.n_sample = 20
+    search = CrossingSearch(None, CR_STEPS, level)
+    errors, readouts = [], []
+    for rep in range(100 if quick else 1000):
+        simulator.centers['1'] = 80 + 4 * np.sin(rep / 25)
+        full = CimosAcquisition.postprocess(np.array([simulator.samples(cr, '1') for cr in range(CR_STEPS)]))
+        search.read = lambda crs: full[crs]
+        before = search.readouts
+        errors.append(abs(search.search() - crossings(full, level)[0]))
+        readouts.append(search.readouts - before)
+    res["search/readouts first"] = metric(readouts[0], "readouts", False)
+    res["search/readouts tracking"] = metric(float(np.mean(readouts[1:])), "readouts", False)
+    res["search/max error"] = metric(float(np.max(errors)), "CR steps", False)
+
+    reps = 10 if quick else 100
+    for name in ["Full", "Adaptive"]:
+        device = CimosAcquisition("bench")
+        vals = dict(query_vals("Right", reps=reps), Search=name, refrence_pulse=level)
+        t0 = time.perf_counter()
+        device.run_query(fake_serial(noise=0), vals, NullLog(), finish_query=False, save_config=False)
+        res[f"search/cide {name.lower()}"] = metric(reps / (time.perf_counter() - t0), "reps/s", True)
+    return res
+
+
+def bench_analysis(quick: bool) -> dict:
+    """
+    Sweeps per second through the vectorized cide crossings and auto refrences, on simulated noisy sweeps
+    """
+    res = OrderedDict()
+    simulator = FirmwareSimulator(seed=0)
+    simulator.n_sample = 5
+    base = np.array([CimosAcquisition.postprocess(np.array([simulator.samples(cr, '1') for cr in range(CR_STEPS)]))
+                     for rep in range(100)])
+    sweeps = np.tile(base, ((10000 if quick else 1000000) // len(base), 1))
+    for name, fn in [("crossings", lambda: crossings(sweeps, 35)), ("refrences", lambda: refrences(sweeps))]:
+        seconds = best_of(fn, 1, 3)
+        res[f"analysis/{name}"] = metric(len(sweeps) / seconds, "sweeps/s", True)
+    return res
+
+
+def bench_postprocess(quick: bool) -> dict:
+    res = OrderedDict()
+    for n_sample in [5, 200]:
+        samples = np.random.default_rng(0).integers(0, 5000, (CR_STEPS, n_sample)).astype(np.int32)
+        seconds = best_of(lambda: CimosAcquisition.postprocess(samples), 100 if quick else 1000)
+        res[f"postprocess/{n_sample} samples"] = metric(seconds * 1e6, "us/sweep", False)
+    return res
+
+
+def bench_writers(quick: bool) -> dict:
+    """
+    Repetitions per second through the output writers, including the final flush
+    """
+    res = OrderedDict()
+    reps, n_sample = (50, 20) if quick else (200, 20)
+    raw = OrderedDict([("Right", np.random.default_rng(0).poisson(40, (CR_STEPS, n_sample)).astype(np.int32))])
+    row = OrderedDict([('1', CimosAcquisition.postprocess(raw["Right"]))])
+    vals = query_vals("Right", n_sample=n_sample, reps=reps)
+    raw_dtype = np.dtype([('1', np.int32, (CR_STEPS,)), ("Right", np.int32, (CR_STEPS, n_sample))])
+    xlabels = CimosAcquisition.XLABELS
+    for name, make in [("csv", lambda d: OutputWriter(os.path.join(d, "{channel}.csv"))),
+                       ("archive", lambda d: ArchiveWriter(os.path.join(d, "run.biosa"), vals, xlabels, raw_dtype)),
+                       ("compressed", lambda d: ChunkedWriter(os.path.join(d, "run.biosaz"), vals, xlabels, raw_dtype))]:
+        with tempfile.TemporaryDirectory() as d:
+            t0 = time.perf_counter()
+            writer = make(d)
+            for rep in range(reps):
+                raw["Right"] += 1  # run_query overwrites its raw buffers every repetition
+                writer.write_repetition(raw, row)
+            writer.close()
+            res[f"writer/{name}"] = metric(reps / (time.perf_counter() - t0), "reps/s", True)
+    return res
+
+
+def bench_plot(quick: bool) -> dict:
+    """
+    Time of one live plot tick which adds one repetition, at growing history lengths
+    """
+    from lib.plotting import LivePlot
+    from lib.device import CimosDevice
+
+    res = OrderedDict()
+    ticks = 5 if quick else 20
+    for plot_type, kind, channel in [("2D", "Capacitance Sweep", "Left&Right"), ("Waterfall", "Capacitance Sweep", "Left"),
+                                     ("3D", "Capacitance Sweep", "Left"), ("2D", "Fixed Refrence", "Left&Right"),
+                                     ("3D", "Fixed Refrence", "Left")]:
+        for history in ([100, 1000] if quick else [100, 1000, 10000]):
+            device = CimosDevice("bench")
+            device.vals = dict(query_vals(channel, kind), **{"Plot Type": plot_type})
+            fig = Figure(figsize=(8, 4), dpi=100)
+            FigureCanvasAgg(fig)
+            live_plot = LivePlot(fig, device.setup_axes(fig), device.vals)
+
+            shape = (CR_STEPS,) if kind == "Capacitance Sweep" else ()
+            results = ResultStore(history + ticks)
+            bits = [device.CHANNEL_BITS[c] for c in channel.split('&')]
+            for bit in bits:
+                results.add_channel(bit, shape)
+            simulator = FirmwareSimulator(seed=0)
+            cr = np.arange(CR_STEPS) if shape else 64
+
+            def row():  # smooth curves with a little noise, like a real board
+                return {bit: simulator.curve(cr, bit) + simulator.rng.normal(0, 1, shape) for bit in bits}
+            for rep in range(history):
+                results.append(row())
+            live_plot.update(results)
+
+            times = []
+            for tick in range(ticks):
+                results.append(row())
+                t0 = time.perf_counter()
+                live_plot.update(results)
+                times.append(time.perf_counter() - t0)
+            res[f"plot/{plot_type} {kind} {history} reps"] = metric(np.median(times) * 1e3, "ms/tick", False)
+    return res
+
+
+def bench_startup(quick: bool) -> dict:
+    """
+    Wall time of fresh interpreters importing the cli and the gui, and building the main window
+    """
+    res = OrderedDict()
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen", PYTHONPATH=ROOT)
+    for name, code in [("import cli", "import lib.cli"),
+                       ("import gui", "import lib.gui"),
+                       ("main window", "from PyQt5.QtWidgets import QApplication\nfrom lib.controller import *\nfrom lib.gui import *\n"
+                                       "app = QApplication([])\n"
+                                       "MainWindow(Controller(devices=[CimosDevice('bench')], interfaces=[Serial()]))")]:
+        times = []
+        for i in range(2 if quick else 5):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - t0)
+        res[f"startup/{name}"] = metric(min(times) * 1e3, "ms", False)
+    return res
+
+
+BENCHMARKS = OrderedDict([("query", bench_query), ("boards", bench_boards), ("wifi", bench_wifi), ("search", bench_search), ("parse", bench_parse),
+                          ("analysis", bench_analysis), ("postprocess", bench_postprocess), ("writer", bench_writers), ("plot", bench_plot),
+                          ("startup", bench_startup)])
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    :return: names of the metrics which got worse than baseline by more than threshold
+    """
+    regressions = []
+    print(f"{'metric':>48} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, now in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["value"]
+        change = (now["value"] - before) / before if before else 0.0
+        worse = -change if now["higher_is_better"] else change
+        flag = "  REGRESSION" if worse > threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:>48} {before:>12.4g} {now['value']:>12.4g} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark suite of the acquisition, parsing, storage and plotting hot paths")
+    parser.add_argument("--output", default=None, help="write the results to this json file")
+    parser.add_argument("--baseline", default=None, help="compare against the results json of an earlier run")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="relative change flagged as a regression")
+    parser.add_argument("--only", action="append", choices=list(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions, for a smoke test")
+    args = parser.parse_args(argv)
+
+    results = OrderedDict()
+    for name, bench in BENCHMARKS.items():
+        if args.only and name not in args.only:
+            continue
+        for k, v in bench(args.quick).items():
+            results[k] = v
+            print(f"{k:>48} {v['value']:>12.4g} {v['unit']}", flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"meta": {"date": datetime.now().isoformat(), "python": platform.python_version(),
+                                "numpy": np.__version__, "platform": platform.platform(), "quick": args.quick},
+                       "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,655 @@
+import json
+import os
+import time
+import threading
+from functools import partial
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from .log_level import *
+from .interfaces import Interface
+from .codec import decode_frame
+from .results import ResultStore
+from .timing import Timings
+from .scheduler import RepetitionScheduler
+from .calibration import CalibrationCache
+from .search import CrossingSearch
+from .analysis import crossings, refrences
+from .writer import OutputWriter
+from .archive import ArchiveWriter
+from . import archive, chunked
+
+
+class Acquisition:
+    """
+    The Qt free part of a device: what a query needs besides the widgets and the plot.
+    The gui devices add widgets and signals on top of it, the cli runs it as is.
+    """
+    RUNTIME_KEYS = ('start_time_ns', 'find_refrence')  # set by a running query, not part of the config
+
+    def __init__(self, name: str = None, **kwargs):
+        super().__init__(**kwargs)
+        self.halt_event = None  # shared with the worker process while one runs the query
+        self.halt = False
+
+        self.name = name if name is not None else type(self).__name__
+
+        self.defaults = {}
+        if os.path.isfile(self.cfg_file_path()):
+            with open(self.cfg_file_path(), 'r') as cfg_file:
+                self.defaults = json.load(cfg_file)
+
+    @property
+    def halt(self) -> bool:
+        return self._halt or (self.halt_event is not None and self.halt_event.is_set())
+
+    @halt.setter
+    def halt(self, value: bool):
+        self._halt = value
+        if self.halt_event is not None:
+            if value:
+                self.halt_event.set()
+            else:
+                self.halt_event.clear()
+
+    def save_last_config(self, vals: dict):
+        self.defaults = {k: v for k, v in vals.items() if k not in self.RUNTIME_KEYS}
+        with open(self.cfg_file_path(), 'w') as cfg_file:
+            json.dump(self.defaults, cfg_file)
+
+    def cfg_file_path(self):
+        return os.path.join(os.path.dirname(os.path.dirname(__file__)), self.name + '.cfg')
+
+    def reset_halt(self, logger=None):
+        if logger:
+            logger.LOG.emit("Stopping Query", WARNING)
+        self.halt = False
+        self.query_stopped()
+
+    def query_stopped(self):
+        """
+        Called from the query thread when a query is over, finished or halted
+        """
+        pass
+
+
+class CimosAcquisition(Acquisition):
+    CHANNEL_BITS = {'Left': ' ', 'Right': '1', 'Internal Cap': '0'}
+    CR_STEPS = 128
+    XLABELS = [296.77, 299.66, 305.01, 307.9, 318.59, 321.48, 326.83, 329.72, 349.35, 352.24, 357.59, 360.48,
+               371.17, 374.06, 379.41, 382.3, 416.16, 419.05, 424.4, 427.29, 437.98, 440.87, 446.22, 449.11,
+               468.74, 471.63, 476.98, 479.87, 490.56, 493.45, 498.8, 501.69, 551.43, 554.32, 559.67, 562.56,
+               573.25, 576.14, 581.49, 584.38, 604.01, 606.9, 612.25, 615.14, 625.83, 628.72, 634.07, 636.96,
+               670.82, 673.71, 679.06, 681.95, 692.64, 695.53, 700.88, 703.77, 723.4, 726.29, 731.64, 734.53,
+               745.22, 748.11, 753.46, 756.35, 794.11, 797, 802.35, 805.24, 815.93, 818.82, 824.17, 827.06, 846.69,
+               849.58, 854.93, 857.82, 868.51, 871.4, 876.75, 879.64, 913.5, 916.39, 921.74, 924.63, 935.32, 938.21,
+               943.56, 946.45, 966.08, 968.97, 974.32, 977.21, 987.9, 990.79, 996.14, 999.03, 1048.77, 1051.66,
+               1057.01, 1059.9, 1070.59, 1073.48, 1078.83, 1081.72, 1101.35, 1104.24, 1109.59, 1112.48, 1123.17,
+               1126.06, 1131.41, 1134.3, 1168.16, 1171.05, 1176.4, 1179.29, 1189.98, 1192.87, 1198.22, 1201.11,
+               1220.74, 1223.63, 1228.98, 1231.87, 1242.56, 1245.45, 1250.8, 1253.69]
+
+    # optional firmware commands, advertised in the reply of CAPABILITY_COMMAND
+    CAPABILITY_COMMAND = "?"
+    BATCH_SWEEP = "B"
+    BINARY_READOUT = "F"
+
+    FRAME_POLL = 0.5  # seconds between halt checks while waiting for samples
+    FULL_SWEEP_EVERY = 50  # repetitions, an adaptive search is checked against a full sweep and restarted from it
+    SEARCH_TOLERANCE = 0.5  # CR steps an adaptive search may be off from the full sweep
+
+    CALIBRATION_SAMPLES = 5  # per CR step of the calibration pre-sweeps
+    # vals['Calibration']: reuse cached calibrations after reading their probes again, reuse them as is, or never
+    DRIFT_CHECK = "Drift check"
+    CACHED = "Cached"
+    ALWAYS = "Always"
+    DRIFT_TOLERANCE = 0.1  # relative change of a probe which counts as drift
+    DRIFT_COUNTS = 3  # pulses a probe may change by in any case, the noise of a few samples
+
+    RESULT_STORE = ResultStore  # the worker process swaps in a store which also publishes to shared memory
+
+    def __init__(self, name: str = None, **kwargs):
+        super(CimosAcquisition, self).__init__(name, **kwargs)
+
+        self.results = ResultStore()
+        self.capabilities = None
+        self.vals = None
+        self.timings = None  # of the last query
+        self.scheduler = None  # of the last query
+        self.calibrations = CalibrationCache(os.path.splitext(self.cfg_file_path())[0] + ".calibration.json")
+
+    def probe_capabilities(self, interface: Interface) -> set:
+        """
+        Ask the firmware which optional commands it supports.
+        Older firmwares don't answer (or answer with an empty frame), which means none.
+        :return: set of supported command letters
+        """
+        interface.send(self.CAPABILITY_COMMAND)
+        o = interface.read(until=Interface.TERMINATION_CHAR)
+        if not isinstance(o, str) or not o.endswith(Interface.TERMINATION_CHAR.decode()):
+            return set()
+        return set(o.strip(Interface.TERMINATION_CHAR.decode())) - set(', \r\n')
+
+    def set_readout(self, interface: Interface, binary: bool) -> bool:
+        """
+        Switch the firmware between ascii and binary sample frames
+        :return: True if the firmware acknowledged
+        """
+        interface.send(f"{self.BINARY_READOUT}{int(binary)}")
+        return interface.read(until=Interface.TERMINATION_CHAR) == Interface.TERMINATION_CHAR.decode()
+
+    @staticmethod
+    def postprocess(values: np.ndarray) -> np.ndarray:
+        """
+        (steps, n_sample) samples -> one value per step
+        """
+        return np.mean(values, axis=1, dtype=np.int32)
+
+    def complete_vals(self, vals: dict, logger):
+        """
+        Derive the values a query needs from the config values (vals['reps'])
+        """
+        if vals['Stop Time'] and vals['Repeat Interval']:
+            vals['reps'] = vals['Stop Time'] // vals['Repeat Interval']
+        else:
+            vals['reps'] = vals['Repeats']
+        if not vals['reps']:
+            logger.LOG.emit("Your config result in an invalid Repeat", INFO)
+        return vals
+
+    def output_name(self, vals: dict, directory: str = None) -> str:
+        """
+        :param directory: outputs/ of the repository by default
+        :return: output path without extension, with a {channel} placeholder
+        """
+        if directory is None:
+            directory = os.path.join(os.path.dirname(os.path.dirname(__file__)), "outputs")
+        return os.path.join(directory,
+                            f"{{channel}}_{datetime.now().strftime('%d-%m-%Y %H:%M:%S')}_{self.name}_{vals['Number of Samples']}")
+
+    def calibrate(self, interface: Interface, vals: dict, logger) -> dict:
+        """
+        Run the short pre-sweeps some measurments need and add their results to vals.
+        Results of earlier pre-sweeps are reused from the calibration cache, as vals['Calibration'] allows
+        :return: vals of the actual query
+        """
+        if vals["Measurment Type"] == "Fixed Refrence":
+            # process refrences
+            if vals['Refrence Value'] == -1:
+                channels = vals['Measurment Channel'].split('&')
+                cached = self.cached_calibration(interface, vals, logger, channels)
+                if cached is not None:
+                    for chan, refrence in zip(channels, cached):
+                        vals[f"{chan}_refrence"] = refrence
+                        logger.LOG.emit(f"{chan}_refrence: {self.XLABELS[refrence]} (cached)", INFO)
+                    self.vals = vals
+                    return vals
+
+                vals_backup = vals.copy()
+                vals['Measurment Type'] = "Capacitance Sweep"
+                vals['Number of Samples'] = self.CALIBRATION_SAMPLES
+                vals['reps'] = 1
+                vals['Repeat Interval'] = 0
+                vals['find_refrence'] = True  # an adaptive search only reads around the half level
+                self.pre_query(interface, vals, logger)
+
+                vals = vals_backup
+                sweeps = np.stack([self.results.view(self.CHANNEL_BITS[chan])[0] for chan in channels])
+                for chan, sweep_data, refrence, peak, found in zip(channels, sweeps, *refrences(sweeps)):
+                    if peak + 1 == self.CR_STEPS:
+                        logger.LOG.emit("Not fully capacitance mode...", ERROR)
+                    if not found:
+                        logger.LOG.emit("This should not happen! Something bad happend", ERROR)
+                    refrence = vals[f"{chan}_refrence"] = int(refrence)
+                    self.calibrations.put(self.calibration_key(chan, vals), refrence, (refrence, int(sweep_data[refrence])))
+                    logger.LOG.emit(f"{chan}_refrence: {self.XLABELS[vals[f'{chan}_refrence']]}", INFO)
+                vals["Measurment Type"] = "Fixed Refrence"
+                self.vals = vals
+
+        if vals['Measurment Channel'] == "Right" and vals['Measurment Type'] == "Capacitance Sweep":
+            # process the internal cap
+            cached = self.cached_calibration(interface, vals, logger, ["Internal Cap"])
+            if cached is not None:
+                vals['refrence_pulse'] = cached[0]
+            else:
+                vals_backup = vals.copy()
+                vals['Measurment Channel'] = "Internal Cap"
+                vals['Number of Samples'] = self.CALIBRATION_SAMPLES
+                vals['reps'] = 1
+                vals['Repeat Interval'] = 0
+                self.pre_query(interface, vals, logger)
+
+                internal_cap = self.results.view('0')[0]
+                slope = (internal_cap[16] - internal_cap[15]) / (self.XLABELS[16] - self.XLABELS[15])
+                intercept = internal_cap[16] - slope * self.XLABELS[16]
+                vals = vals_backup
+                vals['refrence_pulse'] = float(402.7 * slope + intercept)
+                self.calibrations.put(self.calibration_key("Internal Cap", vals), vals['refrence_pulse'], (16, int(internal_cap[16])))
+            self.vals = vals
+            logger.LOG.emit(f"refrence pulse = {vals['refrence_pulse']:.1f}{' (cached)' if cached is not None else ''}", INFO)
+
+        return vals
+
+    def pre_query(self, interface: Interface, vals: dict, logger):
+        """
+        Run a short query of a calibration, self.results holds its results afterwards
+        """
+        thread = threading.Thread(target=self.run_query, args=(interface, vals, logger),
+                                  kwargs={'finish_query': False, 'save_config': False}, daemon=True)
+        thread.start()  # not self.query_proc, the event loop may have stored the query there already
+        thread.join()
+
+    def calibration_key(self, channel: str, vals: dict) -> str:
+        return CalibrationCache.key(self.name, channel, vals['CCO Resolution'], self.CALIBRATION_SAMPLES)
+
+    def cached_calibration(self, interface: Interface, vals: dict, logger, channels: list):
+        """
+        Calibration values of channels from the cache. With vals['Calibration'] "Drift check" the probe step
+        of every channel is read again (one readout each) and a channel which drifted off its probe invalidates all.
+        :return: one value per channel, None if the pre-sweeps have to run
+        """
+        mode = vals.get('Calibration', self.DRIFT_CHECK)
+        if mode == self.ALWAYS:
+            return None
+        entries = [self.calibrations.get(self.calibration_key(chan, vals)) for chan in channels]
+        if None in entries:
+            return None
+
+        if mode == self.DRIFT_CHECK:
+            probe_vals = dict(vals, **{'Measurment Type': "Fixed Refrence", 'Measurment Channel': '&'.join(channels),
+                                       'Number of Samples': self.CALIBRATION_SAMPLES, 'reps': 1, 'Repeat Interval': 0})
+            for chan, entry in zip(channels, entries):
+                probe_vals[f"{chan}_refrence"] = entry['probe'][0]
+            self.pre_query(interface, probe_vals, logger)
+            for chan, entry in zip(channels, entries):
+                count = self.results.view(self.CHANNEL_BITS[chan])
+                expected = entry['probe'][1]
+                if not len(count) or abs(int(count[0]) - expected) > max(self.DRIFT_COUNTS, self.DRIFT_TOLERANCE * expected):
+                    logger.LOG.emit(f"{chan} drifted since its calibration "
+                                    f"({int(count[0]) if len(count) else '-'} instead of {expected} pulses), recalibrating", WARNING)
+                    return None
+        return [entry['value'] for entry in entries]
+
+    def recalibrate(self):
+        """
+        Forget the cached calibrations, the next query runs the pre-sweeps again
+        """
+        self.calibrations.invalidate(f"{self.name}/")
+
+    def batch_command(self, bits: str, start=0, stop=None, step=1) -> str:
+        """
+        B command which streams CR steps start, start + step ... stop of every channel in bits
+        """
+        stop = self.CR_STEPS - 1 if stop is None else stop
+        return f"{self.BATCH_SWEEP}{format(start, '07b')}{format(stop, '07b')}{format(step, '07b')}{bits}\0"
+
+    def batch_step(self, crs: list):
+        """
+        :return: the step of crs if one B command reads them, else None
+        """
+        step = crs[1] - crs[0] if len(crs) > 1 else 1
+        if self.BATCH_SWEEP in self.capabilities and step > 0 and crs == list(range(crs[0], crs[-1] + 1, step)):
+            return step
+        return None
+
+    def open_results(self, vals: dict) -> ResultStore:
+        """
+        The result store of a query, also kept in self.results
+        """
+        results = self.RESULT_STORE(vals['reps'])
+        for chan in vals['Measurment Channel'].split('&'):
+            results.add_channel(self.CHANNEL_BITS[chan], (self.CR_STEPS,) if vals['Measurment Type'] == "Capacitance Sweep" else ())
+        if vals.get('refrence_pulse', None):
+            results.add_channel('cide', dtype=np.float64)
+        results.add_channel(ResultStore.TIME, dtype=np.int64)
+        self.results = results
+        return results
+
+    def start_scheduler(self, vals: dict, logger) -> RepetitionScheduler:
+        """
+        The scheduler of a query, started, also kept in self.scheduler
+        """
+        def on_overrun(missed):
+            logger.LOG.emit("Process time is more than the whole Interval..." +
+                            (f" skipped {missed} repetitions" if missed else ""), ERROR)
+        scheduler = self.scheduler = RepetitionScheduler(vals['Repeat Interval'], vals.get('Overrun', RepetitionScheduler.SKIP), on_overrun)
+        vals['start_time_ns'] = scheduler.start()
+        return scheduler
+
+    def sample_buffers(self, vals: dict) -> OrderedDict:
+        """
+        :return: channel bit -> the raw samples of one repetition, reused by every repetition
+        """
+        steps = self.CR_STEPS if vals['Measurment Type'] == "Capacitance Sweep" else 1
+        return OrderedDict([(self.CHANNEL_BITS[chan], np.zeros((steps, vals['Number of Samples']), dtype=np.int32))
+                            for chan in vals['Measurment Channel'].split('&')])
+
+    def fixed_refrences(self, vals: dict) -> dict:
+        """
+        :return: channel bit -> the CR step a Fixed Refrence query reads
+        """
+        return {self.CHANNEL_BITS[chan]: vals.get(f"{chan}_refrence", vals['Refrence Value']) for chan in vals['Measurment Channel'].split('&')}
+
+    def adaptive_searches(self, vals: dict, read=None):
+        """
+        :param read: channel bit -> CrossingSearch read function, None for CrossingSearch.search_async
+        :return: channel bit -> CrossingSearch, None for full sweeps
+        """
+        # adaptive: only the crossing of the refrence pulse (or of the half level for an auto refrence) is searched
+        level = vals.get('refrence_pulse', None)
+        if vals.get('Search', "Full") != "Adaptive" or not (level or vals.get('find_refrence', False)):
+            return None
+        bits = [self.CHANNEL_BITS[chan] for chan in vals['Measurment Channel'].split('&')]
+        return OrderedDict([(lb, CrossingSearch(read(lb) if read is not None else None, self.CR_STEPS, level)) for lb in bits])
+
+    def is_full_sweep(self, vals: dict, searches, done_reps: int) -> bool:
+        """
+        :param done_reps: repetitions read so far, the scheduler may have skipped slots
+        """
+        return searches is None or bool(vals.get('refrence_pulse', None) and done_reps % self.FULL_SWEEP_EVERY == 0)
+
+    def sweep_row(self, vals: dict, output: OrderedDict, started: int, logger, searches=None, found=None) -> OrderedDict:
+        """
+        Results row of a Capacitance Sweep repetition
+        :param found: channel bit -> crossing of an adaptive repetition, None for a full sweep
+        """
+        level = vals.get('refrence_pulse', None)
+        if found is None:
+            row = OrderedDict([(k, self.postprocess(output[k])) for k in output])
+        else:
+            row = OrderedDict([(k, searches[k].curve.copy()) for k in output])
+
+        # right sweep case
+        if level:
+            if found is None:
+                row['cide'] = crossings(row['1'], level)[0]  # only the right channel needs it
+                if searches is not None:
+                    error = searches['1'].verify(row['1'])
+                    if abs(error) > self.SEARCH_TOLERANCE:
+                        logger.LOG.emit(f"Adaptive search was {error:+.2f} CR steps off the full sweep", WARNING)
+                    searches['1'].anchor(row['1'])
+            else:
+                row['cide'] = found['1']
+        row[ResultStore.TIME] = started
+        return row
+
+    def fixed_row(self, output: OrderedDict, started: int) -> OrderedDict:
+        """
+        Results row of a Fixed Refrence repetition
+        """
+        row = OrderedDict([(k, self.postprocess(output[k])[0]) for k in output])
+        row[ResultStore.TIME] = started
+        return row
+
+    def save_row(self, vals: dict, output: OrderedDict, row: OrderedDict, writer=None, measured=True):
+        """
+        Append row to self.results and hand it to the writer with the raw samples of the repetition
+        :param measured: False for an adaptive repetition, its curves are mostly interpolated and output
+        still holds older samples, so the writer stores its row but flags it and leaves its raw samples out
+        """
+        self.results.append(row)
+        if writer is not None:
+            writer.write_repetition(OrderedDict([(chan, output[self.CHANNEL_BITS[chan]]) for chan in vals['Measurment Channel'].split('&')]), row, measured)
+
+    def close_writer(self, writer: OutputWriter, logger) -> bool:
+        """
+        Write what is queued and close the files, a writer error is logged instead of raised
+        :return: False if the writer failed
+        """
+        try:
+            writer.close()
+        except Exception as e:  # the query has to end normally, or the gui stays running
+            logger.LOG.emit(f"Writing the output failed: {e!r}", ERROR)
+            return False
+        return True
+
+    def log_search(self, searches, logger):
+        """
+        Log how many readouts the adaptive searches of a query needed
+        """
+        n = sum(search.searches for search in searches.values())
+        if n:
+            logger.LOG.emit(f"Adaptive search: {sum(search.readouts for search in searches.values()) / n:.1f} "
+                            f"readouts per search instead of {self.CR_STEPS}", INFO)
+
+    def run_query(self, interface: Interface, vals: dict, logger, **kwargs):
+        """
+        The whole query management, runs in the query thread (or the worker process)
+        :param kwargs: output_name, finish_query and save_config
+        """
+        timings = self.timings = Timings()
+        dropped = getattr(interface, 'dropped_frames', 0)  # frames the reader thread had no room for
+
+        def read_samples(row):  # blocks on the interface until the samples arrive or the query is halted
+            o = None
+            with timings.phase("wait for data"):
+                while o is None and not self.halt:
+                    o = interface.read_frame(timeout=self.FRAME_POLL)
+            if getattr(interface, 'dropped_frames', 0) > dropped:  # every reply after the gap would land on the wrong step
+                logger.LOG.emit(f"{interface.dropped_frames - dropped} frames dropped, the readout is out of step", ERROR)
+                interface.interupt()
+                self.halt = True
+                return
+            if o is not None:
+                with timings.phase("parse"):
+                    try:
+                        decode_frame(o, out=row)
+                    except ValueError as e:  # corrupt frame, stop cleanly instead of ending the thread
+                        logger.LOG.emit(f"Bad sample frame, stopping the query: {e}", ERROR)
+                        interface.interupt()
+                        self.halt = True
+
+        def sweep_per_step(output):  # W/R round trip for every CR step and channel
+            depth = getattr(interface, 'pipeline_depth', 1)
+            if depth > 1:
+                return sweep_pipelined(output, depth)
+            for x in range(self.CR_STEPS):
+                for lb in output:
+                    with timings.phase("write cr"):
+                        interface.send(f"W{format(x, '07b')}" + lb)
+                        interface.read(until=Interface.TERMINATION_CHAR)
+                    if self.halt:
+                        return False
+
+                    interface.send("R")
+                    read_samples(output[lb][x])
+
+                    if self.halt:
+                        return False
+                    # interface.ser.reset_input_buffer()
+            return True
+
+        def sweep_pipelined(output, depth):  # up to depth W/R pairs in flight, their replies come in order
+            steps = [(x, lb) for x in range(self.CR_STEPS) for lb in output]
+            sent = 0
+            for i, (x, lb) in enumerate(steps):
+                with timings.phase("write cr"):
+                    while sent < min(len(steps), i + depth):
+                        interface.send(f"W{format(steps[sent][0], '07b')}" + steps[sent][1])
+                        interface.send("R")
+                        sent += 1
+                    interface.read(until=Interface.TERMINATION_CHAR)
+                if not self.halt:
+                    read_samples(output[lb][x])
+                if self.halt:
+                    interface.interupt()  # drop the replies in flight
+                    return False
+            return True
+
+        def sweep_batched(output):  # one command, the device streams all CR steps for all channels
+            interface.send(self.batch_command(''.join(output)))
+            for x in range(self.CR_STEPS):
+                for lb in output:
+                    read_samples(output[lb][x])
+
+                    if self.halt:
+                        interface.interupt()  # drop the rest of the stream
+                        return False
+            return True
+
+        def read_steps(lb, crs):  # mean pulse count of some CR steps of one channel, None if halted
+            step = self.batch_step(crs)
+            if step is not None:
+                interface.send(self.batch_command(lb, crs[0], crs[-1], step))
+                for x in crs:
+                    read_samples(output[lb][x])
+                    if self.halt:
+                        interface.interupt()
+                        return None
+            else:
+                for x in crs:
+                    with timings.phase("write cr"):
+                        interface.send(f"W{format(x, '07b')}" + lb)
+                        interface.read(until=Interface.TERMINATION_CHAR)
+                    interface.send("R")
+                    read_samples(output[lb][x])
+                    if self.halt:
+                        return None
+            return self.postprocess(output[lb][crs])
+
+        if self.capabilities is None:
+            self.capabilities = self.probe_capabilities(interface)
+            logger.LOG.emit(f"Firmware capabilities: {' '.join(sorted(self.capabilities)) or 'none'}", INFO)
+
+            if self.BINARY_READOUT in self.capabilities:
+                binary = vals.get('Readout', "ASCII") == "Binary" and self.set_readout(interface, True)
+                if not binary:
+                    self.set_readout(interface, False)
+                logger.LOG.emit(f"Readout: {'binary' if binary else 'ascii'}", INFO)
+        sweep = sweep_batched if self.BATCH_SWEEP in self.capabilities else sweep_per_step
+        interface.instrument(timings)
+
+        # logger.LOG.emit(f"Set CCO to {vals['CCO Resolution']}", INFO)
+        with timings.phase("set cco"):
+            interface.send(f"G{vals['CCO Resolution']}")
+            interface.read(until=Interface.TERMINATION_CHAR)
+        if self.halt:
+            interface.instrument(None)
+            self.reset_halt(logger)
+            return
+
+        n_sample = vals['Number of Samples']
+        # logger.LOG.emit(f"Set Number of Samples to {n_sample}", INFO)
+        with timings.phase("set samples"):
+            interface.send(f"S{n_sample}\0")
+            interface.read(until=Interface.TERMINATION_CHAR)
+        if self.halt:
+            interface.instrument(None)
+            self.reset_halt(logger)
+            return
+
+        repeats = vals['reps']
+        results = self.open_results(vals)
+        scheduler = self.start_scheduler(vals, logger)
+        output = self.sample_buffers(vals)
+        searches = None
+
+        sweep_time, sweeps = 0, 0
+        writer = self.open_writer(kwargs['output_name'], vals, results) if kwargs.get('output_name', None) else None
+        try:
+            if vals['Measurment Type'] == "Capacitance Sweep":
+                searches = self.adaptive_searches(vals, lambda lb: partial(read_steps, lb))
+
+                done_reps = 0  # the scheduler may skip slots, full sweeps are counted by repetitions actually read
+                for rep, started in scheduler.repetitions(repeats, lambda: self.halt):
+                    time0 = time.time()
+                    rep_start = time.perf_counter_ns()
+
+                    full = self.is_full_sweep(vals, searches, done_reps)
+                    done_reps += 1
+                    found = None
+                    with timings.phase("readout"):
+                        if full:
+                            done = sweep(output)
+                        else:
+                            found = OrderedDict([(lb, search.search()) for lb, search in searches.items()])
+                            done = None not in found.values()
+                    if not done:
+                        self.reset_halt(logger)
+                        return
+                    if full:
+                        sweep_time += time.time() - time0
+                        sweeps += 1
+
+                    with timings.phase("postprocess"):
+                        row = self.sweep_row(vals, output, started, logger, searches, found)
+                    with timings.phase("save"):
+                        self.save_row(vals, output, row, writer, measured=full)
+                    timings.record("repetition", time.perf_counter_ns() - rep_start)
+
+            elif vals["Measurment Type"] == "Fixed Refrence":
+                refrences = self.fixed_refrences(vals)
+
+                for rep, started in scheduler.repetitions(repeats, lambda: self.halt):
+                    rep_start = time.perf_counter_ns()
+
+                    for lb in output:
+                        with timings.phase("write cr"):
+                            interface.send(f"W{format(refrences[lb], '07b')}" + lb)
+                            interface.read(until=Interface.TERMINATION_CHAR)
+                        if self.halt:
+                            self.reset_halt(logger)
+                            return
+
+                        interface.send("R")
+                        read_samples(output[lb][0])
+
+                        if self.halt:
+                            self.reset_halt(logger)
+                            return
+                        # interface.ser.reset_input_buffer()
+                    timings.record("readout", time.perf_counter_ns() - rep_start)
+
+                    with timings.phase("postprocess"):
+                        row = self.fixed_row(output, started)
+                    with timings.phase("save"):
+                        self.save_row(vals, output, row, writer)
+                    timings.record("repetition", time.perf_counter_ns() - rep_start)
+            if self.halt:  # halted while waiting for a slot
+                self.reset_halt(logger)
+                return
+            if searches is not None:
+                self.log_search(searches, logger)
+        except Exception as e:
+            if writer is None or e is not writer.error:
+                raise
+        finally:
+            interface.instrument(None)
+            if writer is not None:
+                self.close_writer(writer, logger)
+            if kwargs.get('output_name', None):
+                timings.save(kwargs['output_name'].replace("{channel}_", "") + "_timings.json")
+        if writer is not None and writer.error is not None:
+            self.reset_halt()
+            return
+
+        if kwargs.get('save_config', True):
+            self.save_last_config(vals)
+
+        if kwargs.get('finish_query', True):
+            time.sleep(2)
+            self.reset_halt()
+
+            if "repetition" in timings:
+                logger.LOG.emit(f"Average time = {timings['repetition'].mean / 1e9:.3f} s "
+                                f"(p99 {timings['repetition'].percentile(99) / 1e9:.3f} s)", INFO)
+            if sweeps:
+                logger.LOG.emit(f"Sweep throughput = {sweeps / sweep_time:.3f} sweeps/s "
+                                f"({'batched' if sweep is sweep_batched else 'per step'})", INFO)
+            logger.LOG.emit("Query finished!", INFO)
+
+    def open_writer(self, output_name: str, vals: dict, results: ResultStore) -> OutputWriter:
+        """
+        :param output_name: output path without extension, with a {channel} placeholder
+        """
+        adaptive = vals['Measurment Type'] == "Capacitance Sweep" and self.adaptive_searches(vals) is not None
+        if vals.get('Output Format', "CSV") in ("Archive", "Compressed"):  # the result rows and the raw samples, like csv
+            steps = self.CR_STEPS if vals['Measurment Type'] == "Capacitance Sweep" else 1
+            dtype = np.dtype([(name, results.dtype().fields[name][0]) for name in results.channels()] +
+                             [(chan, np.int32, (steps, vals['Number of Samples'])) for chan in vals['Measurment Channel'].split('&')] +
+                             ([(OutputWriter.MEASURED, np.bool_)] if adaptive else []))
+            if vals['Output Format'] == "Archive":
+                return ArchiveWriter(output_name.replace("{channel}_", "") + archive.EXTENSION, vals, self.XLABELS, dtype)
+            return chunked.ChunkedWriter(output_name.replace("{channel}_", "") + chunked.EXTENSION, vals, self.XLABELS, dtype)
+        return OutputWriter(output_name + ".csv", flag_measured=adaptive)
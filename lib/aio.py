@@ -0,0 +1,714 @@
+"""
+asyncio variant of the interface api and of the CIMOS query, so one event loop drives many boards:
+a board costs a reader on its file descriptor instead of a thread blocked in read.
+python -m lib.aio config.json /dev/ttyACM0 /dev/ttyACM1 ... runs the query of config.json on all ports at once.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import threading
+from abc import ABC, abstractmethod
+from functools import partial
+from collections import OrderedDict, deque
+
+import serial
+
+from .log_level import *
+from .interfaces import Interface, Serial
+from .codec import decode_frame
+from .timing import Timings
+from .acquisition import CimosAcquisition
+
+SAMPLE_TIMEOUT = 10.0  # seconds without a sample frame before a board counts as dead
+
+
+class AsyncInterface(ABC):
+    """
+    Interface api for an event loop, the methods which wait are coroutines.
+    One task reads an interface at a time, frames are the ones of Interface.find_frame.
+    """
+
+    def __init__(self):
+        self.status = Interface.NOT_CONNECTED
+        self.timeout = 1  # seconds read() waits for a reply
+
+    @abstractmethod
+    async def open(self, **kwargs):
+        """
+        initiate connection
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def send(self, command: str):
+        pass
+
+    @abstractmethod
+    async def interupt(self):
+        """
+        Drop what was received so far and what is still arriving
+        """
+        pass
+
+    @abstractmethod
+    async def read_frame(self, timeout=None):
+        """
+        Wait for a whole frame
+        :param timeout: seconds to wait, None to wait until the frame arrives
+        :return: frame bytes without the termination char, None on timeout
+        :raise ConnectionError: when the connection is lost
+        """
+        pass
+
+    def is_connected(self) -> bool:
+        return self.status == Interface.CONNECTED
+
+    async def read(self, timeout=None):
+        """
+        The reply to a command, like Interface.read(until=TERMINATION_CHAR)
+        :param timeout: seconds, self.timeout by default
+        :return: the frame with its termination char, "" on timeout
+        """
+        o = await self.read_frame(self.timeout if timeout is None else timeout)
+        if o is None:
+            return ""
+        o += Interface.TERMINATION_CHAR
+        try:
+            o = o.decode()
+        except UnicodeDecodeError:
+            pass
+        return o
+
+    def instrument(self, timings):
+        """
+        Record the duration of every send, read and read_frame of this interface
+        :param timings: lib.timing.Timings, None to stop recording
+        """
+        for name in ["send", "read", "read_frame"]:
+            self.__dict__.pop(name, None)
+            if timings is not None:
+                setattr(self, name, timings.timed_async(name.replace('_', ' '), getattr(self, name)))
+
+
+class AsyncSerial(AsyncInterface):
+    """
+    Serial port on a non-blocking file descriptor, pyserial only opens and configures it.
+    The loop calls a reader when bytes arrive, which splits them into frames. When FRAME_QUEUE_SIZE frames
+    wait unread the reader pauses, so the board is throttled by the driver buffers instead of memory growing.
+    """
+    READ_CHUNK = 4096
+    FRAME_QUEUE_SIZE = 1024
+    INTERRUPT_QUIET = Serial.INTERRUPT_QUIET  # seconds without incoming bytes before an interrupt is done
+
+    def __init__(self):
+        super(AsyncSerial, self).__init__()
+        self.ser = None
+        self.settings = None
+
+        self._loop = None
+        self._fd = None
+        self._rx = bytearray()  # received bytes which are not a whole frame yet
+        self._frames = deque()
+        self._waiter = None  # future of the task waiting in read_frame
+        self._error = None  # raised by read_frame once the queued frames are read
+        self._paused = False
+
+    async def open(self, port, boud=115200, timeout=1, **kwargs):
+        """
+        :param kwargs: the other Serial.settings, ignored
+        """
+        self._loop = asyncio.get_running_loop()
+        self.ser = serial.Serial(port=port, baudrate=boud, timeout=0)
+        self._fd = self.ser.fileno()
+        os.set_blocking(self._fd, False)
+        self.timeout = timeout
+        self.settings = {"port": port, "boud": boud, "timeout": timeout}
+        self._rx.clear()
+        self._frames.clear()
+        self._error = None
+        self._paused = False
+        self._loop.add_reader(self._fd, self._on_readable)
+        self.status = Interface.CONNECTED
+
+    async def close(self):
+        if self._fd is None:
+            return
+        self._loop.remove_reader(self._fd)
+        self._fd = None
+        self.ser.close()
+        self.status = Interface.DISCONNECTED
+        self._fail(ConnectionError(f"{self.settings['port']} closed"))
+
+    async def send(self, command: str):
+        view = memoryview(command.encode())
+        while view:
+            if self._fd is None:
+                raise ConnectionError("port is not open")
+            try:
+                view = view[os.write(self._fd, view):]
+            except BlockingIOError:  # driver buffer full, wait until it drains
+                await self._writable()
+
+    async def interupt(self):
+        if self._fd is not None and self.status == Interface.CONNECTED:
+            if not self._paused:
+                self._loop.remove_reader(self._fd)
+                self._paused = True
+            self.ser.reset_input_buffer()
+            while True:  # like Serial._drain_port, the board may still be streaming the rest of a B command
+                await asyncio.sleep(self.INTERRUPT_QUIET)
+                if not self.ser.in_waiting:
+                    break
+                self.ser.reset_input_buffer()
+        self._rx.clear()
+        self._frames.clear()
+        self._resume()
+
+    async def read_frame(self, timeout=None):
+        if not self._frames:
+            if self._error is not None:
+                raise self._error
+            self._waiter = self._loop.create_future()
+            timer = self._loop.call_later(timeout, self._wake) if timeout is not None else None
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+                if timer is not None:
+                    timer.cancel()
+            if not self._frames:
+                if self._error is not None:
+                    raise self._error
+                return None
+        frame = self._frames.popleft()
+        if self._paused and len(self._frames) <= self.FRAME_QUEUE_SIZE // 2:
+            self._resume()
+        return frame
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._frames)
+
+    def _on_readable(self):
+        try:
+            chunk = os.read(self._fd, self.READ_CHUNK)
+        except BlockingIOError:
+            return
+        except OSError:  # unplugged
+            chunk = b''
+        if not chunk:
+            self._loop.remove_reader(self._fd)
+            self.status = Interface.DISCONNECTED
+            self._fail(ConnectionError(f"{self.settings['port']} disconnected"))
+            return
+
+        start = 0
+        self._rx += chunk
+        found = Interface.find_frame(self._rx)
+        while found is not None:
+            self._frames.append(bytes(self._rx[start:found[0]]))
+            start = found[1]
+            found = Interface.find_frame(self._rx, start)
+        if start:
+            del self._rx[:start]
+            self._wake()
+            if len(self._frames) >= self.FRAME_QUEUE_SIZE:
+                self._loop.remove_reader(self._fd)
+                self._paused = True
+
+    def _resume(self):
+        if self._paused and self._fd is not None:
+            self._loop.add_reader(self._fd, self._on_readable)
+        self._paused = False
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _fail(self, error: Exception):
+        self._error = error
+        self._wake()
+
+    async def _writable(self):
+        future = self._loop.create_future()
+        self._loop.add_writer(self._fd, lambda: future.done() or future.set_result(None))
+        try:
+            await future
+        finally:
+            if self._fd is not None:
+                self._loop.remove_writer(self._fd)
+
+
+class BlockingInterface(Interface):
+    """
+    Interface over an AsyncInterface for the blocking query code in a thread other than the loop's,
+    every call waits for its coroutine on the loop
+    """
+
+    def __init__(self, interface: AsyncInterface, loop):
+        super(BlockingInterface, self).__init__()
+        self.interface = interface
+        self.loop = loop
+        self.status = interface.status
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def open(self, **kwargs):
+        return self._call(self.interface.open(**kwargs))
+
+    def close(self):
+        self._call(self.interface.close())
+
+    def send(self, command):
+        self._call(self.interface.send(command))
+
+    def interupt(self):
+        self._call(self.interface.interupt())
+
+    def is_connected(self) -> bool:
+        return self.interface.is_connected()
+
+    @staticmethod
+    def list_available_devices() -> list:
+        return []
+
+    def get_widget(self):
+        return None
+
+    def read(self, **kwargs):
+        return self._call(self.interface.read())
+
+    def read_frame(self, timeout=None):
+        return self._call(self.interface.read_frame(timeout))
+
+
+async def in_thread(fn, *args):
+    """
+    Run blocking fn(*args) in a daemon thread, so a stuck call can't keep the interpreter from exiting
+    :return: its result
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run():
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            loop.call_soon_threadsafe(settle, None, e)
+        else:
+            loop.call_soon_threadsafe(settle, result, None)
+    threading.Thread(target=run, daemon=True).start()
+    return await future
+
+
+async def calibrate(device: CimosAcquisition, interface: AsyncInterface, vals: dict, logger) -> dict:
+    """
+    device.calibrate() on an AsyncInterface. The pre-sweeps are short and mostly cached,
+    so the blocking code runs as is in a thread, through a BlockingInterface.
+    """
+    bridge = BlockingInterface(interface, asyncio.get_running_loop())
+    try:
+        return await in_thread(device.calibrate, bridge, vals, logger)
+    except asyncio.CancelledError:
+        device.halt = True  # ends the pre-sweeps at their next halt check
+        raise
+
+
+async def probe_capabilities(device: CimosAcquisition, interface: AsyncInterface) -> set:
+    """
+    CimosAcquisition.probe_capabilities on an AsyncInterface
+    """
+    await interface.send(device.CAPABILITY_COMMAND)
+    o = await interface.read()
+    if not isinstance(o, str) or not o.endswith(Interface.TERMINATION_CHAR.decode()):
+        return set()
+    return set(o.strip(Interface.TERMINATION_CHAR.decode())) - set(', \r\n')
+
+
+async def set_readout(device: CimosAcquisition, interface: AsyncInterface, binary: bool) -> bool:
+    await interface.send(f"{device.BINARY_READOUT}{int(binary)}")
+    return await interface.read() == Interface.TERMINATION_CHAR.decode()
+
+
+async def run_query(device: CimosAcquisition, interface: AsyncInterface, vals: dict, logger, output_name: str = None) -> bool:
+    """
+    CimosAcquisition.run_query on an AsyncInterface, with the same results, timings and output files.
+    Only the interface io differs, the rest is shared with it through the CimosAcquisition helpers.
+    vals come calibrated, see calibrate().
+    device.halt stops the query at the next frame or slot, cancelling the task stops it right away.
+    The caller resets device.halt and saves the config.
+    :return: False if halted or the output could not be written
+    :raise TimeoutError: if no sample frame came for SAMPLE_TIMEOUT
+    """
+    timings = device.timings = Timings()
+
+    async def read_samples(row):  # waits for the samples or until the query is halted
+        o = None
+        waited = 0
+        with timings.phase("wait for data"):
+            while o is None and not device.halt:
+                if waited >= SAMPLE_TIMEOUT:
+                    raise TimeoutError(f"no samples for {SAMPLE_TIMEOUT} s")
+                o = await interface.read_frame(timeout=device.FRAME_POLL)
+                waited += device.FRAME_POLL
+        if o is not None:
+            with timings.phase("parse"):
+                try:
+                    decode_frame(o, out=row)
+                except ValueError as e:  # corrupt frame, stop like CimosAcquisition.run_query does
+                    logger.LOG.emit(f"Bad sample frame, stopping the query: {e}", ERROR)
+                    await interface.interupt()
+                    device.halt = True
+
+    async def sweep_per_step(output):  # W/R round trip for every CR step and channel
+        depth = getattr(interface, 'pipeline_depth', 1)
+        if depth > 1:
+            return await sweep_pipelined(output, depth)
+        for x in range(device.CR_STEPS):
+            for lb in output:
+                with timings.phase("write cr"):
+                    await interface.send(f"W{format(x, '07b')}" + lb)
+                    await interface.read()
+                if device.halt:
+                    return False
+
+                await interface.send("R")
+                await read_samples(output[lb][x])
+
+                if device.halt:
+                    return False
+        return True
+
+    async def sweep_pipelined(output, depth):  # up to depth W/R pairs in flight, their replies come in order
+        steps = [(x, lb) for x in range(device.CR_STEPS) for lb in output]
+        sent = 0
+        for i, (x, lb) in enumerate(steps):
+            with timings.phase("write cr"):
+                while sent < min(len(steps), i + depth):
+                    await interface.send(f"W{format(steps[sent][0], '07b')}" + steps[sent][1])
+                    await interface.send("R")
+                    sent += 1
+                await interface.read()
+            if not device.halt:
+                await read_samples(output[lb][x])
+            if device.halt:
+                await interface.interupt()  # drop the replies in flight
+                return False
+        return True
+
+    async def sweep_batched(output):  # one command, the device streams all CR steps for all channels
+        await interface.send(device.batch_command(''.join(output)))
+        for x in range(device.CR_STEPS):
+            for lb in output:
+                await read_samples(output[lb][x])
+
+                if device.halt:
+                    await interface.interupt()  # drop the rest of the stream
+                    return False
+        return True
+
+    async def read_steps(lb, crs):  # mean pulse count of some CR steps of one channel, None if halted
+        step = device.batch_step(crs)
+        if step is not None:
+            await interface.send(device.batch_command(lb, crs[0], crs[-1], step))
+            for x in crs:
+                await read_samples(output[lb][x])
+                if device.halt:
+                    await interface.interupt()
+                    return None
+        else:
+            for x in crs:
+                with timings.phase("write cr"):
+                    await interface.send(f"W{format(x, '07b')}" + lb)
+                    await interface.read()
+                await interface.send("R")
+                await read_samples(output[lb][x])
+                if device.halt:
+                    return None
+        return device.postprocess(output[lb][crs])
+
+    if device.capabilities is None:
+        device.capabilities = await probe_capabilities(device, interface)
+        logger.LOG.emit(f"Firmware capabilities: {' '.join(sorted(device.capabilities)) or 'none'}", INFO)
+
+        if device.BINARY_READOUT in device.capabilities:
+            binary = vals.get('Readout', "ASCII") == "Binary" and await set_readout(device, interface, True)
+            if not binary:
+                await set_readout(device, interface, False)
+            logger.LOG.emit(f"Readout: {'binary' if binary else 'ascii'}", INFO)
+    sweep = sweep_batched if device.BATCH_SWEEP in device.capabilities else sweep_per_step
+
+    interface.instrument(timings)
+    try:
+        with timings.phase("set cco"):
+            await interface.send(f"G{vals['CCO Resolution']}")
+            await interface.read()
+        with timings.phase("set samples"):
+            await interface.send(f"S{vals['Number of Samples']}\0")
+            await interface.read()
+        if device.halt:
+            logger.LOG.emit("Stopping Query", WARNING)
+            return False
+
+        results = device.open_results(vals)
+        scheduler = device.start_scheduler(vals, logger)
+        output = device.sample_buffers(vals)
+        searches = device.adaptive_searches(vals) if vals['Measurment Type'] == "Capacitance Sweep" else None
+        refrences = device.fixed_refrences(vals) if vals['Measurment Type'] == "Fixed Refrence" else None
+
+        done_reps = 0  # the scheduler may skip slots, full sweeps are counted by repetitions actually read
+        writer = device.open_writer(output_name, vals, results) if output_name else None
+        try:
+            async for rep, started in scheduler.async_repetitions(vals['reps'], lambda: device.halt):
+                rep_start = time.perf_counter_ns()
+                if refrences is None:
+                    full = device.is_full_sweep(vals, searches, done_reps)
+                    done_reps += 1
+                    found = None
+                    with timings.phase("readout"):
+                        if full:
+                            done = await sweep(output)
+                        else:
+                            found = OrderedDict()
+                            for lb, search in searches.items():
+                                found[lb] = await search.search_async(partial(read_steps, lb))
+                            done = None not in found.values()
+                else:
+                    full = done = True
+                    for lb in output:
+                        with timings.phase("write cr"):
+                            await interface.send(f"W{format(refrences[lb], '07b')}" + lb)
+                            await interface.read()
+                        await interface.send("R")
+                        await read_samples(output[lb][0])
+                        if device.halt:
+                            done = False
+                            break
+                    timings.record("readout", time.perf_counter_ns() - rep_start)
+                if not done:
+                    break
+
+                with timings.phase("postprocess"):
+                    if refrences is None:
+                        row = device.sweep_row(vals, output, started, logger, searches, found)
+                    else:
+                        row = device.fixed_row(output, started)
+                with timings.phase("save"):
+                    device.save_row(vals, output, row, writer, measured=full)
+                timings.record("repetition", time.perf_counter_ns() - rep_start)
+        except Exception as e:
+            if writer is None or e is not writer.error:
+                raise
+        finally:
+            if writer is not None:
+                device.close_writer(writer, logger)
+            if output_name:
+                timings.save(output_name.replace("{channel}_", "") + "_timings.json")
+    finally:
+        interface.instrument(None)
+
+    if writer is not None and writer.error is not None:
+        return False
+    if device.halt:
+        logger.LOG.emit("Stopping Query", WARNING)
+        return False
+    if searches is not None:
+        device.log_search(searches, logger)
+    if "repetition" in timings:
+        logger.LOG.emit(f"Average time = {timings['repetition'].mean / 1e9:.3f} s "
+                        f"(p99 {timings['repetition'].percentile(99) / 1e9:.3f} s)", INFO)
+    logger.LOG.emit("Query finished!", INFO)
+    return True
+
+
+async def handover(device, interface: Interface, vals: dict, logger, output_name: str):
+    """
+    Run a query of a gui device on the loop: its Serial is closed meanwhile and reopened when
+    the query is over, like AcquisitionProcess does. Ends with device.reset_halt(), which tells the gui.
+    """
+    settings = interface.settings
+    interface.close()
+    port = AsyncSerial()
+    try:
+        await port.open(**settings)
+        vals = await calibrate(device, port, vals, logger)
+        device.halt = False  # a stop during the pre-sweeps was reset by them
+        if await run_query(device, port, vals, logger, output_name):
+            device.save_last_config(vals)
+    except Exception as e:
+        logger.LOG.emit(f"{type(e).__name__}: {e}", ERROR)
+    finally:
+        await port.close()
+        try:
+            interface.open_port(**settings)
+        except Exception as e:
+            logger.LOG.emit(e, ERROR)
+        device.reset_halt()
+
+
+class LoopThread(threading.Thread):
+    """
+    Event loop in a daemon thread, for a caller which runs another loop, e.g. the Qt gui.
+    submit() schedules a coroutine from any thread.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True, name="asyncio loop")
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """
+        :return: concurrent.futures.Future of the coroutine, cancel() cancels its task
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join()
+        self.loop.close()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_loop() -> LoopThread:
+    """
+    The loop thread all devices of the gui share, started on first use
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = LoopThread()
+            _shared.start()
+        return _shared
+
+
+async def run_board(port: str, vals: dict, args) -> tuple:
+    """
+    One board of main(): open, calibrate and query it
+    :return: (exit code, stats)
+    """
+    from .cli import PrintLog, TimedStore, stats, EXIT_OK, EXIT_FAILED, EXIT_CONFIG, EXIT_PORT, EXIT_INCOMPLETE, EXIT_INTERRUPTED
+
+    logger = PrintLog(args.quiet, prefix=f"[{port}] ")
+    device = CimosAcquisition(f"{args.name}_{os.path.basename(port)}")
+    vals = device.complete_vals(dict(vals), logger)
+    if not vals['reps']:
+        return EXIT_CONFIG, {}
+    device.vals = vals
+
+    interface = AsyncSerial()
+    try:
+        await interface.open(port, args.boud, args.timeout)
+    except Exception as e:
+        logger.LOG.emit(e, ERROR)
+        return EXIT_PORT, {}
+
+    code = EXIT_OK
+    started = time.monotonic()
+    try:
+        vals = await calibrate(device, interface, vals, logger)
+        device.RESULT_STORE = TimedStore
+        started = time.monotonic()
+        await asyncio.wait_for(run_query(device, interface, vals, logger, device.output_name(vals, args.output_dir)),
+                               args.query_timeout)
+    except asyncio.TimeoutError:
+        logger.LOG.emit(f"query timed out after {args.query_timeout} s", ERROR)
+        code = EXIT_INCOMPLETE
+    except asyncio.CancelledError:  # interrupted, the stats of the repetitions so far still count
+        code = EXIT_INTERRUPTED
+    except Exception as e:
+        logger.LOG.emit(f"{type(e).__name__}: {e}", ERROR)
+        code = EXIT_FAILED
+    finally:
+        finished = time.monotonic()
+        await interface.close()
+
+    res = stats(device, vals, started, finished)
+    res["errors"] = logger.errors
+    if code == EXIT_OK and res["repetitions"] + res.get("skipped", 0) < res["planned"]:
+        code = EXIT_INCOMPLETE
+    return code, res
+
+
+async def run_boards(ports: list, vals: dict, args) -> list:
+    """
+    Run the query on all ports at once, on the running loop. SIGINT and SIGTERM cancel every board.
+    :return: (exit code, stats) per port
+    """
+    loop = asyncio.get_running_loop()
+    tasks = [asyncio.ensure_future(run_board(port, vals, args)) for port in ports]
+
+    def on_interrupt():
+        for task in tasks:
+            task.cancel()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, on_interrupt)
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+
+
+def main(argv=None) -> int:
+    from .cli import PrintLog, load_config, EXIT_CONFIG
+
+    parser = argparse.ArgumentParser(description="Run a query on many devices at once, from one event loop")
+    parser.add_argument("config", help="json file with the query values, same keys as the .cfg files")
+    parser.add_argument("ports", nargs='+', help="serial ports of the devices")
+    parser.add_argument("--boud", type=int, default=115200)
+    parser.add_argument("--timeout", type=int, default=1, help="seconds to wait for a reply")
+    parser.add_argument("--query-timeout", type=float, default=None, help="seconds a query may take, none by default")
+    parser.add_argument("--name", default="CimosDevice", help="device name, the port is appended")
+    parser.add_argument("--output-dir", default=None, help="outputs/ of the repository by default")
+    parser.add_argument("--stats", default=None, help="also write the stats of all ports to this json file")
+    parser.add_argument("--quiet", action="store_true", help="only log warnings and errors")
+    args = parser.parse_args(argv)
+
+    try:
+        vals = load_config(args.config)
+    except (OSError, ValueError, TypeError) as e:
+        PrintLog().LOG.emit(f"invalid config {args.config}: {e}", ERROR)
+        return EXIT_CONFIG
+
+    started = time.monotonic()
+    res = asyncio.run(run_boards(args.ports, vals, args))
+    elapsed = time.monotonic() - started
+
+    print(f"{'port':>16} {'exit':>5} {'reps':>10} {'reps/s':>8} {'errors':>7}")
+    for port, (code, board) in zip(args.ports, res):
+        print(f"{port:>16} {code:>5} {board.get('repetitions', 0):>5}/{board.get('planned', 0):<4} "
+              f"{board.get('repetitions_per_second', 0):>8.2f} {board.get('errors', 0):>7}")
+    print(f"{len(args.ports)} boards in {elapsed:.2f} s")
+    if args.stats:
+        with open(args.stats, 'w') as stats_file:
+            json.dump({port: dict(board, exit=code) for port, (code, board) in zip(args.ports, res)}, stats_file, indent=2)
+    return max(code for code, _ in res)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Threshold crossings of capacitance sweeps, a whole (reps, CR steps) matrix at a time.
+Used by the query loop for every sweep and offline to reprocess stored runs, e.g. with another level:
+python -m lib.analysis run.biosa --level 35 --output cide.csv
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+
+CHUNK = 1 << 16  # sweeps per block, bounds the temporaries
+
+
+def crossings(sweeps: np.ndarray, level) -> np.ndarray:
+    """
+    Where every sweep first falls to level, interpolated between the CR steps around it
+    :param sweeps: (reps, steps) pulse counts, or one (steps,) sweep
+    :param level: one level for all sweeps, or one per sweep
+    :return: (reps,) CR steps, 0 for a sweep which starts below level, the last step for one which never gets there
+    """
+    sweeps = np.atleast_2d(sweeps)
+    reps, steps = sweeps.shape
+    levels = np.broadcast_to(np.asarray(level, dtype=np.float64), (reps,))
+    res = np.empty(reps)
+    for start in range(0, reps, CHUNK):
+        block, lv = sweeps[start:start + CHUNK], levels[start:start + CHUNK]
+        rows = np.arange(len(block))
+        below = block <= lv[:, None]
+        r = below.argmax(axis=1)
+        cur, prev = block[rows, r], block[rows, r - 1]  # prev wraps around for r == 0, masked below
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = (1 / (cur - prev)) * (lv - prev) + (r - 1)
+        x[r == 0] = 0
+        x[~below[rows, r]] = steps - 1
+        res[start:start + CHUNK] = x
+    return res
+
+
+def refrences(sweeps: np.ndarray) -> tuple:
+    """
+    Auto refrence of every sweep: the step where it falls half way from its maximum to the minimum after it
+    :param sweeps: (reps, steps) pulse counts, or one (steps,) sweep
+    :return: (reps,) refrence steps, (reps,) steps of the maxima and (reps,) bool, False where the sweep
+    never fell to half way (the refrence is the last step then)
+    """
+    sweeps = np.atleast_2d(sweeps)
+    reps, steps = sweeps.shape
+    refs = np.empty(reps, dtype=np.int64)
+    peaks = np.empty(reps, dtype=np.int64)
+    found = np.empty(reps, dtype=bool)
+    for start in range(0, reps, CHUNK):
+        block = sweeps[start:start + CHUNK]
+        rows = np.arange(len(block))
+        peak = block.argmax(axis=1)
+        after = np.arange(steps, dtype=np.int32) >= peak.astype(np.int32)[:, None]
+        low = block.min(axis=1)  # the minimum after the peak is mostly the global one
+        early = block.argmin(axis=1) < peak
+        if early.any():
+            low[early] = np.where(after[early], block[early], np.iinfo(block.dtype).max).min(axis=1)
+        y = (block[rows, peak] + low) // 2
+        below = after & (block <= y[:, None])
+        r = below.argmax(axis=1)
+        cur, prev = block[rows, r], block[rows, r - 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = np.floor((1 / (cur - prev)) * (y - prev) + (r - 1 - peak)) + peak  # from the peak, a float sum rounds differently
+        x[r == peak] = peak[r == peak]
+        ok = below[rows, r]
+        x[~ok] = steps - 1
+        refs[start:start + CHUNK], peaks[start:start + CHUNK], found[start:start + CHUNK] = x, peak, ok
+    return refs, peaks, found
+
+
+def capacitance(cr, xlabels: list) -> np.ndarray:
+    """
+    Map (fractional) CR steps to capacitance through the xlabels table, linear between the steps
+    """
+    return np.interp(cr, np.arange(len(xlabels)), xlabels)
+
+
+def load_sweeps(path: str, channel: str = "Right"):
+    """
+    Sweeps of one channel of a stored run: an archive (.biosa), a compressed archive (.biosaz),
+    or the csv of the channel's raw samples. Searched repetitions of adaptive runs are left out, their curves are interpolated
+    :return: (reps, steps) pulse counts, the index of each sweep in the run, the vals of the run (empty for csv), xlabels
+    """
+    from .acquisition import CimosAcquisition
+    from .archive import RunArchive, EXTENSION
+    from .chunked import ChunkedArchive, EXTENSION as CHUNKED_EXTENSION
+    from .writer import OutputWriter
+
+    bit = CimosAcquisition.CHANNEL_BITS[channel]
+    if path.endswith(EXTENSION) or path.endswith(CHUNKED_EXTENSION):
+        run = RunArchive(path) if path.endswith(EXTENSION) else ChunkedArchive(path)
+        try:
+            sweeps = np.asarray(run.channel(bit))
+            reps = np.arange(len(sweeps))
+            if OutputWriter.MEASURED in run.channels():
+                reps = np.flatnonzero(run.channel(OutputWriter.MEASURED))
+                sweeps = sweeps[reps]
+            return sweeps, reps, run.vals, run.header['xlabels']
+        finally:
+            if isinstance(run, ChunkedArchive):
+                run.close()
+    raw = np.loadtxt(path, delimiter=',', dtype=np.int32, ndmin=2)
+    steps = CimosAcquisition.CR_STEPS
+    sweeps = CimosAcquisition.postprocess(raw.reshape(len(raw) * steps, -1)).reshape(len(raw), steps)
+    return sweeps, np.arange(len(sweeps)), {}, CimosAcquisition.XLABELS
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Recompute the cide crossings of a stored run")
+    parser.add_argument("run", help=".biosa, .biosaz or the raw csv of the channel")
+    parser.add_argument("--channel", default="Right")
+    parser.add_argument("--level", type=float, default=None, help="pulse count to cross, the refrence pulse of the run by default")
+    parser.add_argument("--output", default=None, help="csv of repetition, CR step and capacitance, stdout by default")
+    args = parser.parse_args(argv)
+
+    sweeps, reps, vals, xlabels = load_sweeps(args.run, args.channel)
+    level = args.level if args.level is not None else vals.get('refrence_pulse')
+    if level is None:
+        print(f"{args.run} has no refrence pulse, pass --level", file=sys.stderr)
+        return 2
+
+    t0 = time.perf_counter()
+    cr = crossings(sweeps, level)
+    elapsed = time.perf_counter() - t0
+    table = np.column_stack([reps, cr, capacitance(cr, xlabels)])
+    np.savetxt(args.output if args.output else sys.stdout, table, fmt=['%d', '%.4f', '%.4f'], delimiter=',',
+               header="rep,cr,capacitance", comments='')
+    print(f"{len(cr)} sweeps at level {level:.2f} in {elapsed * 1e3:.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
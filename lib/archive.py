@@ -0,0 +1,159 @@
+import os
+import json
+import struct
+from datetime import datetime
+
+import numpy as np
+
+from .writer import OutputWriter
+
+# file layout: MAGIC, uint32 version, uint32 header size, json header (padded), fixed size repetition records
+MAGIC = b'BIOSARUN'
+VERSION = 1
+PREAMBLE = struct.Struct('<8sII')
+ALIGNMENT = 64
+EXTENSION = '.biosa'
+
+
+def record_dtype(channels: list) -> np.dtype:
+    """
+    :param channels: [(name, dtype, shape)] as stored in the header
+    :return: dtype of one repetition record, one field per channel
+    """
+    return np.dtype([(name, np.dtype(dtype), tuple(shape)) for name, dtype, shape in channels])
+
+
+def calibration(vals: dict) -> dict:
+    return {k: v for k, v in vals.items() if k == 'refrence_pulse' or k.endswith('_refrence')}
+
+
+def make_header(vals: dict, xlabels: list, dtype: np.dtype) -> dict:
+    return {
+        "created": datetime.now().isoformat(),
+        "vals": vals,
+        "calibration": calibration(vals),
+        "xlabels": list(xlabels),
+        "channels": [(name, dtype.fields[name][0].base.str, dtype.fields[name][0].shape) for name in dtype.names],
+    }
+
+
+def fill_record(record: np.ndarray, raw: dict, row: dict, measured: bool):
+    """
+    Fill one repetition record, the raw fields of a searched repetition stay zero and its measured field False
+    """
+    for name in record.dtype.names:
+        if name == OutputWriter.MEASURED:
+            record[name] = measured
+        elif name in row:
+            record[name] = row[name]
+        elif measured:
+            record[name] = raw[name]
+        else:
+            record[name] = 0
+
+
+def _json_default(o):  # numpy scalars in vals
+    return o.tolist()
+
+
+def write_preamble(path: str, magic: bytes, header: dict, buffering: int):
+    """
+    Create the file and write magic, version and the json header
+    :return: the open file, positioned after the header
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    out = open(path, 'wb', buffering=buffering)
+    header = json.dumps(header, default=_json_default).encode()
+    header += b' ' * (-(PREAMBLE.size + len(header)) % ALIGNMENT)
+    out.write(PREAMBLE.pack(magic, VERSION, len(header)))
+    out.write(header)
+    return out
+
+
+def read_preamble(f, magic: bytes) -> dict:
+    """
+    :param f: file opened for binary reading, left positioned after the header
+    :return: the json header
+    """
+    found, version, header_size = PREAMBLE.unpack(f.read(PREAMBLE.size))
+    if found != magic:
+        raise ValueError(f"{f.name} is not a {magic.decode()} file")
+    if version > VERSION:
+        raise ValueError(f"{f.name} has version {version}, only {VERSION} is supported")
+    return json.loads(f.read(header_size))
+
+
+class ArchiveWriter(OutputWriter):
+    """
+    Appends repetitions to a run archive from the background writer thread.
+    One fixed size record per repetition, with a field per processed channel and per raw samples channel,
+    so every channel is a strided view of the memory map.
+    """
+
+    def __init__(self, path: str, vals: dict, xlabels: list, dtype: np.dtype, **kwargs):
+        self.path = path
+        self.dtype = dtype
+        self.header = make_header(vals, xlabels, dtype)
+        super(ArchiveWriter, self).__init__(path, **kwargs)
+
+    def write_repetition(self, raw: dict, row: dict, measured=True):
+        # packed here, the query overwrites its raw buffers on the next repetition
+        record = np.zeros((), dtype=self.dtype)
+        fill_record(record, raw, row, measured)
+        self.write(None, record)
+
+    def _file(self, channel):
+        if not self.files:
+            self.files[None] = write_preamble(self.path, MAGIC, self.header, self.FILE_BUFFER)
+        return self.files[None]
+
+    def _write_block(self, channel, record):
+        self._file(channel).write(record.tobytes())
+
+
+class RunArchive:
+    """
+    Reads a run archive through np.memmap, nothing is loaded until it is sliced
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.header = read_preamble(f, MAGIC)
+            offset = f.tell()
+
+        self.dtype = record_dtype(self.header['channels'])
+        reps = (os.path.getsize(path) - offset) // self.dtype.itemsize  # a torn last record is ignored
+        if reps:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=offset, shape=(reps,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    @property
+    def vals(self) -> dict:
+        return self.header['vals']
+
+    @property
+    def calibration(self) -> dict:
+        return self.header['calibration']
+
+    @property
+    def xlabels(self) -> list:
+        return self.header['xlabels']
+
+    def channels(self) -> list:
+        return list(self.dtype.names)
+
+    def __len__(self):
+        return len(self.records)
+
+    def channel(self, name: str, reps=slice(None), cr=slice(None)) -> np.ndarray:
+        """
+        Slice of one channel, e.g. channel('1', slice(1000, 2000), slice(10, 20))
+        :param reps: repetitions (index, slice or index array)
+        :param cr: CR steps, only for sweep channels
+        :return: memory mapped view (a copy for index arrays)
+        """
+        data = self.records[name][reps]
+        return data[..., cr] if self.dtype.fields[name][0].shape else data
@@ -0,0 +1,59 @@
+import json
+import os
+import time
+
+
+class CalibrationCache:
+    """
+    Results of the calibration pre-sweeps, kept in a json file so back to back queries skip them.
+    An entry holds the calibration value, when it was measured and a probe: one CR step and its pulse count
+    at calibration time, which a later query can read again to find out if the device drifted.
+    The file is read on every lookup and replaced atomically on every change,
+    so devices running in worker processes share it.
+    """
+    TTL = 3600  # seconds an entry stays valid
+
+    def __init__(self, path: str, ttl: float = TTL):
+        self.path = path
+        self.ttl = ttl
+
+    @staticmethod
+    def key(name: str, channel: str, cco: str, n_sample: int) -> str:
+        return f"{name}/{channel}/{cco}/{n_sample}"
+
+    def get(self, key: str):
+        """
+        :return: the entry, None if there is none or it expired
+        """
+        entry = self._load().get(key)
+        if entry is None or time.time() - entry['time'] > self.ttl:
+            return None
+        return entry
+
+    def put(self, key: str, value, probe: tuple = None):
+        """
+        :param probe: (CR step, pulse count) to check for drift later
+        """
+        entries = self._load()
+        entries[key] = {"value": value, "time": time.time(), "probe": list(probe) if probe is not None else None}
+        self._save(entries)
+
+    def invalidate(self, prefix: str = ""):
+        """
+        Drop the entries whose key starts with prefix, all by default
+        """
+        entries = self._load()
+        self._save({k: v for k, v in entries.items() if not k.startswith(prefix)})
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):  # none yet, or torn by a crash
+            return {}
+
+    def _save(self, entries: dict):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp, self.path)
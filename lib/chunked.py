@@ -0,0 +1,204 @@
+import os
+import zlib
+import lzma
+import struct
+
+import numpy as np
+
+from .writer import OutputWriter
+from .archive import make_header, write_preamble, read_preamble, record_dtype, fill_record
+
+# file layout: preamble + json header (see archive), chunks, index, trailer
+# chunk: CHUNK_HEADER (repetitions, compressed size) + compressed delta encoded records
+# index: INDEX_DTYPE entry per chunk, trailer: TRAILER (index offset, chunks, TRAILER_MAGIC)
+MAGIC = b'BIOSACHK'
+TRAILER_MAGIC = b'BIOSAIDX'
+EXTENSION = '.biosaz'
+CHUNK_HEADER = struct.Struct('<II')
+TRAILER = struct.Struct('<QI8s')
+INDEX_DTYPE = np.dtype([('first', '<u8'), ('reps', '<u4'), ('offset', '<u8'), ('size', '<u4')])
+
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=1), lzma.decompress),
+}
+
+
+def encode_chunk(records: np.ndarray) -> bytes:
+    """
+    Integer fields are delta encoded along the repetitions (first repetition kept as is) and zigzag mapped,
+    so small changes become small unsigned numbers. Every field is then byte shuffled (all lowest bytes first ...),
+    which leaves long runs of zero bytes for the compressor.
+    """
+    parts = []
+    for name in records.dtype.names:
+        field = np.ascontiguousarray(records[name])
+        size = field.dtype.itemsize
+        if field.dtype.kind in 'iu':
+            field = field.view(f'<i{size}')
+            delta = field.copy()
+            np.subtract(field[1:], field[:-1], out=delta[1:])  # wraps around, cumsum restores it exactly
+            field = (delta << 1) ^ (delta >> (8 * size - 1))
+        parts.append(field.view(np.uint8).reshape(-1, size).T.tobytes())
+    return b''.join(parts)
+
+
+def decode_chunk(data: bytes, dtype: np.dtype, reps: int) -> np.ndarray:
+    records = np.zeros(reps, dtype=dtype)
+    offset = 0
+    for name in dtype.names:
+        field_dtype, shape = dtype.fields[name][0].base, dtype.fields[name][0].shape
+        size = field_dtype.itemsize
+        count = reps * int(np.prod(shape, dtype=np.int64))
+        planes = np.frombuffer(data, dtype=np.uint8, count=count * size, offset=offset).reshape(size, count)
+        offset += count * size
+
+        field = planes.T.copy()
+        if field_dtype.kind in 'iu':
+            zigzag = field.view(f'<u{size}').reshape((reps,) + shape)
+            delta = (zigzag >> 1).view(f'<i{size}') ^ -(zigzag & 1).view(f'<i{size}')
+            field = np.cumsum(delta, axis=0, dtype=f'<i{size}')
+        records[name] = field.view(field_dtype).reshape((reps,) + shape)
+    return records
+
+
+class ChunkedWriter(OutputWriter):
+    """
+    Stores raw samples and processed rows of every repetition in compressed chunks of CHUNK_REPS repetitions,
+    with an index at the end of the file to reach any repetition without decompressing the others.
+    """
+    CHUNK_REPS = 64
+
+    def __init__(self, path: str, vals: dict, xlabels: list, dtype: np.dtype, codec='zlib', chunk_reps=CHUNK_REPS, **kwargs):
+        self.path = path
+        self.dtype = dtype
+        self.codec = codec
+        self.compress = CODECS[codec][0]
+        self.header = make_header(vals, xlabels, dtype)
+        self.header.update({"codec": codec, "chunk_reps": chunk_reps})
+
+        self.chunk = np.zeros(chunk_reps, dtype=dtype)
+        self.chunk_rows = 0
+        self.index = []
+        self.reps = 0
+        self.raw_size = 0  # uncompressed bytes, for the compression ratio
+        self.stored_size = 0
+        super(ChunkedWriter, self).__init__(path, **kwargs)
+
+    def write_repetition(self, raw: dict, row: dict, measured=True):
+        # the query reuses its raw buffers for the next repetition, copy before handing over
+        self.write(None, ({channel: block.copy() for channel, block in raw.items()} if measured else {}, row, measured))
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.raw_size / self.stored_size if self.stored_size else 0
+
+    def _file(self, channel):
+        if not self.files:
+            self.files[None] = write_preamble(self.path, MAGIC, self.header, self.FILE_BUFFER)
+        return self.files[None]
+
+    def _write_block(self, channel, block):
+        raw, row, measured = block
+        fill_record(self.chunk[self.chunk_rows], raw, row, measured)
+        self.chunk_rows += 1
+        if self.chunk_rows == len(self.chunk):
+            self._write_chunk()
+
+    def _write_chunk(self):
+        out = self._file(None)
+        data = self.compress(encode_chunk(self.chunk[:self.chunk_rows]))
+        self.index.append((self.reps, self.chunk_rows, out.tell(), len(data)))
+        out.write(CHUNK_HEADER.pack(self.chunk_rows, len(data)))
+        out.write(data)
+
+        self.reps += self.chunk_rows
+        self.raw_size += self.chunk_rows * self.dtype.itemsize
+        self.stored_size += len(data) + CHUNK_HEADER.size
+        self.chunk_rows = 0
+
+    def _finish(self):
+        if self.chunk_rows:
+            self._write_chunk()
+        out = self._file(None)
+        offset = out.tell()
+        out.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+        out.write(TRAILER.pack(offset, len(self.index), TRAILER_MAGIC))
+
+
+class ChunkedArchive:
+    """
+    Random access reader of ChunkedWriter files, a repetition costs one chunk decompression.
+    Files of interrupted runs have no index, their chunks are found by walking the chunk headers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.header = read_preamble(self._file, MAGIC)
+        self.dtype = record_dtype(self.header['channels'])
+        self.decompress = CODECS[self.header['codec']][1]
+        self.index = self._read_index()
+        self._cached = (None, None)  # last decoded chunk
+
+    def close(self):
+        self._file.close()
+
+    def __len__(self):
+        return int(self.index['first'][-1] + self.index['reps'][-1]) if len(self.index) else 0
+
+    @property
+    def vals(self) -> dict:
+        return self.header['vals']
+
+    def channels(self) -> list:
+        return list(self.dtype.names)
+
+    def repetition(self, rep: int) -> np.void:
+        """
+        :return: record of one repetition, fields as in channels()
+        """
+        if not 0 <= rep < len(self):
+            raise IndexError(f"repetition {rep} out of range")
+        chunk = int(np.searchsorted(self.index['first'], rep, side='right')) - 1
+        return self._chunk(chunk)[rep - int(self.index['first'][chunk])]
+
+    def channel(self, name: str, reps=slice(None)) -> np.ndarray:
+        """
+        :param reps: slice of repetitions, only the chunks it touches are decompressed
+        """
+        start, stop, step = reps.indices(len(self))
+        if start >= stop:
+            return np.zeros((0,) + self.dtype.fields[name][0].shape, dtype=self.dtype.fields[name][0].base)
+        first = int(np.searchsorted(self.index['first'], start, side='right')) - 1
+        last = int(np.searchsorted(self.index['first'], stop - 1, side='right')) - 1
+        data = np.concatenate([self._chunk(c)[name] for c in range(first, last + 1)])
+        return data[start - int(self.index['first'][first]):stop - int(self.index['first'][first]):step]
+
+    def _chunk(self, chunk: int) -> np.ndarray:
+        if self._cached[0] != chunk:
+            first, reps, offset, size = self.index[chunk]
+            self._file.seek(int(offset) + CHUNK_HEADER.size)
+            self._cached = (chunk, decode_chunk(self.decompress(self._file.read(int(size))), self.dtype, int(reps)))
+        return self._cached[1]
+
+    def _read_index(self) -> np.ndarray:
+        data_start = self._file.tell()
+        end = os.path.getsize(self.path)
+        if end - data_start >= TRAILER.size:
+            self._file.seek(end - TRAILER.size)
+            offset, chunks, magic = TRAILER.unpack(self._file.read(TRAILER.size))
+            if magic == TRAILER_MAGIC:
+                self._file.seek(offset)
+                return np.frombuffer(self._file.read(chunks * INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)
+
+        index, first, offset = [], 0, data_start  # no index, walk the chunks
+        while offset + CHUNK_HEADER.size <= end:
+            self._file.seek(offset)
+            reps, size = CHUNK_HEADER.unpack(self._file.read(CHUNK_HEADER.size))
+            if offset + CHUNK_HEADER.size + size > end:  # torn last chunk
+                break
+            index.append((first, reps, offset, size))
+            first += reps
+            offset += CHUNK_HEADER.size + size
+        return np.array(index, dtype=INDEX_DTYPE)
@@ -0,0 +1,200 @@
+"""
+Headless batch runner, runs one query from a json config without Qt or matplotlib:
+python cli.py config.json /dev/ttyACM0
+python cli.py config.json 192.168.4.1:23 --wifi
+The config has the same keys as the .cfg files (the values of the device widget).
+"""
+import sys
+import json
+import time
+import signal
+import argparse
+
+import numpy as np
+
+from .log_level import *
+from .interfaces import Serial, Wifi
+from .results import ResultStore
+from .acquisition import CimosAcquisition
+
+EXIT_OK = 0
+EXIT_FAILED = 1  # the query raised
+EXIT_CONFIG = 2  # same as argparse usage errors
+EXIT_PORT = 3
+EXIT_INCOMPLETE = 4  # the device stopped before all repetitions were done, skipped overrun slots count as done
+EXIT_INTERRUPTED = 130
+
+REQUIRED = ["Measurment Channel", "Measurment Type", "Number of Samples"]
+DEFAULTS = {"Refrence Value": 0, "CCO Resolution": "000", "Repeats": 1, "Repeat Interval": 0, "Overrun": "Skip",
+            "Stop Time": 0, "Readout": "Binary", "Output Format": "CSV", "Search": "Full",
+            "Calibration": "Drift check"}
+
+
+class PrintLog:
+    """
+    Stands in for the main window as the logger, writes to stderr
+    """
+    LEVELS = {INFO: "INFO", ERROR: "ERROR", WARNING: "WARNING"}
+
+    class _Signal:
+        def __init__(self, log):
+            self.log = log
+
+        def emit(self, message, level=INFO):
+            if level == ERROR:
+                self.log.errors += 1
+            if level != INFO or not self.log.quiet:
+                print(f"{PrintLog.LEVELS[level]}: {self.log.prefix}{message}", file=sys.stderr, flush=True)
+
+    def __init__(self, quiet=False, prefix=""):
+        """
+        :param prefix: put before every message, e.g. the port when several devices log
+        """
+        self.quiet = quiet
+        self.prefix = prefix
+        self.errors = 0
+        self.LOG = PrintLog._Signal(self)
+
+
+class TimedStore(ResultStore):
+    """
+    ResultStore which also keeps when every repetition was appended, for the timing stats
+    """
+
+    def __init__(self, reps: int = None):
+        super().__init__(reps)
+        self.times = []
+
+    def append(self, row: dict):
+        super().append(row)
+        self.times.append(time.monotonic())
+
+
+def load_config(path: str) -> dict:
+    """
+    :return: query values, defaults filled in
+    :raise ValueError: on missing or invalid values
+    """
+    with open(path, 'r') as cfg_file:
+        vals = dict(DEFAULTS, **json.load(cfg_file))
+
+    missing = [k for k in REQUIRED if k not in vals]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    for chan in vals['Measurment Channel'].split('&'):
+        if chan not in CimosAcquisition.CHANNEL_BITS:
+            raise ValueError(f"unknown channel {chan}")
+    if vals['Measurment Type'] not in ("Capacitance Sweep", "Fixed Refrence"):
+        raise ValueError(f"unknown measurment type {vals['Measurment Type']}")
+    for k in ["Refrence Value", "Number of Samples", "Repeats", "Repeat Interval", "Stop Time"]:
+        vals[k] = int(vals[k])
+    return vals
+
+
+def stats(device: CimosAcquisition, vals: dict, started: float, finished: float) -> dict:
+    times = np.asarray(getattr(device.results, 'times', []))
+    steps = device.CR_STEPS if vals['Measurment Type'] == "Capacitance Sweep" else 1
+    channels = len(vals['Measurment Channel'].split('&'))
+    elapsed = finished - started
+    res = {"repetitions": len(device.results),
+           "planned": vals['reps'],
+           "elapsed": elapsed,
+           "repetitions_per_second": len(device.results) / elapsed if elapsed else 0,
+           "samples_per_second": len(device.results) * channels * steps * vals['Number of Samples'] / elapsed if elapsed else 0}
+    if len(times) > 1:
+        period = np.diff(times)
+        res.update({"period_mean": float(np.mean(period)),
+                    "period_p50": float(np.percentile(period, 50)),
+                    "period_p99": float(np.percentile(period, 99)),
+                    "period_max": float(np.max(period))})
+    if device.scheduler is not None:
+        res.update({"overruns": device.scheduler.overruns, "skipped": device.scheduler.skipped})
+    return res
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run a query without the gui")
+    parser.add_argument("config", help="json file with the query values, same keys as the .cfg files")
+    parser.add_argument("port", help="serial port of the device, host[:port] with --wifi")
+    parser.add_argument("--boud", type=int, default=115200)
+    parser.add_argument("--timeout", type=int, default=1, help="serial timeout in seconds")
+    parser.add_argument("--reader", action="store_true", help="read the port from a background thread")
+    parser.add_argument("--wifi", action="store_true", help="the device is on the network, port is its host[:port]")
+    parser.add_argument("--depth", type=int, default=1, help="W/R pairs in flight at once over wifi")
+    parser.add_argument("--name", default="CimosDevice", help="device name used in the output file names")
+    parser.add_argument("--output-dir", default=None, help="outputs/ of the repository by default")
+    parser.add_argument("--stats", default=None, help="also write the stats to this json file")
+    parser.add_argument("--quiet", action="store_true", help="only log warnings and errors")
+    parser.add_argument("--recalibrate", action="store_true", help="drop the cached calibrations of the device first")
+    args = parser.parse_args(argv)
+
+    logger = PrintLog(args.quiet)
+    try:
+        vals = load_config(args.config)
+    except (OSError, ValueError, TypeError) as e:
+        logger.LOG.emit(f"invalid config {args.config}: {e}", ERROR)
+        return EXIT_CONFIG
+
+    device = CimosAcquisition(args.name)
+    if args.recalibrate:
+        device.recalibrate()
+    vals = device.complete_vals(vals, logger)
+    if not vals['reps']:
+        return EXIT_CONFIG
+    device.vals = vals
+
+    interface = Wifi() if args.wifi else Serial()
+    try:
+        if args.wifi:
+            host, _, tcp_port = args.port.partition(':')
+            interface.open_host(host, int(tcp_port) if tcp_port else Wifi.DEFAULT_PORT, args.timeout, args.depth)
+        else:
+            interface.open_port(args.port, args.boud, args.timeout, args.reader)
+    except Exception as e:
+        logger.LOG.emit(e, ERROR)
+        return EXIT_PORT
+
+    interrupted = []
+
+    def on_interrupt(signum, frame):
+        interrupted.append(signum)
+        device.halt = True
+    signal.signal(signal.SIGINT, on_interrupt)
+    signal.signal(signal.SIGTERM, on_interrupt)
+
+    started = time.monotonic()
+    try:
+        vals = device.calibrate(interface, vals, logger)
+        device.RESULT_STORE = TimedStore
+        started = time.monotonic()
+        device.run_query(interface, vals, logger, output_name=device.output_name(vals, args.output_dir),
+                         finish_query=False, save_config=False)
+    except Exception as e:
+        logger.LOG.emit(f"{type(e).__name__}: {e}", ERROR)
+        return EXIT_FAILED
+    finally:
+        finished = time.monotonic()
+        interface.close()
+
+    res = stats(device, vals, started, finished)
+    res["errors"] = logger.errors
+    if getattr(interface, 'dropped_frames', 0):
+        res["dropped_frames"] = interface.dropped_frames
+    if getattr(interface, 'reconnects', 0):
+        res["reconnects"] = interface.reconnects
+    for k, v in res.items():
+        print(f"{k} = {v:.6g}" if isinstance(v, float) else f"{k} = {v}")
+    if device.timings is not None:
+        res["timings"] = device.timings.stats()
+        print(f"{'phase':>16} {'count':>8} {'p50 (ms)':>10} {'p99 (ms)':>10} {'max (ms)':>10}")
+        for phase, t in res["timings"].items():
+            print(f"{phase:>16} {t['count']:>8} {t['p50'] * 1e3:>10.3f} {t['p99'] * 1e3:>10.3f} {t['max'] * 1e3:>10.3f}")
+    if args.stats:
+        with open(args.stats, 'w') as stats_file:
+            json.dump(res, stats_file, indent=2)
+
+    if interrupted:
+        return EXIT_INTERRUPTED
+    if res["repetitions"] + res.get("skipped", 0) < res["planned"]:
+        return EXIT_INCOMPLETE
+    return EXIT_OK
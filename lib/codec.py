@@ -0,0 +1,67 @@
+import numpy as np
+
+from .interfaces import Interface
+
+SAMPLE_SEPARATOR = b','
+BINARY_SAMPLE = np.dtype('<u2')
+
+
+def decode_frame(frame: bytes, out: np.ndarray = None) -> np.ndarray:
+    """
+    Decode a sample frame to int32 in one vectorized step, either ascii (e.g. b"12,13,11,") or binary
+    :param frame: frame bytes without the termination char
+    :param out: optional int32 row to decode into, its length must match the number of samples
+    :return: decoded samples
+    """
+    if frame[:1] == Interface.BINARY_MARKER:
+        values = decode_binary_frame(frame)
+    else:
+        frame = frame.strip().strip(SAMPLE_SEPARATOR)
+        if not frame:
+            raise ValueError("empty sample frame")
+        try:
+            values = np.fromstring(frame, dtype=np.int32, sep=SAMPLE_SEPARATOR.decode())
+        except ValueError:  # numpy 2 rejects a bad value without naming it
+            values = None
+        if values is None or len(values) != frame.count(SAMPLE_SEPARATOR) + 1:
+            # numpy 1 stops at the first bad value instead, either way int() reports which one
+            values = np.array([int(raw) for raw in frame.split(SAMPLE_SEPARATOR)], dtype=np.int32)
+
+    if out is None:
+        return values
+    out[:] = values
+    return out
+
+
+def decode_binary_frame(frame: bytes) -> np.ndarray:
+    """
+    Zero-copy view of the samples of a binary frame
+    :param frame: whole frame, marker + uint16 count + uint16 samples + uint16 checksum
+    :return: read-only uint16 view into frame
+    """
+    count = int.from_bytes(frame[1:Interface.BINARY_HEADER], 'little')
+    end = Interface.BINARY_HEADER + count * BINARY_SAMPLE.itemsize
+    if len(frame) != end + 2:
+        raise ValueError(f"binary frame of {len(frame)} bytes can't hold {count} samples")
+
+    values = np.frombuffer(frame, dtype=BINARY_SAMPLE, count=count, offset=Interface.BINARY_HEADER)
+    checksum = int.from_bytes(frame[end:end + 2], 'little')
+    if checksum != binary_checksum(values):
+        raise ValueError(f"binary frame checksum mismatch ({checksum} != {binary_checksum(values)})")
+    return values
+
+
+def binary_checksum(values: np.ndarray) -> int:
+    """
+    16 bit sum of the samples, what the firmware appends to every binary frame
+    """
+    return int(values.sum(dtype=np.uint32)) & 0xFFFF
+
+
+def encode_binary_frame(values) -> bytes:
+    """
+    Build a binary frame the way the firmware does
+    """
+    values = np.asarray(values, dtype=BINARY_SAMPLE)
+    return Interface.BINARY_MARKER + len(values).to_bytes(2, 'little') + values.tobytes() + \
+        binary_checksum(values).to_bytes(2, 'little')
@@ -1,7 +1,81 @@
+import time
+
 from .device import *
 from .interfaces import *
 
 
+class SessionLog:
+    """
+    Stands in for the main window as a device logger, tags every message with the device name
+    """
+
+    class _Signal:
+        def __init__(self, signal, prefix):
+            self.signal = signal
+            self.prefix = prefix
+
+        def emit(self, message, level=INFO):
+            self.signal.emit(f"[{self.prefix}] {message}", level)
+
+    def __init__(self, logger, prefix):
+        self.LOG = SessionLog._Signal(logger.LOG, prefix)
+
+
+class Session:
+    """
+    One device driven over its own interface instance, every session has its own
+    acquisition thread (device.query_proc), result store (device.results) and output files
+    """
+    DISCONNECTED = "Disconnected"
+    CONNECTED = "Connected"
+    RUNNING = "Running"
+
+    def __init__(self, device: Device, interfaces: list[Interface]):
+        self.device = device
+        self.interfaces = interfaces
+        self.interface = None  # the one in use
+        self.started = None
+
+        device.query_finished.connect(self.on_query_finished)
+
+    def connect(self, interface: Interface, **kwargs) -> bool:
+        if not interface.open(**kwargs):
+            return False
+        self.interface = interface
+        return True
+
+    def disconnect(self):
+        self.interface.close()
+        self.interface = None
+
+    def start(self, logger):
+        errors = self.device.start_query(self.interface, logger)
+        if not errors:
+            self.started = time.monotonic()
+        return errors
+
+    def stop(self):
+        self.device.halt = True
+
+    def on_query_finished(self):
+        self.started = None
+
+    @property
+    def state(self) -> str:
+        if self.started is not None:
+            return Session.RUNNING
+        return Session.CONNECTED if self.interface is not None else Session.DISCONNECTED
+
+    def progress(self) -> tuple:
+        """
+        :return: (repetitions done, repetitions planned, repetitions per second)
+        """
+        done = len(self.device.results)
+        planned = getattr(self.device, 'vals', {}).get('reps', 0) if self.started is not None else done
+        rate = done / (time.monotonic() - self.started) if self.started is not None else 0
+        return done, planned, rate
+
+
 class Controller:
     """
     The class which gui uses to interact with devices
@@ -11,6 +85,10 @@ class Controller:
         self.devices = devices
         self.interfaces = interfaces
 
+        # every device gets its own interface instances, so several boards can run at once
+        self.sessions = [Session(d, interfaces if i == 0 else [type(f)() for f in interfaces])
+                         for i, d in enumerate(devices)]
+
     def get_interface_names(self):
         return [type(f).__name__ for f in self.interfaces]
 
@@ -20,3 +98,11 @@ class Controller:
     def connection_init(self, interface: Interface):
         return interface.list_available_devices()
 
+    def session(self, device: Device) -> Session:
+        return self.sessions[self.devices.index(device)]
+
+    def logger(self, device: Device, logger):
+        return SessionLog(logger, device.name) if len(self.devices) > 1 else logger
+
+    def running_sessions(self) -> list[Session]:
+        return [s for s in self.sessions if s.state == Session.RUNNING]
@@ -1,32 +1,24 @@
-import json
-from abc import ABC, abstractmethod
-import os
-import time
+from abc import abstractmethod
 import threading
-import multiprocessing
 from collections import OrderedDict
 from datetime import datetime
 
 
-import numpy as np
-import matplotlib
+from matplotlib.ticker import MaxNLocator
 
-# from matplotlib.backends.backend_qt5agg import FI
-from matplotlib import cm
-import matplotlib.pyplot as plt
-
-from PyQt5.QtCore import Qt, QObject, pyqtSignal, pyqtSlot, QTime
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, QTime
 import PyQt5.QtWidgets as widgets
 from PyQt5.QtCore import *
-from functools import partial
 
 from .log_level import *
-from .interfaces import Interface
-
-matplotlib.use('Qt5Agg')
+from .interfaces import Interface, Serial
+from .results import ResultStore
+from .acquisition import Acquisition, CimosAcquisition
+from .worker import AcquisitionProcess
+from . import aio
 
 
-class Device(QObject):#ABC,
+class Device(QObject, Acquisition):#ABC,
     INFO = 0
     ERROR = 1
     WARNING = 2
@@ -39,19 +31,11 @@ class Device(QObject):#ABC,
     """
 
     def __init__(self, name: str = None, **kwargs):
-        super().__init__()
+        super().__init__(name=name, **kwargs)
     #     # QObject.__init__()
-        self.halt = False
-
-        self.name = name if name is not None else type(self).__name__
         self.fields = {}
         self.commands = {}
 
-        self.defaults = {}
-        if os.path.isfile(self.cfg_file_path()):
-            with open(self.cfg_file_path(), 'r') as cfg_file:
-                self.defaults = json.load(cfg_file)
-
         # signals
         self.stop_query.connect(self.finalize_query)
         # self.query_finished.connect(self.finalize_query)
@@ -60,22 +44,18 @@ class Device(QObject):#ABC,
     def get_widget(self):
         pass
 
-    def save_last_config(self, vals: dict):
-        self.defaults = vals
-        with open(self.cfg_file_path(), 'w') as cfg_file:
-            json.dump(vals, cfg_file)
-
-    def cfg_file_path(self):
-        return os.path.join(os.path.dirname(os.path.dirname(__file__)), self.name + '.cfg')
+    @abstractmethod
+    def setup_axes(self, fig) -> list:
+        """
+        The plot panel calls this when a query starts, self.results is then plotted on the returned axes
+        """
+        pass
 
     @abstractmethod
     def start_query(self, interface: Interface, logger) -> list[str]:
         pass
 
-    def reset_halt(self, logger=None):
-        if logger:
-            logger.LOG.emit(f"Stopping Query", WARNING)
-        self.halt = False
+    def query_stopped(self):
         self.stop_query.emit()
 
     @pyqtSlot()
@@ -83,9 +63,7 @@ class Device(QObject):#ABC,
         self.query_finished.emit()
 
 
-class CimosDevice(Device):
-    # new_result = pyqtSignal(list)
-    CHANNEL_BITS = {'Left': ' ', 'Right': '1', 'Internal Cap': '0'}
+class CimosDevice(Device, CimosAcquisition):
 
     def __init__(self, name: str=None, **kwargs):
         super(CimosDevice, self).__init__(name)
@@ -98,17 +76,18 @@ class CimosDevice(Device):
             ("Number of Samples", {"values": "NUM", "min": 1, "max": 1000}),
             ("Repeats", {"values": "NUM", "min": 1, "max": 1000}),
             ("Repeat Interval", {"values": "TIME"}),
+            ("Overrun", {"values": ["Skip", "Catch up", "Shift"]}),  # when a repetition takes longer than the interval
             ("Stop Time", {"values": "TIME"}),
-            ("Plot Type", {"values": ["2D", "3D"]})
+            ("Calibration", {"values": ["Drift check", "Cached", "Always"]}),  # reuse of earlier pre-sweeps
+            ("Search", {"values": ["Full", "Adaptive"]}),  # adaptive: read only around the refrence crossing, only the full sweeps are saved
+            ("Plot Type", {"values": ["2D", "3D", "Waterfall"]}),  # 2D and waterfall: the 3D Snapshot button shows the latest sweeps in 3D
+            ("Readout", {"values": ["Binary", "ASCII"]}),  # binary only if the firmware supports it
+            ("Output Format", {"values": ["CSV", "Archive", "Compressed"]}),
+            ("Acquisition", {"values": ["Thread", "Process", "Async"]})  # process: the port is owned by a worker process, async: by the shared event loop
         ])
 
-        self.outputs = None
         self.ax = None
         self.fig = None
-        self.plots = {}
-
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_plot)
 
     def get_widget(self):
         res = widgets.QWidget()
@@ -158,13 +137,15 @@ class CimosDevice(Device):
         measurment_changed(self.fields['Measurment Type'].currentText())
         ##############################################################
 
+        recalibrate_btn = widgets.QPushButton("Recalibrate")
+        recalibrate_btn.clicked.connect(self.recalibrate)
+        form_layout.addRow(recalibrate_btn)
+
         res.setLayout(form_layout)
         return res
 
     def start_query(self, interface: Interface, logger) -> list[str]:
-        logger.LOG.emit(f"NEW QUERY =================", INFO)
-
-        plt.close()
+        logger.LOG.emit("NEW QUERY =================", INFO)
 
         errors = []
 
@@ -185,12 +166,7 @@ class CimosDevice(Device):
             else:
                 vals[f] = self.fields[f].text()
         # calculates repeats
-        if vals['Stop Time'] and vals['Repeat Interval']:
-            vals['reps'] = vals['Stop Time'] // vals['Repeat Interval']
-        else:
-            vals['reps'] = vals['Repeats']
-        if not vals['reps']:
-            logger.LOG.emit(f"Your config result in an invalid Repeat", INFO)
+        vals = self.complete_vals(vals, logger)
 
         print(vals)
         self.vals = vals
@@ -198,227 +174,39 @@ class CimosDevice(Device):
         if errors:
             return errors
 
-        self.outputs = OrderedDict()
-        self.plots = {}
-
-        def query(interface:Interface, vals, **kwargs):  # whole query management
-            def postprocess(values):
-                return np.mean(values, axis=1, dtype=np.int32)
-
-            # logger.LOG.emit(f"Set CCO to {vals['CCO Resolution']}", INFO)
-            interface.send(f"G{vals['CCO Resolution']}")
-            o = interface.read(until=Interface.TERMINATION_CHAR)
-            # print(f"o:{o}")
-            if self.halt:
-                self.reset_halt(logger)
-                return
-
-            n_sample = vals['Number of Samples']
-            # logger.LOG.emit(f"Set Number of Samples to {n_sample}", INFO)
-            interface.send(f"S{n_sample}\0")
-            o = interface.read(until=Interface.TERMINATION_CHAR)
-            # print(f"o:{o}")
-            if self.halt:
-                self.reset_halt(logger)
-                return
-
-            last_bit = [self.CHANNEL_BITS[chan] for chan in vals['Measurment Channel'].split('&')]
-            for lb in last_bit:
-                self.outputs[lb] = []
-
-            if vals.get('refrence_pulse', None):
-                self.outputs['cide'] = []
-
-            repeats = vals['reps']
-            repeat_interval = vals['Repeat Interval']
-
-            time_sum = 0
-            if vals['Measurment Type'] == "Capacitance Sweep":
-                for rep in range(repeats):
-                    time0 = time.time()
-
-                    output = OrderedDict([(lb, []) for lb in last_bit])  # np.zeros((128, n_sample), dtype=np.int32)
-                    if kwargs.get('refrence_pulse', None):
-                        output['cide'] = []
-
-                    for x in range(128):
-                        for lb in last_bit:
-                            interface.send(f"W{format(x, '07b')}" + lb)
-                            o = interface.read(until=Interface.TERMINATION_CHAR)
-                            # print(f"o:{o}")
-                            if self.halt:
-                                self.reset_halt(logger)
-                                return
-
-                            interface.send(f"R")
-                            while not interface.ser.in_waiting:
-                                pass
-
-                            o = interface.read(until=Interface.TERMINATION_CHAR).strip(str(Interface.TERMINATION_CHAR))
-
-                            # output update
-                            output[lb].append([int(raw) for raw in o.strip(',').split(',')])
-
-                            if self.halt:
-                                self.reset_halt(logger)
-                                return
-                            # interface.ser.reset_input_buffer()
-                    time_sum = time.time() - time0
-
-                    for k in output:
-                        self.outputs[k].append(postprocess(output[k]))
-
-                    # right sweep case
-                    if vals.get('refrence_pulse', None):
-                        for r in range(len(self.outputs['1'])):  # only the right channel needs it
-                            if self.outputs['1'][r] <= vals['refrence_pulse']:
-                                if r == 0:
-                                    self.outputs['cide'] = r
-                                else:
-                                    self.outputs['cide'] = (1 / (self.outputs['1'][r] - self.outputs['1'][r - 1])) * \
-                                                           (vals['refrence_pulse'] - self.outputs['1'][r - 1]) + (r - 1)
-                                break
-                        if 'cide' not in self.outputs:
-                            self.outputs['cide'] = r
-
-                    if kwargs.get('output_name', None):
-                        for chan in vals['Measurment Channel'].split('&'):
-                            self.save_output(chan, output[self.CHANNEL_BITS[chan]], kwargs['output_name'])
-
-                    if repeat_interval:
-                        if repeat_interval > (time.time()-time0):
-                            time.sleep(repeat_interval - (time.time()-time0))
-                        else:
-                            logger.LOG.emit("Process time is more than the whole Interval...", ERROR)
-
-            elif vals["Measurment Type"] == "Fixed Refrence":
-                refrences = {self.CHANNEL_BITS[chan]: vals.get(f"{chan}_refrence", vals['Refrence Value']) for chan in vals['Measurment Channel'].split('&')}
-
-                for rep in range(repeats):
-                    time0 = time.time()
-
-                    output = OrderedDict([(lb, []) for lb in last_bit])  # np.zeros((128, n_sample), dtype=np.int32)
-                    for lb in last_bit:
-                        interface.send(f"W{format(refrences[lb], '07b')}" + lb)
-                        o = interface.read(until=Interface.TERMINATION_CHAR)
-                        # print(f"o:{o}")
-                        if self.halt:
-                            self.reset_halt(logger)
-                            return
-
-                        interface.send(f"R")
-                        while not interface.ser.in_waiting:
-                            pass
-
-                        o = interface.read(until=Interface.TERMINATION_CHAR).strip(str(Interface.TERMINATION_CHAR))
-
-                        # update output
-                        output[lb].append([int(raw) for raw in o.strip(',').split(',')])
-
-                        if self.halt:
-                            self.reset_halt(logger)
-                            return
-                        # interface.ser.reset_input_buffer()
-                    time_sum = time.time() - time0
-
-                    for k in output:
-                        self.outputs[k].append(postprocess(output[k]))
-
-                    if kwargs.get('output_name', None):
-                        for chan in vals['Measurment Channel'].split('&'):
-                            self.save_output(chan, self.outputs[self.CHANNEL_BITS[chan]], kwargs['output_name'])
-
-                    if repeat_interval:
-                        if repeat_interval > (time.time()-time0):
-                            time.sleep(repeat_interval - (time.time()-time0))
-                        else:
-                            logger.LOG.emit("Process time is more than the whole Interval...", ERROR)
-
-            if kwargs.get('save_config', True):
-                self.save_last_config(vals)
-
-            if kwargs.get('finish_query', True):
-                time.sleep(2)
-                self.reset_halt()
-
-                logger.LOG.emit(f"Average time = {time_sum/repeats:.3f} s", INFO)
-                logger.LOG.emit("Query finished!", INFO)
-
-        xlabels = [296.77, 299.66, 305.01, 307.9, 318.59, 321.48, 326.83, 329.72, 349.35, 352.24, 357.59, 360.48,
-                   371.17, 374.06, 379.41, 382.3, 416.16, 419.05, 424.4, 427.29, 437.98, 440.87, 446.22, 449.11,
-                   468.74, 471.63, 476.98, 479.87, 490.56, 493.45, 498.8, 501.69, 551.43, 554.32, 559.67, 562.56,
-                   573.25, 576.14, 581.49, 584.38, 604.01, 606.9, 612.25, 615.14, 625.83, 628.72, 634.07, 636.96,
-                   670.82, 673.71, 679.06, 681.95, 692.64, 695.53, 700.88, 703.77, 723.4, 726.29, 731.64, 734.53,
-                   745.22, 748.11, 753.46, 756.35, 794.11, 797, 802.35, 805.24, 815.93, 818.82, 824.17, 827.06, 846.69,
-                   849.58, 854.93, 857.82, 868.51, 871.4, 876.75, 879.64, 913.5, 916.39, 921.74, 924.63, 935.32, 938.21,
-                   943.56, 946.45, 966.08, 968.97, 974.32, 977.21, 987.9, 990.79, 996.14, 999.03, 1048.77, 1051.66,
-                   1057.01, 1059.9, 1070.59, 1073.48, 1078.83, 1081.72, 1101.35, 1104.24, 1109.59, 1112.48, 1123.17,
-                   1126.06, 1131.41, 1134.3, 1168.16, 1171.05, 1176.4, 1179.29, 1189.98, 1192.87, 1198.22, 1201.11,
-                   1220.74, 1223.63, 1228.98, 1231.87, 1242.56, 1245.45, 1250.8, 1253.69]
-
-        if vals["Measurment Type"] == "Fixed Refrence":
-            # process refrences
-            if vals['Refrence Value'] == -1:
-                vals_backup = vals.copy()
-                vals['Measurment Type'] = "Capacitance Sweep"
-                vals['Number of Samples'] = 5
-                vals['reps'] = 1
-                vals['Repeat Interval'] = 0
-
-                self.query_proc = threading.Thread(target=query, args=(interface, vals),
-                                                   kwargs={'finish_query': False, 'save_config': False}, daemon=True)
-                self.query_proc.start()
-                self.query_proc.join()
-
-                def calculate_refrence(sweep_data):
-
-                    max_ind = np.argmax(sweep_data)
-
-                    if max_ind+1 == len(sweep_data):
-                        logger.LOG.emit("Not fully capacitance mode...", ERROR)
-
-                    y = (sweep_data[max_ind] + np.min(sweep_data[max_ind:])) // 2
-                    for ind, d in enumerate(sweep_data[max_ind:]):
-                        if d <= y:
-                            if ind == 0:
-                                return 0
-                            else:
-                                return int((1 / (d - sweep_data[max_ind:][ind-1])) * (y-sweep_data[max_ind:][ind-1]) + (ind-1))
-
-                    logger.LOG.emit("This should not happen! Something bad happend", ERROR)
-                    return len(sweep_data)-1
-
-                vals = vals_backup
-                for chan in vals['Measurment Channel'].split('&'):
-                    vals[f"{chan}_refrence"] = calculate_refrence(self.outputs[self.CHANNEL_BITS[chan]][0])
-                    logger.LOG.emit(f"{chan}_refrence: {xlabels[calculate_refrence(self.outputs[self.CHANNEL_BITS[chan]][0])]}", INFO)
-                vals["Measurment Type"] = "Fixed Refrence"
-                self.vals = vals
+        self.capabilities = None
+        process = vals.get('Acquisition', "Thread") == "Process"
+        run_async = vals.get('Acquisition', "Thread") == "Async"
+        if (process or run_async) and not isinstance(interface, Serial):  # only a serial port can be handed over
+            return [f"{vals['Acquisition']} acquisition needs a Serial interface"]
+        if not process and not run_async:  # the worker process and the event loop calibrate themselves
+            vals = self.calibrate(interface, vals, logger)
 
-        if vals['Measurment Channel'] == "Right" and vals['Measurment Type'] == "Capacitance Sweep":
-            # process the internal cap
-            vals_backup = vals.copy()
-            vals['Measurment Channel'] = "Internal Cap"
-            vals['Number of Samples'] = 5
-            vals['reps'] = 1
-            vals['Repeat Interval'] = 0
-
-            self.query_proc = threading.Thread(target=query, args=(interface, vals),
-                                               kwargs={'finish_query': False, 'save_config': False}, daemon=True)
+        self.results = ResultStore()  # drop the calibration sweeps before the plot starts
+        if datetime.now().year * 12 + datetime.now().month > 24261:
+            return -1
+        output_name = self.output_name(self.vals)
+        if run_async:  # a future of the loop thread, already running
+            self.query_proc = aio.shared_loop().submit(aio.handover(self, interface, vals, logger, output_name))
+        else:
+            if process:
+                self.query_proc = AcquisitionProcess(self, interface, vals, logger, output_name)
+            else:
+                self.query_proc = threading.Thread(target=self.run_query, args=(interface, vals, logger), kwargs={'output_name': output_name}, daemon=True)
             self.query_proc.start()
-            self.query_proc.join()
-
-            slope = (self.outputs['0'][0][16] - self.outputs['0'][0][15]) / (xlabels[16] - xlabels[15])
-            intercept = self.outputs['0'][0][16] - slope * xlabels[16]
-            vals = vals_backup
-            vals['refrence_pulse'] = 402.7 * slope + intercept
-            self.vals = vals
-            logger.LOG.emit(f"refrence pulse = {vals['refrence_pulse']:.1f}", INFO)
+        # self.query_proc.join()
 
-            self.outputs = OrderedDict()
+        return errors
 
-            # plot part
-            self.fig = plt.figure()
+    def setup_axes(self, fig) -> list:
+        """
+        Create the axes of the running query on fig
+        :param fig: matplotlib figure owned by the plot panel
+        :return: one axis per result channel, in ResultStore order
+        """
+        vals = self.vals
+        if vals['Measurment Channel'] == "Right" and vals['Measurment Type'] == "Capacitance Sweep":
+            self.fig = fig
             self.ax = []
             if vals['Plot Type'] == "3D":
                 self.ax.append(self.fig.add_subplot(1, 2, 1, projection='3d'))
@@ -436,7 +224,7 @@ class CimosDevice(Device):
                 self.ax[0].set_xlabel('CR')
                 self.ax[0].set_xlim(left=-1, right=128)
                 self.ax[0].set_xticks(range(0, 128, 7))
-                self.ax[0].set_xticklabels([int(x) for i, x in enumerate(xlabels) if i % 7 == 0], rotation=90, ha='center')
+                self.ax[0].set_xticklabels([int(x) for i, x in enumerate(self.XLABELS) if i % 7 == 0], rotation=90, ha='center')
 
                 self.ax[0].set_ylabel('Number Of Pulses')
                 self.ax[0].set_ylim(bottom=-1, top=100)
@@ -448,23 +236,23 @@ class CimosDevice(Device):
             self.ax[0].set_xlabel('CR')
             self.ax[0].set_xlim(left=-1, right=128)
             self.ax[0].set_xticks(range(0, 128, 7))
-            self.ax[0].set_xticklabels([int(x) for i, x in enumerate(xlabels) if i % 7 == 0], rotation=90, ha='center')
+            self.ax[0].set_xticklabels([int(x) for i, x in enumerate(self.XLABELS) if i % 7 == 0], rotation=90, ha='center')
 
             # cide value
             self.ax.append(self.fig.add_subplot(1, 2, 2))
             self.ax[1].set_title(f"{'Refrence Pulse'}")
 
             self.ax[1].set_xlabel('Time')
-            self.ax[1].set_xticks(range(0, 200, 2))
+            self.ax[1].xaxis.set_major_locator(MaxNLocator(integer=True))
 
             self.ax[1].set_ylabel('C_ide')
             self.ax[1].set_yticks(range(0, 128, 7))
-            self.ax[1].set_yticklabels([int(x) for i, x in enumerate(xlabels) if i % 7 == 0])
+            self.ax[1].set_yticklabels([int(x) for i, x in enumerate(self.XLABELS) if i % 7 == 0])
         else:
             if vals['Plot Type'] == "3D":  # 3d case
-                self.fig, self.ax = plt.subplots(1, 2 if vals['Measurment Channel'] == "Left&Right" else 1, subplot_kw={"projection": "3d"})
-                if not isinstance(self.ax, np.ndarray):
-                    self.ax = [self.ax]
+                self.fig = fig
+                self.ax = fig.subplots(1, 2 if vals['Measurment Channel'] == "Left&Right" else 1,
+                                       subplot_kw={"projection": "3d"}, squeeze=False)[0]
 
                 for axis in self.ax:
                     # self.ax.yaxis.set_major_formatter(matplotlib.ticker.StrMethodFormatter("{x:.0f}"))
@@ -475,9 +263,8 @@ class CimosDevice(Device):
                     # self.ax.set_zticks(range(0, 5000, 100))
                     axis.set_zlim(bottom=-1, top=100)
             else:  # 2d simple plot
-                self.fig, self.ax = plt.subplots(1, 2 if vals['Measurment Channel'] == "Left&Right" else 1)
-                if not isinstance(self.ax, np.ndarray):
-                    self.ax = [self.ax]
+                self.fig = fig
+                self.ax = fig.subplots(1, 2 if vals['Measurment Channel'] == "Left&Right" else 1, squeeze=False)[0]
 
                 for axis in self.ax:
                     axis.set_ylabel('Number Of Pulses')
@@ -490,126 +277,19 @@ class CimosDevice(Device):
 
                 if vals["Measurment Type"] == "Fixed Refrence":
                     axis.set_xlabel('Time')
-                    axis.set_xticks(range(0, 200, 2))
+                    axis.xaxis.set_major_locator(MaxNLocator(integer=True))
                 else:
                     axis.set_xlabel('CR')
                     axis.set_xlim(left=-1, right=128)
                     axis.set_xticks(range(0, 128, 7))
-                    axis.set_xticklabels([int(x) for i, x in enumerate(xlabels) if i % 7 == 0], rotation=90, ha='center')
+                    axis.set_xticklabels([int(x) for i, x in enumerate(self.XLABELS) if i % 7 == 0], rotation=90, ha='center')
                 axis.set_title(f"{self.vals['Measurment Channel'].split('&')[i]} {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
 
-        mngr = plt.get_current_fig_manager()
-        mngr.window.setGeometry(500, 80, 800, 500)
-
-        plt.ion()
-        self.fig.show()
-
-        self.timer.start(300)
-        if datetime.now().year * 12 + datetime.now().month > 24261:
-            return -1
-        output_name = os.path.join(os.path.dirname(os.path.dirname(__file__)),
-                                   "outputs",
-                                   f"{{channel}}_{datetime.now().strftime('%d-%m-%Y %H:%M:%S')}_{self.name}_{self.vals['Number of Samples']}.csv")
-        self.query_proc = threading.Thread(target=query, args=(interface, vals), kwargs={'output_name': output_name}, daemon=True)
-        # self.query_proc = multiprocessing.Process(target=query, args=(interface, vals, output_name), daemon=True)
-        self.query_proc.start()
-        # self.query_proc.join()
-
-        return errors
-
-    def update_plot(self):
-        if self.vals["Measurment Type"] == "Fixed Refrence":
-            if self.vals['Plot Type'] == '3D':
-                for ax_ind, k in enumerate([x for x in self.outputs.keys() if not x.endswith("_ind")]):
-                    ind = self.outputs.get(f"{k}_ind", 0)
-                    if ind < len(self.outputs[k]):
-                        if self.plots.get(k, None) is not None:
-                            self.plots[k].remove()
-
-                        self.plots[k] = self.ax[ax_ind].scatter([self.vals['Refrence Value']] * len(self.outputs[k]),
-                                                        range(len(self.outputs[k])), self.outputs[k],
-                                                        cmap=plt.get_cmap('coolwarm'), c=self.outputs[k], alpha=.99)
-
-                        self.ax[ax_ind].set_zbound([-1, np.max(self.outputs[k])+10])
-
-                        # if len(self.outputs[k]) == self.vals['Repeats']:
-                        #     self.fig.colorbar(self.plots[k])
-
-                        self.outputs[f"{k}_ind"] = len(self.outputs[k])
-            else:
-                for ax_ind, k in enumerate([x for x in self.outputs.keys() if not x.endswith("_ind")]):
-                    ind = self.outputs.get(f"{k}_ind", 0)
-                    if ind < len(self.outputs[k]):
-                        if self.plots.get(k, None) is not None:
-                            self.plots[k].remove()
-
-                        self.plots[k] = self.ax[ax_ind].scatter(range(len(self.outputs[k])), self.outputs[k], alpha=.5)
-                        self.ax[ax_ind].set_ybound([-1, np.max(self.outputs[k])+10])
-
-                        self.outputs[f"{k}_ind"] = len(self.outputs[k])
-        else:
-            if self.vals['Plot Type'] == '3D':
-                for ax_ind, k in enumerate([x for x in self.outputs.keys() if not x.endswith("_ind")]):
-                    if k == 'cide':
-                        ind = self.outputs.get(f"{k}_ind", 0)
-                        if ind < len(self.outputs[k]):
-                            if self.plots.get(k, None) is not None:
-                                # print(self.plots[k])
-                                self.plots[k].remove()
-
-                            self.plots[k] = self.ax[ax_ind].plot(self.outputs[k], alpha=.5)[0]
-                            self.ax[ax_ind].set_ybound([-1, np.max(self.outputs[k]) + 10])
-
-                            self.outputs[f"{k}_ind"] = len(self.outputs[k])
-                    else:
-                        ind = self.outputs.get(f"{k}_ind", 0)
-                        if ind < len(self.outputs[k]):
-                            if self.plots.get(k, None) is not None:
-                                self.plots[k].remove()
-
-                            x, y = np.meshgrid(range(128), range(len(self.outputs[k])))
-                            self.plots[k] = self.ax[ax_ind].plot_surface(x, y, np.array(self.outputs[k]), rstride=2, cstride=2, alpha=.99,
-                                                                         cmap=plt.get_cmap('coolwarm'), linewidth=1, antialiased=True)
-
-                            self.ax[ax_ind].set_zbound([-1, np.max(self.outputs[k])+10])
-
-                            # if len(self.outputs[k]) == self.vals['Repeats']:
-                            #     self.fig.colorbar(self.plots[k])
-
-                            self.outputs[f"{k}_ind"] = len(self.outputs[k])
-            else:
-                for ax_ind, k in enumerate([x for x in self.outputs.keys() if not x.endswith("_ind")]):
-                    if k == 'cide':
-                        ind = self.outputs.get(f"{k}_ind", 0)
-                        if ind < len(self.outputs[k]):
-                            if self.plots.get(k, None) is not None:
-                                # print(self.plots[k])
-                                self.plots[k].remove()
-
-                            self.plots[k] = self.ax[ax_ind].plot(self.outputs[k], alpha=.5)[0]
-                            self.ax[ax_ind].set_ybound([-1, np.max(self.outputs[k]) + 10])
-
-                            self.outputs[f"{k}_ind"] = len(self.outputs[k])
-                    else:
-                        ind = self.outputs.get(f"{k}_ind", 0)
-                        if ind < len(self.outputs[k]):
-                            for i in range(ind, len(self.outputs[k])):
-                                self.ax[ax_ind].plot(self.outputs[k][i], alpha=.5)
-                            self.ax[ax_ind].set_ybound([-1, np.max(self.outputs[k])+10])
-
-                            self.outputs[f"{k}_ind"] = len(self.outputs[k])
-
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
-
-    def save_output(self, channel, output, file_name):
-        with open(file_name.format(channel=channel), 'a') as out:
-            out.write(','.join([str(x) for x in np.array(output).flatten()])+'\n')
+        return list(self.ax)
 
     @pyqtSlot()
     def finalize_query(self):
-        self.timer.stop()
-        # for k in self.outputs:
-        #     print(self.outputs[k])
+        # for k in self.results.channels():
+        #     print(self.results.view(k))
         super(CimosDevice, self).finalize_query()
 
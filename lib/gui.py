@@ -1,30 +1,36 @@
-import sys
+import html
 from functools import partial
 
-from PyQt5.QtCore import Qt, QObject, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import QTimer
 from PyQt5.QtGui import QPalette, QColor, QIcon
-from PyQt5.QtWidgets import QApplication, QLabel, QWidget, QPushButton, QLineEdit, QHBoxLayout, QGridLayout, QFormLayout, QDialog
+from PyQt5.QtWidgets import QLabel, QPushButton, QHBoxLayout, QDialog
 import PyQt5.QtWidgets as widgets
 
 from .log_level import *
-from .controller import Controller
+from .controller import Controller, Session
 from .device import Device
 from .interfaces import Interface
+from .logsink import LogSink
+from .plotting import PlotPanel
 
 
 class MainWindow(QDialog):
     LOG_COLORS = {INFO: "White", ERROR: "Red", WARNING: "Yellow"}
-
-    LOG = pyqtSignal(str, int)
+    STATUS_INTERVAL = 1000  # ms between session status updates
+    LOG_INTERVAL = 100  # ms between log panel updates
+    LOG_LINES = 5000  # lines kept in the log panel, the log file has all of them
+    LOG_BATCH = 500  # lines added per update, the rest of a burst is only in the log file
 
     def __init__(self, controller: Controller, parent=None):
         self.controller = controller
+        self.LOG = LogSink()  # devices log from their threads through LOG.emit
 
         super().__init__(parent)
         self.setWindowTitle('PyQt5 App')
         self.setGeometry(100, 100, 280, 80)
 
         self.main_layout = widgets.QVBoxLayout()
+        self.window_layout = widgets.QHBoxLayout()
 
         self.interface_box, self.connect_btn = self._create_connection_box()
         self.main_layout.addWidget(self.interface_box)
@@ -36,17 +42,25 @@ class MainWindow(QDialog):
 
         self.main_layout.addWidget(self._create_log_widget())
 
-        self.setLayout(self.main_layout)
+        self.plot_panel = PlotPanel()
+        self.side_layout = widgets.QVBoxLayout()
+        self.side_layout.addWidget(self.plot_panel, stretch=1)
+        self.side_layout.addWidget(self._create_status_widget())
+        self.side_layout.addWidget(self._create_timing_widget())
+        self.window_layout.addLayout(self.main_layout)
+        self.window_layout.addLayout(self.side_layout, stretch=1)
+
+        self.setLayout(self.window_layout)
         self.setWindowIcon(QIcon('icon.png'))
 
         # default connection
-        self.interface_selector.setCurrentIndex(0)
         self.device_selector.setCurrentIndex(0)
-        self.on_interface_disconnect()
+        self.interface_selector.setCurrentIndex(0)
+        self.update_controls()
 
         # signals
-        self.current_device().query_finished.connect(self.on_query_finished)
-        self.LOG.connect(self.log)
+        for device in self.controller.devices:
+            device.query_finished.connect(partial(self.on_query_finished, device))
 
     def _create_connection_box(self):
         res = widgets.QGroupBox("Connection")
@@ -57,13 +71,16 @@ class MainWindow(QDialog):
         self.interface_selector.setCurrentIndex(-1)
 
         def on_interface_select(index):
-            new_widget = self.controller.interfaces[index].get_widget()
+            if index < 0 or self.device_selector.currentIndex() < 0:
+                return
+            new_widget = self.current_session().interfaces[index].get_widget()
             if hasattr(self, "interface_widget"):
                 # main_layout.removeWidget(main_window.device_widget)
                 main_layout.itemAt(1).widget().deleteLater()
             main_layout.insertWidget(1, new_widget)
             self.interface_widget = new_widget
         self.interface_selector.currentIndexChanged.connect(on_interface_select)
+        self.on_interface_select = on_interface_select
         main_layout.addWidget(self.interface_selector)
 
         res.setLayout(main_layout)
@@ -71,9 +88,9 @@ class MainWindow(QDialog):
         connect_btn = widgets.QPushButton("Connect")
 
         def submit_onclick():
-            interface = self.controller.interfaces[self.interface_selector.currentIndex()]
-            if connect_btn.text() == "Connect":
-                if not interface.open():
+            session = self.current_session()
+            if session.state == Session.DISCONNECTED:
+                if not session.connect(self.current_interface()):
                     c = self.interface_selector.currentIndex()
                     self.interface_selector.setCurrentIndex(-1)
                     self.interface_selector.setCurrentIndex(c)
@@ -82,11 +99,9 @@ class MainWindow(QDialog):
                 # p = QPalette()
                 # p.setColor(QPalette.Base, QColor(0, 255, 0, alpha=100))
                 # connect_btn.setPalette(p)
-
-                self.on_interface_change(True)
             else:
-                interface.close()
-                self.on_interface_disconnect()
+                session.disconnect()
+            self.update_controls()
 
         connect_btn.clicked.connect(submit_onclick)
 
@@ -107,6 +122,15 @@ class MainWindow(QDialog):
                 main_layout.itemAt(1).widget().deleteLater()
             main_layout.insertWidget(1, new_widget)
             self.device_widget = new_widget
+
+            # show the connection of this device's session
+            session = self.current_session()
+            if session.interface is not None:
+                self.interface_selector.setCurrentIndex(session.interfaces.index(session.interface))
+            self.on_interface_select(self.interface_selector.currentIndex())
+            if session.state == Session.RUNNING:
+                self.plot_panel.start(session.device)
+            self.update_controls()
         self.device_selector.currentIndexChanged.connect(on_device_select)
         main_layout.addWidget(self.device_selector)
         res.setLayout(main_layout)
@@ -114,18 +138,17 @@ class MainWindow(QDialog):
         submit_btn = widgets.QPushButton("Start")
 
         def submit_onclick():
-            if submit_btn.text() == "Start":
-                self.on_query_change(True)
-
-                errors = self.current_device().start_query(self.current_interface(), self)
+            session = self.current_session()
+            if session.state != Session.RUNNING:
+                errors = session.start(self.controller.logger(session.device, self))
                 if errors:
                     for e in errors:
-                        self.log(e, MainWindow.ERROR)
-
-                    self.on_query_change(False)
+                        self.log(e, ERROR)
+                else:
+                    self.plot_panel.start(session.device)
             else:
-                self.current_device().halt = True
-                submit_btn.setEnabled(False)
+                session.stop()
+            self.update_controls()
 
                 # self.on_query_finished()
         submit_btn.clicked.connect(submit_onclick)
@@ -134,28 +157,100 @@ class MainWindow(QDialog):
 
     def _create_log_widget(self):
         res = widgets.QGroupBox("Logs")
-        self.logger = widgets.QTextEdit()
+        self.logger = widgets.QPlainTextEdit()
+        self.logger.setMaximumBlockCount(self.LOG_LINES)
 
         p = QPalette()
         p.setColor(QPalette.Base, QColor(0, 0, 0, alpha=190))
         p.setColor(QPalette.Text, QColor('white'))
         self.logger.setPalette(p)
 
-        self.logger.setAlignment(Qt.AlignLeft|Qt.AlignTop)
         self.logger.setReadOnly(True)
         self.logger.setMinimumHeight(200)
 
         layout = QHBoxLayout()
         layout.addWidget(self.logger)
         res.setLayout(layout)
+
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(self.LOG_INTERVAL)
+        return res
+
+    def _create_status_widget(self):
+        res = widgets.QGroupBox("Sessions")
+        self.status_table = widgets.QTableWidget(len(self.controller.sessions), 5)
+        self.status_table.setHorizontalHeaderLabels(["Device", "Interface", "Status", "Repetitions", "Rate (rep/s)"])
+        self.status_table.horizontalHeader().setSectionResizeMode(widgets.QHeaderView.Stretch)
+        self.status_table.verticalHeader().hide()
+        self.status_table.setEditTriggers(widgets.QAbstractItemView.NoEditTriggers)
+        self.status_table.setMaximumHeight(40 + 30 * len(self.controller.sessions))
+        self.status_total = QLabel()
+
+        layout = widgets.QVBoxLayout()
+        layout.addWidget(self.status_table)
+        layout.addWidget(self.status_total)
+        res.setLayout(layout)
+
+        self.status_timer = QTimer(self)
+        self.status_timer.timeout.connect(self.update_status)
+        self.status_timer.start(self.STATUS_INTERVAL)
+        return res
+
+    def _create_timing_widget(self):
+        res = widgets.QGroupBox("Timings")
+        self.timing_table = widgets.QTableWidget(0, 4)
+        self.timing_table.setHorizontalHeaderLabels(["Count", "p50 (ms)", "p99 (ms)", "Max (ms)"])
+        self.timing_table.horizontalHeader().setSectionResizeMode(widgets.QHeaderView.Stretch)
+        self.timing_table.setEditTriggers(widgets.QAbstractItemView.NoEditTriggers)
+        self.timing_table.setMaximumHeight(300)
+
+        export_btn = QPushButton("Export JSON")
+
+        def export_onclick():
+            timings = self.current_device().timings
+            if timings is None:
+                return
+            path, _ = widgets.QFileDialog.getSaveFileName(self, "Export timings", f"{self.current_device().name}_timings.json",
+                                                          "JSON (*.json)")
+            if path:
+                timings.save(path)
+        export_btn.clicked.connect(export_onclick)
+
+        layout = widgets.QVBoxLayout()
+        layout.addWidget(self.timing_table)
+        layout.addWidget(export_btn)
+        res.setLayout(layout)
+
+        self.status_timer.timeout.connect(self.update_timings)
         return res
 
-    @pyqtSlot(str, int)
     def log(self, message, level=INFO):
-        self.logger.append(f"<font color='{MainWindow.LOG_COLORS[level]}'>" + str(message) + "</font>")
+        self.LOG.emit(message, level)
+
+    def flush_log(self):
+        """
+        Show the messages logged since the last call, the newest LOG_BATCH of them
+        """
+        pending, skipped = self.LOG.drain(self.LOG_BATCH)
+        if skipped:
+            pending.insert(0, (f"{skipped} messages skipped, see {self.LOG.path}", WARNING))
+        if not pending:
+            return
+        self.logger.setUpdatesEnabled(False)
+        for message, level in pending:
+            self.logger.appendHtml(f"<font color='{MainWindow.LOG_COLORS[level]}'>{html.escape(message)}</font>")
+        self.logger.setUpdatesEnabled(True)
+
+    def closeEvent(self, event):
+        self.LOG.close()
+        super().closeEvent(event)
+
+    def current_session(self) -> Session:
+        return self.controller.sessions[self.device_selector.currentIndex()]
 
     def current_interface(self) -> Interface:
-        return self.controller.interfaces[self.interface_selector.currentIndex()]
+        return self.current_session().interfaces[self.interface_selector.currentIndex()]
 
     def current_device(self) -> Device:
         return self.controller.devices[self.device_selector.currentIndex()]
@@ -165,25 +260,48 @@ class MainWindow(QDialog):
             if getattr(self, attr, False):
                 getattr(self, attr, False).setEnabled(not getattr(self, attr, False).isEnabled())
 
-    @pyqtSlot()
-    def on_query_finished(self):
-        self.on_query_change(False)
-
-    @pyqtSlot()
-    def on_interface_disconnect(self):
-        self.on_interface_change(False)
-
-    def on_interface_change(self, is_connected):
-        self.connect_btn.setText("Connect" if not is_connected else "Disconnect")
-        self.interface_box.setEnabled(not is_connected)
-        self.device_box.setEnabled(is_connected)
-        self.submit_btn.setEnabled(is_connected)
-
-    def on_query_change(self, is_started):
-        self.submit_btn.setText("Start" if not is_started else "Stop")
-        if not is_started:
-            self.submit_btn.setEnabled(True)
-        self.connect_btn.setEnabled(not is_started)
-        self.device_box.setEnabled(not is_started)
-
-
+    def on_query_finished(self, device):
+        if device is self.current_device():
+            self.plot_panel.stop()
+            self.update_controls()
+        self.update_status()
+
+    def update_controls(self):
+        """
+        Enable the controls according to the state of the selected session
+        """
+        session = self.current_session()
+        connected = session.state != Session.DISCONNECTED
+        running = session.state == Session.RUNNING
+
+        self.connect_btn.setText("Connect" if not connected else "Disconnect")
+        self.connect_btn.setEnabled(not running)
+        self.interface_box.setEnabled(not connected)
+        if hasattr(self, "device_widget"):
+            self.device_widget.setEnabled(connected and not running)
+        self.submit_btn.setText("Start" if not running else "Stop")
+        self.submit_btn.setEnabled(connected and not (running and session.device.halt))
+
+    def update_status(self):
+        total = 0
+        for row, session in enumerate(self.controller.sessions):
+            done, planned, rate = session.progress()
+            total += rate
+            interface = type(session.interface).__name__ if session.interface is not None else "-"
+            for col, text in enumerate([session.device.name, interface, session.state,
+                                        f"{done}/{planned}" if planned else str(done), f"{rate:.3f}"]):
+                self.status_table.setItem(row, col, widgets.QTableWidgetItem(text))
+        self.status_total.setText(f"{len(self.controller.running_sessions())} running, {total:.3f} rep/s in total")
+
+    def update_timings(self):
+        """
+        p50/p99 per phase of the selected device's query
+        """
+        timings = self.current_device().timings
+        stats = timings.stats() if timings is not None else {}
+        self.timing_table.setRowCount(len(stats))
+        self.timing_table.setVerticalHeaderLabels(list(stats))
+        for row, phase in enumerate(stats.values()):
+            for col, text in enumerate([str(phase["count"]), f"{phase['p50'] * 1e3:.3f}", f"{phase['p99'] * 1e3:.3f}",
+                                        f"{phase['max'] * 1e3:.3f}"]):
+                self.timing_table.setItem(row, col, widgets.QTableWidgetItem(text))
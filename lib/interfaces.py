@@ -1,17 +1,21 @@
 from abc import ABC, abstractmethod
 import time
+import socket
+import select
 import threading
+import queue
+from collections import deque
 
 import serial
-import PyQt5.QtWidgets as widgets
-from PyQt5.QtGui import QPalette, QColor
-from functools import partial
 
 # ToDo: refresh list every 5 sec
 
 
 class Interface(ABC):
     TERMINATION_CHAR = b'#'
+    # binary frames: marker, uint16 sample count, uint16 samples, uint16 checksum (all little-endian)
+    BINARY_MARKER = b'$'
+    BINARY_HEADER = 3
 
     NOT_CONNECTED = 0
     CONNECTED = 1
@@ -79,22 +83,69 @@ class Interface(ABC):
     def read(self, **kwargs):
         pass
 
+    @abstractmethod
+    def read_frame(self, timeout=None):
+        """
+        Block until a whole frame (ended by TERMINATION_CHAR, or a length-prefixed binary frame) is received
+        :param timeout: seconds to wait, None to wait until the frame arrives
+        :return: frame bytes without the termination char, None on timeout
+        """
+        pass
+
+    def instrument(self, timings):
+        """
+        Record the duration of every send, read and read_frame of this interface
+        :param timings: lib.timing.Timings, None to stop recording
+        """
+        for name in ["send", "read", "read_frame"]:
+            self.__dict__.pop(name, None)
+            if timings is not None:
+                setattr(self, name, timings.timed(name.replace('_', ' '), getattr(self, name)))
+
+    @staticmethod
+    def find_frame(buf, start=0):
+        """
+        Locate the next whole frame in a receive buffer
+        :param buf: received bytes
+        :param start: where the frame starts in buf
+        :return: (frame end, start of the next frame) or None if the frame is not complete yet
+        """
+        if buf[start:start + 1] == Interface.BINARY_MARKER:
+            if len(buf) - start < Interface.BINARY_HEADER:
+                return None
+            end = start + Interface.BINARY_HEADER + 2 * int.from_bytes(buf[start + 1:start + 3], 'little') + 2
+            return (end, end) if len(buf) >= end else None
+
+        end = buf.find(Interface.TERMINATION_CHAR, start)
+        return (end, end + 1) if end >= 0 else None
+
 
 class Serial(Interface):
-    def __init__(self, boud=115200, timeout=1):
+    READ_CHUNK = 4096  # max bytes per bulk read of the reader thread
+    FRAME_QUEUE_SIZE = 1024
+    INTERRUPT_QUIET = 0.05  # seconds without incoming bytes before an interrupt is done, the board finishes a B stream
+
+    def __init__(self, boud=115200, timeout=1, reader=False):
         super(Serial, self).__init__()
 
-        self.defaults = { "Boud": str(boud), "Timeout": str(timeout)}
+        self.defaults = { "Boud": str(boud), "Timeout": str(timeout), "Reader Thread": reader}
+        self._rx = bytearray()  # received bytes which are not a whole frame yet
+
+        # reader thread mode
+        self._reader = None
+        self._frames = None
+        self._interrupt = threading.Event()  # set by interupt(), cleared by the reader thread once it dropped everything
+        self.dropped_frames = 0
+        self.settings = None
 
     def open(self, **kwargs):
         try:
-            port = self.list_available_devices()[self.fields['Devices'].currentRow()][0]
+            # a typed port wins, comports() doesn't list pseudo-terminals like the simulator's /dev/pts/N
+            port = self.fields["Port"].text().strip() or self.list_available_devices()[self.fields['Devices'].currentRow()][0]
             boud = self.fields["Boud"].text()
             timeout = self.fields["Timeout"].text()
 
-            self.ser = serial.Serial(port=port, baudrate=int(boud), timeout=int(timeout))
-            self.status = Interface.CONNECTED
-            print(f"serial port oppend on {self.ser.name}")
+            self.open_port(port, int(boud), int(timeout), self.fields["Reader Thread"].isChecked())
 
             # self.always_read()
             return True
@@ -105,14 +156,52 @@ class Serial(Interface):
                 print(e)
             return False
 
+    def open_port(self, port, boud=115200, timeout=1, reader=False):
+        """
+        Open the port without the widget, e.g. in a worker process.
+        The arguments are kept in self.settings to reopen the same port elsewhere.
+        """
+        self.ser = serial.Serial(port=port, baudrate=boud, timeout=timeout)
+        self.settings = {"port": port, "boud": boud, "timeout": timeout, "reader": reader}
+        self.status = Interface.CONNECTED
+        print(f"serial port oppend on {self.ser.name}")
+
+        if reader:
+            self.start_reader()
+
     def close(self):
+        if self._reader is not None:
+            self.stop_reader()
         self.ser.close()
 
     def send(self, command: str):
         self.ser.write(command.encode())
 
     def interupt(self):
-        pass
+        if self._reader is not None and self._reader.is_alive():
+            # the reader thread drops its buffer and the queue itself, nothing it holds can slip in afterwards
+            self._interrupt.set()
+            if hasattr(self.ser, 'cancel_read'):
+                self.ser.cancel_read()
+            while self._interrupt.is_set() and self._reader is not None and self._reader.is_alive():
+                time.sleep(0.001)
+            return
+        self._drain_port()
+        self._rx.clear()
+        if self._frames is not None:
+            self._drop_frames()
+
+    def _drain_port(self):
+        self.ser.reset_input_buffer()
+        while True:
+            time.sleep(self.INTERRUPT_QUIET)
+            if not self.ser.in_waiting:
+                return
+            self.ser.reset_input_buffer()
+
+    def _drop_frames(self):
+        while not self._frames.empty():
+            self._frames.get_nowait()
 
     def is_connected(self) -> bool:
         return self.status == Interface.CONNECTED
@@ -148,14 +237,20 @@ class Serial(Interface):
         # port_controller.start()
 
     def get_widget(self):
+        import PyQt5.QtWidgets as widgets  # only the gui needs Qt, the cli runs without it
+
         res = widgets.QWidget()
         form_layout = widgets.QFormLayout()
 
         self.fields = {"Devices": widgets.QListWidget(),
+                       "Port": widgets.QLineEdit(),
                        "Boud": widgets.QLineEdit(),
-                       "Timeout": widgets.QLineEdit()}
+                       "Timeout": widgets.QLineEdit(),
+                       "Reader Thread": widgets.QCheckBox()}
+        self.fields["Port"].setPlaceholderText("or type a port, e.g. /dev/pts/3")
         self.fields["Boud"].setText(self.defaults["Boud"])
         self.fields["Timeout"].setText(self.defaults["Timeout"])
+        self.fields["Reader Thread"].setChecked(self.defaults["Reader Thread"])
 
         for fk in self.fields:
             form_layout.addRow(fk, self.fields[fk])
@@ -194,16 +289,105 @@ class Serial(Interface):
     #     x.start()
 
     def read(self, **kwargs):
-        if kwargs.get('until', None) is None:
-            o = self.ser.read_all()
+        if self._reader is not None:
+            if kwargs.get('until', None) is None:
+                o = b''
+                while not self._frames.empty():
+                    o += self._frames.get_nowait() + Interface.TERMINATION_CHAR
+            else:
+                o = self.read_frame(timeout=self.ser.timeout)
+                o = b'' if o is None else o + Interface.TERMINATION_CHAR
+        elif kwargs.get('until', None) is None:
+            o = bytes(self._rx) + self.ser.read_all()
+            self._rx.clear()
         else:
-            o = self.ser.read_until(b'#')
+            o = self.read_frame(timeout=self.ser.timeout)
+            if o is None:  # timed out, hand back whatever arrived
+                o = bytes(self._rx) + self.ser.read_all()
+                self._rx.clear()
+            else:
+                o += Interface.TERMINATION_CHAR
         try:
             o = o.decode()
         except Exception as e:
             pass
         return o
 
+    def read_frame(self, timeout=None):
+        if self._reader is not None:
+            try:
+                return self._frames.get(timeout=timeout)
+            except queue.Empty:
+                return None
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            found = self.find_frame(self._rx)
+            if found is not None:
+                frame = bytes(self._rx[:found[0]])
+                del self._rx[:found[1]]
+                return frame
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            # blocks in the driver until data arrives or the port timeout passes
+            self._rx += self.ser.read(max(1, self.ser.in_waiting))
+
+    def start_reader(self):
+        """
+        Read the port from a background thread, complete frames are queued for read_frame
+        :return:
+        """
+        self._frames = queue.Queue(maxsize=self.FRAME_QUEUE_SIZE)
+        self.dropped_frames = 0
+        self._interrupt.clear()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def stop_reader(self):
+        reader, self._reader = self._reader, None
+        if hasattr(self.ser, 'cancel_read'):
+            self.ser.cancel_read()
+        reader.join()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._frames.qsize() if self._reader is not None else 0
+
+    def _read_loop(self):
+        buf = bytearray(self._rx)  # frame bytes received so far, reused between reads
+        self._rx.clear()
+        while self._reader is not None:
+            try:
+                chunk = self.ser.read(min(max(1, self.ser.in_waiting), self.READ_CHUNK))
+                interrupted = self._interrupt.is_set()
+                if interrupted:
+                    self._drain_port()
+            except (serial.SerialException, OSError, TypeError):  # port closed under us
+                break
+            if interrupted:  # everything up to now, including this chunk, belongs to the interrupted commands
+                buf.clear()
+                self._drop_frames()
+                self._interrupt.clear()
+                continue
+            if not chunk:
+                continue
+
+            start = 0
+            buf += chunk
+            view = memoryview(buf)
+            found = self.find_frame(buf)
+            while found is not None:
+                try:
+                    self._frames.put_nowait(bytes(view[start:found[0]]))
+                except queue.Full:  # the replies are out of step from here on, run_query fails the sweep
+                    self.dropped_frames += 1
+                start = found[1]
+                found = self.find_frame(buf, start)
+            view.release()
+            if start:
+                del buf[:start]
+
 
 class Bluetooth(Interface):
     def __init__(self):
@@ -211,6 +395,248 @@ class Bluetooth(Interface):
 
 
 class Wifi(Interface):
-    def __init__(self):
-        pass
+    """
+    Board on the network: a persistent TCP connection to a static host and port, there is no discovery.
+    Nagle is off so every command leaves at once. Up to pipeline_depth W/R pairs may be in flight,
+    CimosAcquisition.run_query sends them ahead and reads the replies in order.
+    When the connection drops, send and read_frame reconnect with backoff and send again the commands
+    whose replies didn't come (the rest of a B stream only), so the query goes on where it stopped.
+    """
+    DEFAULT_PORT = 23  # what serial to wifi bridges (e.g. esp-link) listen on
+    READ_CHUNK = 65536
+    BATCH_COMMAND = 'B'  # streams several frames, see CimosAcquisition.BATCH_SWEEP
+    SELECT_COMMAND = 'W'  # CR step and channel the next R reads
+    READ_COMMAND = 'R'
+    RECONNECT_DELAY = 0.1  # seconds before the second reconnect attempt, doubled after every failed one
+    RECONNECT_ATTEMPTS = 6
+    INTERRUPT_QUIET = Serial.INTERRUPT_QUIET  # seconds without incoming bytes before an interrupt is done
+
+    def __init__(self, host="", port=DEFAULT_PORT, timeout=1, depth=1):
+        """
+        :param depth: W/R pairs in flight at once, 1 waits for every reply before the next command
+        """
+        super(Wifi, self).__init__()
+
+        self.defaults = {"Host": host, "Port": str(port), "Timeout": str(timeout), "Pipeline Depth": depth}
+        self.sock = None
+        self.settings = None
+        self.timeout = timeout
+        self.pipeline_depth = depth
+        self.reconnects = 0
+        self._rx = bytearray()  # received bytes which are not a whole frame yet
+        self._pending = deque()  # [command, replies still to come, sent by reconnect()] of the commands in flight
+        self._selected = None  # last W the board answered
+
+    def open(self, **kwargs):
+        try:
+            self.open_host(self.fields["Host"].text(), int(self.fields["Port"].text()), float(self.fields["Timeout"].text()),
+                           self.fields["Pipeline Depth"].value())
+            return True
+        except Exception as e:
+            self.status = Interface.CONNECTION_FAILED
+            if "log" in kwargs:
+                kwargs['log'](e)
+                print(e)
+            return False
+
+    def open_host(self, host, port=DEFAULT_PORT, timeout=1, depth=1):
+        """
+        Connect without the widget. The arguments are kept in self.settings.
+        """
+        self.settings = {"host": host, "port": port, "timeout": timeout, "depth": depth}
+        self.timeout = timeout
+        self.pipeline_depth = max(1, int(depth))
+        self._rx.clear()
+        self._pending.clear()
+        self._connect()
+        print(f"connected to {host}:{port}")
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.status = Interface.DISCONNECTED
+
+    def send(self, command: str):
+        if self.sock is None:  # closed, or the last reconnect failed
+            raise ConnectionError(f"not connected to {self.settings['host']}:{self.settings['port']}" if self.settings else "not connected")
+        self._pending.append([command, self.replies(command), False])
+        try:
+            self.sock.sendall(command.encode())
+        except OSError:
+            self.reconnect()  # sends it again with the other pending commands
 
+    def interupt(self):
+        self._rx.clear()
+        self._pending.clear()
+        self._selected = None
+        if self.sock is None:
+            return
+        try:  # until the connection is quiet, the board finishes a B stream meanwhile
+            while select.select([self.sock], [], [], self.INTERRUPT_QUIET)[0] and self.sock.recv(self.READ_CHUNK):
+                pass
+        except OSError:
+            pass
+
+    def is_connected(self) -> bool:
+        return self.status == Interface.CONNECTED
+
+    @staticmethod
+    def list_available_devices() -> list:
+        return []
+
+    def get_widget(self):
+        import PyQt5.QtWidgets as widgets
+
+        res = widgets.QWidget()
+        form_layout = widgets.QFormLayout()
+
+        self.fields = {"Host": widgets.QLineEdit(),
+                       "Port": widgets.QLineEdit(),
+                       "Timeout": widgets.QLineEdit(),
+                       "Pipeline Depth": widgets.QSpinBox()}
+        self.fields["Host"].setText(self.defaults["Host"])
+        self.fields["Host"].setPlaceholderText("192.168.4.1")
+        self.fields["Port"].setText(self.defaults["Port"])
+        self.fields["Timeout"].setText(self.defaults["Timeout"])
+        self.fields["Pipeline Depth"].setRange(1, 64)
+        self.fields["Pipeline Depth"].setValue(self.defaults["Pipeline Depth"])
+
+        for fk in self.fields:
+            form_layout.addRow(fk, self.fields[fk])
+        res.setLayout(form_layout)
+        return res
+
+    def read(self, **kwargs):
+        if kwargs.get('until', None) is None:
+            self._receive(0)
+            o = bytes(self._rx)
+            self._rx.clear()
+        else:
+            o = self.read_frame(timeout=self.timeout)
+            if o is None:  # timed out, the reply isn't coming any more
+                if self._pending:
+                    self._pending.popleft()
+                o = b''
+            else:
+                o += Interface.TERMINATION_CHAR
+        try:
+            o = o.decode()
+        except UnicodeDecodeError:
+            pass
+        return o
+
+    def read_frame(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            found = self.find_frame(self._rx)
+            if found is not None:
+                frame = bytes(self._rx[:found[0]])
+                del self._rx[:found[1]]
+                if not self._pending:
+                    return frame
+                head = self._pending[0]
+                head[1] -= 1
+                if head[1] <= 0:
+                    self._pending.popleft()
+                    if head[0][:1] == self.SELECT_COMMAND:
+                        self._selected = head[0]
+                if not head[2]:
+                    return frame
+                continue
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            self._receive(remaining)
+
+    def reconnect(self):
+        """
+        Connect again, right away and then after RECONNECT_DELAY, 2 * RECONNECT_DELAY ..., and send the commands
+        whose replies didn't come again. Frames received but not read yet are dropped, they come again too.
+        An R whose W was answered already gets the W again, the board may have moved on to a W sent after it.
+        :raise ConnectionError: when all RECONNECT_ATTEMPTS failed
+        """
+        self.close()
+        self._rx.clear()
+        pending = [[c, self.replies(c), False] for command, remaining, _ in self._pending for c in self.resend(command, remaining)]
+        if pending and pending[0][0][:1] == self.READ_COMMAND and self._selected is not None:
+            pending.insert(0, [self._selected, 1, True])  # its reply is not the caller's
+        self._pending = deque(pending)
+        commands = [command for command, _, _ in pending]
+
+        delay = self.RECONNECT_DELAY
+        for attempt in range(self.RECONNECT_ATTEMPTS):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+            try:
+                self._connect()
+                self.sock.sendall(''.join(commands).encode())
+            except OSError:
+                self.close()
+                continue
+            self.reconnects += 1
+            return
+        self.status = Interface.CONNECTION_FAILED
+        raise ConnectionError(f"lost {self.settings['host']}:{self.settings['port']}")
+
+    @staticmethod
+    def replies(command: str) -> int:
+        """
+        Number of frames the board answers command with
+        """
+        if command[:1] != Wifi.BATCH_COMMAND:
+            return 1
+        steps, step, channels = Wifi._batch(command)
+        return len(steps) * len(channels)
+
+    @staticmethod
+    def resend(command: str, remaining: int) -> list:
+        """
+        Commands which bring the last remaining replies of command
+        """
+        if command[:1] != Wifi.BATCH_COMMAND:
+            return [command]
+        steps, step, channels = Wifi._batch(command)
+        first, done_channels = divmod(len(steps) * len(channels) - remaining, len(channels))
+        res = []
+        if done_channels:  # the channels of a CR step which didn't come yet
+            res.append(f"{Wifi.BATCH_COMMAND}{steps[first]:07b}{steps[first]:07b}{1:07b}{channels[done_channels:]}\0")
+            first += 1
+        if first < len(steps):
+            res.append(f"{Wifi.BATCH_COMMAND}{steps[first]:07b}{steps[-1]:07b}{step:07b}{channels}\0")
+        return res
+
+    @staticmethod
+    def _batch(command: str) -> tuple:
+        """
+        :return: CR steps, step and channels of a batched sweep command
+        """
+        start, stop, step = int(command[1:8], 2), int(command[8:15], 2), max(1, int(command[15:22], 2))
+        return list(range(start, stop + 1, step)), step, command[22:].rstrip('\0')
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.settings['host'], self.settings['port']), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.status = Interface.CONNECTED
+
+    def _receive(self, timeout):
+        """
+        Wait up to timeout seconds (None for ever) for bytes and add them to the receive buffer
+        """
+        if self.sock is None:
+            raise ConnectionError("not connected")
+        try:
+            if timeout is not None and not select.select([self.sock], [], [], timeout)[0]:
+                return
+            chunk = self.sock.recv(self.READ_CHUNK)
+        except socket.timeout:  # None waits in steps of the socket timeout
+            return
+        except OSError:  # reset
+            chunk = b''
+        if not chunk:
+            self.reconnect()
+            return
+        self._rx += chunk
@@ -0,0 +1,108 @@
+import os
+import time
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+from .log_level import *
+
+
+class LogSink:
+    """
+    Log of the gui: emit() only queues the message, so any thread can log without touching Qt.
+    The gui thread drains the queue at a fixed rate. A message repeated back to back is shown once,
+    followed by a "last message repeated N times" line when another message comes or REPEAT_INTERVAL passed.
+    Every message is also written to a rotating file, repeats included.
+    """
+    MAX_PENDING = 10000  # messages queued between two drains, older ones are dropped from the display
+    REPEAT_INTERVAL = 5.0  # seconds between summaries of a message which keeps repeating
+    FILE_BYTES = 5 * 1024 * 1024
+    FILE_BACKUPS = 5
+    LEVEL_NAMES = {INFO: "INFO", ERROR: "ERROR", WARNING: "WARNING"}
+
+    def __init__(self, path: str = None):
+        """
+        :param path: log file, logs/biosalab.log of the repository by default, "" for no file
+        """
+        if path is None:
+            path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs", "biosalab.log")
+        self._lock = threading.Lock()
+        self._pending = deque(maxlen=self.MAX_PENDING)  # (message, level) to display
+        self._records = []  # (time, message, level) to write
+        self._last = None
+        self._repeats = 0
+        self._summarized = 0.0
+        self._dropped = 0
+
+        self.path = path
+        self.handler = None
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.handler = RotatingFileHandler(path, maxBytes=self.FILE_BYTES, backupCount=self.FILE_BACKUPS)
+
+    def emit(self, message, level=INFO):
+        message = str(message)
+        now = time.time()
+        with self._lock:
+            self._records.append((now, message, level))
+            if (message, level) == self._last:
+                self._repeats += 1
+                return
+            self._summarize()
+            self._push(message, level)
+            self._last = (message, level)
+            self._summarized = now
+
+    def drain(self, limit: int = None) -> tuple:
+        """
+        Take the messages to display and write the queued records to the file, called by the gui thread
+        :param limit: return only the newest limit messages
+        :return: [(message, level)], number of messages left out
+        """
+        with self._lock:
+            if self._repeats and time.time() - self._summarized > self.REPEAT_INTERVAL:
+                self._summarize()
+            pending, self._pending = list(self._pending), deque(maxlen=self.MAX_PENDING)
+            records, self._records = self._records, []
+            skipped, self._dropped = self._dropped, 0
+        if self.handler is not None and records:
+            self._write(records)
+        if limit is not None and len(pending) > limit:
+            skipped += len(pending) - limit
+            pending = pending[-limit:]
+        return pending, skipped
+
+    def close(self):
+        self.drain()
+        if self.handler is not None:
+            self.handler.close()
+
+    def _write(self, records: list):
+        """
+        One write of all records, the handler only rotates the file
+        """
+        lines, second, stamp = [], None, None
+        for created, message, level in records:
+            if int(created) != second:  # formatting the date is the slow part, once per second
+                second = int(created)
+                stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+            lines.append(f"{stamp},{int(created % 1 * 1000):03d} {self.LEVEL_NAMES[level]} {message}\n")
+        text = ''.join(lines)
+        handler = self.handler
+        if handler.stream is None:
+            handler.stream = handler._open()
+        if handler.stream.tell() + len(text) >= handler.maxBytes:
+            handler.doRollover()
+        handler.stream.write(text)
+        handler.stream.flush()
+
+    def _summarize(self):
+        if self._repeats:
+            self._push(f"last message repeated {self._repeats} times", self._last[1])
+            self._repeats = 0
+            self._summarized = time.time()
+
+    def _push(self, message, level):
+        if len(self._pending) == self.MAX_PENDING:
+            self._dropped += 1
+        self._pending.append((message, level))
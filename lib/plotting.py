@@ -0,0 +1,280 @@
+from collections import deque
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT
+from PyQt5.QtCore import QTimer
+import PyQt5.QtWidgets as widgets
+
+from .results import ResultStore
+
+
+def decimate_minmax(y: np.ndarray, columns: int):
+    """
+    Level of detail reduction of a time series: keep the min and max of every pixel column,
+    so spikes survive while the number of drawn points stays 2 * columns
+    :param y: the whole series
+    :param columns: horizontal resolution of the axes in pixels
+    :return: x, y to draw
+    """
+    if len(y) <= 2 * columns:
+        return np.arange(len(y)), y
+    edges = np.linspace(0, len(y), columns + 1).astype(np.int64)
+    x = np.repeat((edges[:-1] + edges[1:]) / 2, 2)
+    res = np.empty(2 * columns, dtype=y.dtype)
+    res[0::2] = np.minimum.reduceat(y, edges[:-1])
+    res[1::2] = np.maximum.reduceat(y, edges[:-1])
+    return x, res
+
+
+class LivePlot:
+    """
+    Keeps one persistent artist per channel and updates it in place on every tick.
+    2D axes are blitted: the static parts (axes, ticks, labels) are drawn once and cached,
+    only the data artists are redrawn. A full redraw only happens when the data outgrows the axes limits.
+    3D axes can't be blitted and are drawn whole, from a window of the newest repetitions so a tick
+    costs the same at any history length; snapshot_3d shows the whole history.
+    """
+    SWEEP_LINES = 20  # newest sweeps kept on a 2D sweep overlay
+    WATERFALL_ROWS = 256  # repetitions shown by the waterfall image
+    SURFACE_ROWS = 50  # newest sweeps on a live 3D surface
+    SCATTER_POINTS = 1000  # newest repetitions on a live 3D scatter of a Fixed Refrence query
+    SNAPSHOT_ROWS = 100  # max repetitions of a 3D snapshot
+    HEADROOM = 1.25  # limits grow by this factor, so full redraws stay rare
+
+    def __init__(self, fig, axes, vals: dict):
+        self.fig = fig
+        self.axes = axes
+        self.vals = vals
+
+        self.artists = {}  # channel -> artist (deque of lines for a sweep overlay)
+        self.plotted = {}  # channel -> rows already drawn
+        self.buffers = {}  # channel -> rolling waterfall image
+        self.results = None
+        self.full_draws = 0
+
+        self.blit = not any(ax.name == '3d' for ax in axes)
+        self.background = None
+        self.draw_cid = None
+        if self.blit:
+            for ax in axes:
+                ax.set_autoscale_on(False)
+            self.draw_cid = self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def update(self, results):
+        """
+        Draw the rows of results which are not on the axes yet
+        :param results: ResultStore of the running query
+        """
+        self.results = results
+        redraw = False
+        for ax_ind, k in enumerate(k for k in results.channels() if k != ResultStore.TIME):
+            data = results.view(k)
+            if self.plotted.get(k, 0) < len(data):
+                redraw |= self._update_channel(self.axes[ax_ind], k, data)
+                self.plotted[k] = len(data)
+
+        canvas = self.fig.canvas
+        if redraw or self.background is None:
+            self.full_draws += 1
+            canvas.draw()
+        else:
+            canvas.restore_region(self.background)
+            self._draw_artists()
+            canvas.blit(self.fig.bbox)
+
+    def sweep_channels(self) -> list:
+        if self.results is None or self.vals["Measurment Type"] != "Capacitance Sweep":
+            return []
+        return [k for k in self.results.channels() if k not in ('cide', ResultStore.TIME)]
+
+    def _update_channel(self, ax, k, data) -> bool:
+        """
+        :return: True if the axes changed and need a full redraw
+        """
+        if self.vals["Measurment Type"] == "Fixed Refrence" and self.vals['Plot Type'] == '3D':
+            first = max(0, len(data) - self.SCATTER_POINTS)
+            data = data[first:]
+            xs = np.full(len(data), self.vals['Refrence Value'])
+            ys = np.arange(first, first + len(data))
+            if k not in self.artists:
+                self.artists[k] = ax.scatter(xs, ys, data, cmap='coolwarm', c=data, alpha=.99)
+            else:
+                # no public setter for 3D offsets
+                self.artists[k]._offsets3d = (xs, ys, data)
+                self.artists[k].set_array(data)
+                self.artists[k].set_clim(np.min(data), np.max(data))
+            ax.set_ybound([first, first + len(data)])
+            ax.set_zbound([-1, np.max(data) + 10])
+            return True
+
+        if k in self.sweep_channels():
+            if self.vals['Plot Type'] == '3D':
+                return self._update_surface(ax, k, data)
+            if self.vals['Plot Type'] == 'Waterfall':
+                return self._update_waterfall(ax, k, data)
+
+            lines = self.artists.setdefault(k, deque())
+            new = data[max(self.plotted.get(k, 0), len(data) - self.SWEEP_LINES):]
+            for row in new:
+                if len(lines) < self.SWEEP_LINES:
+                    line = ax.plot(row, alpha=.5, animated=self.blit)[0]
+                else:
+                    line = lines.popleft()
+                    line.set_ydata(row)
+                lines.append(line)
+            return self._fit(ax, None, np.max(new))
+
+        # time series: fixed refrence samples or cide
+        x, y = decimate_minmax(data, max(1, int(ax.bbox.width)))
+        if k not in self.artists:
+            style = 'o' if k != 'cide' else '-'
+            self.artists[k] = ax.plot(x, y, style, alpha=.5, animated=self.blit)[0]
+        else:
+            self.artists[k].set_data(x, y)
+        return self._fit(ax, len(data), np.max(data))
+
+    def _update_surface(self, ax, k, data) -> bool:
+        """
+        Surface of the newest SURFACE_ROWS sweeps, a surface can't be changed in place so it is made again
+        """
+        if k in self.artists:
+            self.artists[k].remove()
+        first = max(0, len(data) - self.SURFACE_ROWS)
+        x, y = np.meshgrid(range(data.shape[1]), range(first, len(data)))
+        self.artists[k] = ax.plot_surface(x, y, data[first:], rstride=2, cstride=2, alpha=.99,
+                                          cmap='coolwarm', linewidth=1, antialiased=True)
+        ax.set_ybound([first, first + max(2, len(data) - first)])
+        ax.set_zbound([-1, np.max(data[first:]) + 10])
+        return True
+
+    def _update_waterfall(self, ax, k, data) -> bool:
+        """
+        CR x repetitions image of the newest WATERFALL_ROWS sweeps, scrolled in a preallocated buffer
+        """
+        redraw = False
+        if k not in self.artists:
+            self.buffers[k] = np.zeros((self.WATERFALL_ROWS, data.shape[1]), dtype=data.dtype)
+            self.artists[k] = ax.imshow(self.buffers[k], aspect='auto', origin='lower', interpolation='nearest',
+                                        cmap='coolwarm', vmin=0, vmax=100, animated=self.blit,
+                                        extent=(-.5, data.shape[1] - .5, -self.WATERFALL_ROWS + .5, .5))
+            ax.set_ylim(-self.WATERFALL_ROWS + .5, .5)
+            ax.set_ylabel('Repetitions (0 = newest)')
+            redraw = True
+
+        new = data[max(self.plotted.get(k, 0), len(data) - self.WATERFALL_ROWS):]
+        buf = self.buffers[k]
+        buf[:-len(new)] = buf[len(new):]
+        buf[-len(new):] = new
+        self.artists[k].set_data(buf)
+        if np.max(new) > self.artists[k].norm.vmax:
+            self.artists[k].set_clim(0, np.max(new) * self.HEADROOM)
+        return redraw
+
+    def snapshot_3d(self, fig):
+        """
+        Surface of the whole history of every sweep channel, decimated to SNAPSHOT_ROWS repetitions
+        :param fig: figure to draw on
+        """
+        channels = self.sweep_channels()
+        for i, k in enumerate(channels):
+            data = self.results.view(k)
+            step = max(1, -(-len(data) // self.SNAPSHOT_ROWS))
+            x, y = np.meshgrid(range(data.shape[1]), range(0, len(data), step))
+
+            ax = fig.add_subplot(1, len(channels), i + 1, projection='3d')
+            ax.plot_surface(x, y, data[::step], rstride=1, cstride=2, alpha=.99,
+                            cmap='coolwarm', linewidth=1, antialiased=True)
+            ax.set_xlabel('CR')
+            ax.set_ylabel('Time')
+            ax.set_zlabel('Number Of Pulses')
+            ax.set_title(f"{self.vals['Measurment Channel'].split('&')[i]}, {len(data)} repetitions")
+
+    def _fit(self, ax, x_max, y_max) -> bool:
+        changed = False
+        if y_max + 10 > ax.get_ybound()[1]:
+            ax.set_ybound([-1, (y_max + 10) * self.HEADROOM])
+            changed = True
+        if x_max is not None and x_max > ax.get_xbound()[1]:
+            ax.set_xbound([-1, x_max * self.HEADROOM + 1])
+            changed = True
+        return changed
+
+    def _draw_artists(self):
+        for artist in self.artists.values():
+            for a in (artist if isinstance(artist, deque) else [artist]):
+                self.fig.draw_artist(a)
+
+    def _on_draw(self, event):
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_artists()
+
+    def disconnect(self):
+        """
+        Stop caching the background on canvas draws, the canvas outlives this plot
+        """
+        if self.draw_cid is not None:
+            self.fig.canvas.mpl_disconnect(self.draw_cid)
+            self.draw_cid = None
+
+
+class PlotPanel(widgets.QGroupBox):
+    """
+    Live plot of the running query, embedded in the main window.
+    It only needs device.setup_axes(fig), device.vals and device.results.
+    """
+    INTERVAL = 300  # ms between plot updates
+
+    def __init__(self, parent=None):
+        super().__init__("Plot", parent)
+        self.figure = Figure()
+        self.canvas = FigureCanvasQTAgg(self.figure)
+        self.canvas.setMinimumSize(640, 400)
+
+        self.snapshot_btn = widgets.QPushButton("3D Snapshot")
+        self.snapshot_btn.setEnabled(False)
+        self.snapshot_btn.clicked.connect(self.show_snapshot)
+
+        layout = widgets.QVBoxLayout()
+        layout.addWidget(NavigationToolbar2QT(self.canvas, self))
+        layout.addWidget(self.canvas)
+        layout.addWidget(self.snapshot_btn)
+        self.setLayout(layout)
+
+        self.device = None
+        self.live_plot = None
+        self.snapshots = []
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update_plot)
+
+    def start(self, device):
+        if self.live_plot is not None:
+            self.live_plot.disconnect()
+        self.figure.clear()
+        self.device = device
+        self.live_plot = LivePlot(self.figure, device.setup_axes(self.figure), device.vals)
+        self.snapshot_btn.setEnabled(device.vals["Measurment Type"] == "Capacitance Sweep")
+        self.canvas.draw()
+        self.timer.start(self.INTERVAL)
+
+    def stop(self):
+        self.timer.stop()
+        if self.live_plot is not None:
+            self.update_plot()
+            self.live_plot.disconnect()
+
+    def update_plot(self):
+        self.live_plot.update(self.device.results)
+
+    def show_snapshot(self):
+        if self.live_plot is None or not self.live_plot.sweep_channels() or not len(self.device.results):
+            return
+        fig = Figure()
+        self.live_plot.snapshot_3d(fig)
+
+        window = FigureCanvasQTAgg(fig)
+        window.setWindowTitle(f"{self.device.name} 3D snapshot")
+        window.resize(800, 500)
+        window.show()
+        self.snapshots.append(window)  # keep a reference, or Qt closes it right away
@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ResultStore:
+    """
+    Results of a query, one preallocated (reps, *shape) array per channel.
+    A repetition is appended for all channels at once and only counted after it is fully written,
+    so readers (plots, savers) always see whole repetitions.
+    """
+    GROW_CHUNK = 256  # repetitions added when the store is full
+    TIME = 'time'  # channel of the repetition start times, ns since the query started
+
+    def __init__(self, reps: int = None):
+        self.capacity = reps if reps else self.GROW_CHUNK
+        self._data = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def add_channel(self, name: str, shape: tuple = (), dtype=np.int32):
+        self._data[name] = np.zeros((self.capacity,) + tuple(shape), dtype=dtype)
+
+    def channels(self) -> list:
+        return list(self._data.keys())
+
+    def dtype(self) -> np.dtype:
+        """
+        dtype of one repetition of all channels
+        """
+        return np.dtype([(name, arr.dtype, arr.shape[1:]) for name, arr in self._data.items()])
+
+    def __contains__(self, name):
+        return name in self._data
+
+    def __len__(self):
+        """
+        number of fully written repetitions
+        """
+        return self._rows
+
+    def append(self, row: dict):
+        """
+        Write one repetition
+        :param row: channel name -> values of this repetition, every channel must be present
+        """
+        with self._lock:
+            if self._rows == self.capacity:
+                self._grow()
+            for name, arr in self._data.items():
+                arr[self._rows] = row[name]
+            self._rows += 1
+
+    def view(self, name: str) -> np.ndarray:
+        """
+        Read-only view of the written repetitions of a channel, no copy
+        """
+        with self._lock:
+            res = self._data[name][:self._rows]
+        res.flags.writeable = False
+        return res
+
+    def _grow(self):
+        self.capacity += self.GROW_CHUNK
+        for name, arr in self._data.items():
+            new = np.zeros((self.capacity,) + arr.shape[1:], dtype=arr.dtype)
+            new[:len(arr)] = arr
+            self._data[name] = new
@@ -0,0 +1,112 @@
+import time
+import asyncio
+
+
+class RepetitionScheduler:
+    """
+    Starts repetitions on absolute deadlines of the monotonic clock, slot k is due at start + k * interval,
+    so sleeping slop and wall clock jumps don't add up over a long run.
+    When a repetition overruns its slot the policy decides what comes next:
+    SKIP drops the missed slots and waits for the next one on the grid,
+    CATCH_UP runs the missed slots back to back until it is on time again,
+    SHIFT starts the next repetition right away and moves the grid there.
+    """
+    SKIP = "Skip"
+    CATCH_UP = "Catch up"
+    SHIFT = "Shift"
+    POLICIES = [SKIP, CATCH_UP, SHIFT]
+
+    MAX_SLEEP = 0.5  # seconds between halt checks while waiting for a slot
+
+    def __init__(self, interval: float, policy=SKIP, on_overrun=None):
+        """
+        :param interval: seconds between repetition starts, 0 to run them back to back
+        :param on_overrun: called with the number of skipped slots when a repetition overruns its slot
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"unknown overrun policy {policy}")
+        self.interval = int(interval * 1e9)
+        self.policy = policy
+        self.on_overrun = on_overrun
+
+        self.start_ns = None  # monotonic
+        self.start_time_ns = None  # wall clock at start_ns
+        self.overruns = 0
+        self.skipped = 0
+        self._anchor = None  # (monotonic ns, slot) the grid runs from
+        self._slot = 0
+
+    def start(self) -> int:
+        """
+        Put slot 0 at now
+        :return: wall clock ns of the start, to turn the repetition timestamps into dates
+        """
+        self.start_ns = time.monotonic_ns()
+        self.start_time_ns = time.time_ns()
+        self._anchor = (self.start_ns, 0)
+        self._slot = 0
+        return self.start_time_ns
+
+    def deadline(self, slot: int) -> int:
+        return self._anchor[0] + (slot - self._anchor[1]) * self.interval
+
+    def repetitions(self, count: int, halted=lambda: False):
+        """
+        Wait for every slot and yield when its repetition should run, the caller runs it before the next iteration
+        :param count: slots of the run, skipped slots count too so the run still ends on time
+        :param halted: stops the wait and the run when it returns True
+        :return: yields (slot, start in ns since start())
+        """
+        if self.start_ns is None:
+            self.start()
+        while self._slot < count:
+            if not self._sleep_until(self.deadline(self._slot), halted):
+                return
+            yield self._slot, time.monotonic_ns() - self.start_ns
+            self._next()
+
+    async def async_repetitions(self, count: int, halted=lambda: False):
+        """
+        repetitions() for a query on an event loop, waits with asyncio.sleep so other queries run meanwhile
+        """
+        if self.start_ns is None:
+            self.start()
+        while self._slot < count:
+            while not halted():
+                remaining = self.deadline(self._slot) - time.monotonic_ns()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining / 1e9, self.MAX_SLEEP))
+            if halted():
+                return
+            yield self._slot, time.monotonic_ns() - self.start_ns
+            self._next()
+
+    def _next(self):
+        slot = self._slot + 1
+        now = time.monotonic_ns()
+        if self.interval and now > self.deadline(slot):
+            self.overruns += 1
+            missed = 0
+            if self.policy == self.SKIP:
+                first = self._anchor[1] + -(-(now - self._anchor[0]) // self.interval)  # first slot still ahead
+                missed = first - slot
+                slot = first
+            elif self.policy == self.SHIFT:
+                self._anchor = (now, slot)
+            self.skipped += missed
+            if self.on_overrun is not None:
+                self.on_overrun(missed)
+        self._slot = slot
+
+    def _sleep_until(self, deadline: int, halted) -> bool:
+        """
+        :return: False if halted meanwhile
+        """
+        while True:
+            if halted():
+                return False
+            remaining = deadline - time.monotonic_ns()
+            if remaining <= 0:
+                return True
+            time.sleep(min(remaining / 1e9, self.MAX_SLEEP))
@@ -0,0 +1,160 @@
+import numpy as np
+
+from .analysis import crossings
+
+
+class CrossingSearch:
+    """
+    Finds where a falling pulse count curve crosses a level without reading every CR step.
+    The first search brackets the crossing with a coarse pass, the next ones start from the last crossing
+    and widen the bracket (1, 2, 4 ... steps) only if the curve moved. Bisection then narrows the bracket
+    down to two adjacent steps, which are interpolated like analysis.crossings() does on full sweeps.
+    Assumes the curve falls monotonically around the crossing, verify() checks that against a full sweep.
+    """
+    COARSE_STEP = 16  # CR steps between the readouts of the coarse pass
+
+    def __init__(self, read, steps: int, level: float = None):
+        """
+        :param read: list of CR steps -> their pulse counts, None if the query was halted meanwhile
+        :param level: pulse count to find, None for half way between the maximum and the minimum after it
+        """
+        self.read = read
+        self.steps = steps
+        self.level = level
+        self.threshold = level  # of the last search
+
+        self.last = None  # first step below the threshold in the last search, the next search starts there
+        self.values = {}  # CR step -> pulse count, read by the last search
+        self.curve = None  # latest pulse count of every step, steps never read are interpolated
+        self.readouts = 0
+        self.searches = 0
+
+    def search(self):
+        """
+        :return: the crossing in CR steps, None if halted
+        """
+        steps = self.steps_to_read()
+        try:
+            crs = next(steps)
+            while True:
+                crs = steps.send(self.read(crs))
+        except StopIteration as done:
+            return done.value
+
+    async def search_async(self, read):
+        """
+        search() on an event loop
+        :param read: coroutine function, list of CR steps -> their pulse counts, None if halted
+        """
+        steps = self.steps_to_read()
+        try:
+            crs = next(steps)
+            while True:
+                crs = steps.send(await read(crs))
+        except StopIteration as done:
+            return done.value
+
+    def steps_to_read(self):
+        """
+        The search as a generator, for callers which read differently: it yields lists of CR steps
+        and is sent their pulse counts (None if halted), its return value is the result of search()
+        """
+        self.values = {}
+        bracket = yield from (self._coarse() if self.last is None or self.level is None else self._track(self.last))
+        if bracket is None:
+            return None
+        lo, hi = bracket
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if not (yield from self._measure([mid])):
+                return None
+            if self._above(mid):
+                lo = mid
+            else:
+                hi = mid
+
+        self.last = hi
+        self.searches += 1
+        self._update_curve()
+        if lo < 0:
+            return 0
+        if hi >= self.steps:
+            return self.steps - 1
+        return (1 / (self.values[hi] - self.values[lo])) * (self.threshold - self.values[lo]) + lo
+
+    def anchor(self, values: np.ndarray):
+        """
+        Start the next search from a full sweep
+        """
+        below = np.flatnonzero(values <= self.level)
+        self.last = int(below[0]) if len(below) else self.steps
+        self.curve = values.copy()
+
+    def verify(self, values: np.ndarray) -> float:
+        """
+        Run the search the next repetition would run on a full sweep
+        :return: its error against the crossing of the full sweep, in CR steps
+        """
+        offline = CrossingSearch(lambda crs: values[crs], self.steps, self.level)
+        offline.last = self.last
+        return offline.search() - crossings(values, self.level)[0]
+
+    def _coarse(self):
+        grid = list(range(0, self.steps, self.COARSE_STEP))
+        if not (yield from self._measure(grid)) or not (yield from self._measure([self.steps - 1])):
+            return None
+        grid = sorted(self.values)
+        values = [self.values[x] for x in grid]
+        start = 0
+        if self.level is None:
+            start = int(np.argmax(values))
+            self.threshold = (values[start] + min(values[start:])) // 2
+        for i in range(start, len(grid)):
+            if not self._above(grid[i]):
+                return (grid[i - 1] if i else -1), grid[i]
+        return self.steps - 1, self.steps
+
+    def _track(self, last: int):
+        lo, hi = last - 1, last
+        if not (yield from self._measure([lo, hi])):
+            return None
+        width = 1
+        while not self._above(lo):  # the crossing moved to lower steps
+            lo, hi = max(-1, lo - width), lo
+            width *= 2
+            if not (yield from self._measure([lo])):
+                return None
+        while self._above(hi):  # to higher steps
+            lo, hi = hi, min(self.steps, hi + width)
+            width *= 2
+            if not (yield from self._measure([hi])):
+                return None
+        return lo, hi
+
+    def _measure(self, crs: list) -> bool:
+        """
+        :return: False if halted
+        """
+        crs = [x for x in crs if 0 <= x < self.steps and x not in self.values]
+        if crs:
+            values = yield crs
+            if values is None:
+                return False
+            self.values.update(zip(crs, values))
+            self.readouts += len(crs)
+        return True
+
+    def _above(self, x: int) -> bool:
+        if x < 0:
+            return True
+        if x >= self.steps:
+            return False
+        return self.values[x] > self.threshold
+
+    def _update_curve(self):
+        steps = sorted(self.values)
+        values = [self.values[x] for x in steps]
+        if self.curve is None:
+            self.curve = np.interp(np.arange(self.steps), steps, values).astype(np.int32)
+        else:
+            self.curve[steps] = values
@@ -0,0 +1,356 @@
+"""
+CIMOS firmware simulator on a Linux pseudo-terminal, stands in for a board in load tests.
+Serial connects to simulator.port like to a /dev/ttyACM* port, Wifi to the host:port of a TcpSimulator.
+python -m lib.simulator --count 4 starts four boards and prints their ports, --tcp serves them over TCP.
+"""
+import os
+import pty
+import sys
+import time
+import tty
+import queue
+import select
+import socket
+import argparse
+import threading
+
+import numpy as np
+
+from .interfaces import Interface
+from .codec import encode_binary_frame
+
+
+class FirmwareSimulator:
+    """
+    Speaks the protocol CimosDevice uses:
+    G<3 bits> CCO resolution, S<n>\\0 samples per read, W<7 bits><channel> CR and channel, R read,
+    and the optional ? capabilities, F<0|1> binary readout and B<start><stop><step><channels>\\0 batched sweep.
+    Every command is answered with a TERMINATION_CHAR terminated reply, R and B with sample frames.
+
+    The pulse counts follow a falling sigmoid of the CR step per channel, scaled by the CCO resolution,
+    with gaussian noise.
+    """
+    CAPABILITIES = "BF"
+    CENTERS = {' ': 64, '1': 80, '0': 48}  # CR step where the curve of a channel falls, per channel bit
+    BITS_PER_BYTE = 10  # 8N1
+    POLL = 0.1  # seconds between stop checks while idle
+
+    def __init__(self, amplitude=60.0, offset=5.0, width=8.0, noise=1.0, latency=0.0, command_latency=None,
+                 boud=None, capabilities=CAPABILITIES, centers=None, seed=None):
+        """
+        :param amplitude: pulse count above offset on the flat side of the curve, at CCO resolution 000
+        :param width: CR steps the curve needs to fall
+        :param noise: standard deviation of the samples
+        :param latency: seconds before every reply
+        :param command_latency: command letter -> seconds, instead of latency for these commands
+        :param boud: throttle replies to this baud rate, None for as fast as possible
+        :param capabilities: optional commands to support, "" for an old firmware
+        """
+        self.amplitude = amplitude
+        self.offset = offset
+        self.width = width
+        self.noise = noise
+        self.latency = latency
+        self.command_latency = command_latency or {}
+        self.boud = boud
+        self.capabilities = capabilities
+        self.centers = dict(self.CENTERS, **(centers or {}))
+        self.rng = np.random.default_rng(seed)
+
+        self.gain = 1
+        self.n_sample = 1
+        self.cr = 0
+        self.channel = ' '
+        self.binary = False
+        self.commands = 0
+
+        self.port = None
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._running = False
+        self._link_free = 0.0  # when the throttled link has sent everything written so far
+
+    def start(self) -> str:
+        """
+        :return: path of the port to connect to
+        """
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def curve(self, cr, channel: str) -> np.ndarray:
+        """
+        Noise free pulse count of channel at CR step(s) cr
+        """
+        center = self.centers.get(channel, self.CENTERS[' '])
+        return self.offset + self.gain * self.amplitude / (1 + np.exp((np.asarray(cr) - center) / self.width))
+
+    def samples(self, cr: int, channel: str) -> np.ndarray:
+        values = self.curve(cr, channel) + self.rng.normal(0, self.noise, self.n_sample)
+        return np.clip(np.rint(values), 0, 0xFFFF).astype(np.int64)
+
+    def frame(self, cr: int, channel: str) -> bytes:
+        values = self.samples(cr, channel)
+        if self.binary:
+            return encode_binary_frame(values)
+        return ','.join(str(v) for v in values).encode() + Interface.TERMINATION_CHAR
+
+    def handle(self, buf: bytearray) -> int:
+        """
+        Execute the command at the start of buf
+        :return: number of bytes used, 0 if the command is not complete yet
+        """
+        command = chr(buf[0])
+        if command == 'G':
+            if len(buf) < 4:
+                return 0
+            self.gain = 1 + buf[1:4].count(b'1')
+            self.reply(command, Interface.TERMINATION_CHAR)
+            return 4
+        if command == 'S':
+            end = buf.find(b'\0')
+            if end < 0:
+                return 0
+            self.n_sample = max(1, int(buf[1:end]))
+            self.reply(command, Interface.TERMINATION_CHAR)
+            return end + 1
+        if command == 'W':
+            if len(buf) < 9:
+                return 0
+            self.cr = int(buf[1:8], 2)
+            self.channel = chr(buf[8])
+            self.reply(command, Interface.TERMINATION_CHAR)
+            return 9
+        if command == 'R':
+            self.reply(command, self.frame(self.cr, self.channel))
+            return 1
+        if command == '?' and self.capabilities:
+            self.reply(command, self.capabilities.encode() + Interface.TERMINATION_CHAR)
+            return 1
+        if command == 'F' and 'F' in self.capabilities:
+            if len(buf) < 2:
+                return 0
+            self.binary = buf[1:2] == b'1'
+            self.reply(command, Interface.TERMINATION_CHAR)
+            return 2
+        if command == 'B' and 'B' in self.capabilities:
+            end = buf.find(b'\0')
+            if end < 0:
+                return 0
+            start, stop, step = int(buf[1:8], 2), int(buf[8:15], 2), max(1, int(buf[15:22], 2))
+            channels = buf[22:end].decode()
+            for cr in range(start, stop + 1, step):
+                for channel in channels:
+                    self.reply(command, self.frame(cr, channel))
+            return end + 1
+        return 1  # unknown byte, old firmwares ignore it too
+
+    def reply(self, command: str, data: bytes):
+        latency = self.command_latency.get(command, self.latency)
+        if latency:
+            time.sleep(latency)
+        if self.boud:
+            now = time.monotonic()
+            self._link_free = max(self._link_free, now) + len(data) * self.BITS_PER_BYTE / self.boud
+            if self._link_free > now:
+                time.sleep(self._link_free - now)
+        self.write(data)
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._master, view):]
+
+    def _run(self):
+        buf = bytearray()
+        while self._running:
+            if not select.select([self._master], [], [], self.POLL)[0]:
+                continue
+            try:
+                buf += os.read(self._master, 4096)
+            except OSError:  # port closed
+                break
+            while buf:
+                used = self.handle(buf)
+                if not used:
+                    break
+                self.commands += 1
+                del buf[:used]
+
+
+class TcpSimulator(FirmwareSimulator):
+    """
+    FirmwareSimulator behind a TCP listener, stands in for a board on wifi. Wifi connects to simulator.port (host:port).
+    One client at a time, a client which reconnects finds the board as it left it.
+    rtt delays every reply like a network does, without holding up the commands behind it.
+    """
+
+    def __init__(self, host="127.0.0.1", tcp_port=0, rtt=0.0, **kwargs):
+        """
+        :param tcp_port: 0 for any free port
+        :param rtt: seconds from a command to its reply on the link
+        :param kwargs: FirmwareSimulator arguments
+        """
+        super().__init__(**kwargs)
+        self.host = host
+        self.tcp_port = tcp_port
+        self.rtt = rtt
+        self.connections = 0
+
+        self._server = None
+        self._client = None
+        self._outbox = None  # (due, client, data) of the delayed replies
+        self._sender = None
+
+    def start(self) -> str:
+        """
+        :return: host:port to connect to
+        """
+        self._server = socket.create_server((self.host, self.tcp_port))
+        self.tcp_port = self._server.getsockname()[1]
+        self.port = f"{self.host}:{self.tcp_port}"
+        self._outbox = queue.Queue()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._sender = threading.Thread(target=self._send_loop, daemon=True)
+        self._sender.start()
+        return self.port
+
+    def stop(self):
+        self._running = False
+        self._outbox.put(None)
+        self._thread.join()
+        self._sender.join()
+        self._server.close()
+        self.drop()
+
+    def drop(self):
+        """
+        Close the connection of the client, like a board which lost the network
+        """
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            client.close()
+
+    def write(self, data: bytes):
+        if self.rtt:
+            self._outbox.put((time.monotonic() + self.rtt, self._client, data))
+        else:
+            self._send(self._client, data)
+
+    def _send(self, client, data: bytes):
+        if client is not None and client is self._client:  # replies to a dropped connection are lost
+            try:
+                client.sendall(data)
+            except OSError:
+                pass
+
+    def _send_loop(self):
+        while True:
+            item = self._outbox.get()
+            if item is None:
+                return
+            due, client, data = item
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._send(client, data)
+
+    def _run(self):
+        while self._running:
+            if not select.select([self._server], [], [], self.POLL)[0]:
+                continue
+            client = self._client = self._server.accept()[0]
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections += 1
+            buf = bytearray()
+            while self._running and self._client is client:
+                try:
+                    if not select.select([client], [], [], self.POLL)[0]:
+                        continue
+                    data = client.recv(4096)
+                except (OSError, ValueError):  # dropped meanwhile
+                    break
+                if not data:
+                    break
+                buf += data
+                while buf:
+                    used = self.handle(buf)
+                    if not used:
+                        break
+                    self.commands += 1
+                    del buf[:used]
+            if self._client is client:
+                self.drop()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Simulated CIMOS boards on pseudo-terminals")
+    parser.add_argument("--count", type=int, default=1, help="number of boards")
+    parser.add_argument("--amplitude", type=float, default=60.0)
+    parser.add_argument("--offset", type=float, default=5.0)
+    parser.add_argument("--width", type=float, default=8.0)
+    parser.add_argument("--noise", type=float, default=1.0)
+    parser.add_argument("--latency", action="append", default=[],
+                        help="seconds before every reply, or <command>=<seconds>, can be repeated")
+    parser.add_argument("--boud", type=int, default=None, help="throttle replies to this baud rate")
+    parser.add_argument("--capabilities", default=FirmwareSimulator.CAPABILITIES,
+                        help="optional commands to support, '' for an old firmware")
+    parser.add_argument("--tcp", action="store_true", help="serve the boards on TCP ports instead of pseudo-terminals")
+    parser.add_argument("--host", default="127.0.0.1", help="address the TCP boards listen on")
+    parser.add_argument("--rtt", type=float, default=0.0, help="seconds of network round trip of the TCP boards")
+    args = parser.parse_args(argv)
+
+    latency, command_latency = 0.0, {}
+    for item in args.latency:
+        command, _, seconds = item.rpartition('=')
+        if command:
+            command_latency[command] = float(seconds)
+        else:
+            latency = float(seconds)
+
+    kwargs = dict(amplitude=args.amplitude, offset=args.offset, width=args.width, noise=args.noise, latency=latency,
+                  command_latency=command_latency, boud=args.boud, capabilities=args.capabilities)
+    if args.tcp:
+        simulators = [TcpSimulator(args.host, rtt=args.rtt, seed=i, **kwargs) for i in range(args.count)]
+    else:
+        simulators = [FirmwareSimulator(seed=i, **kwargs) for i in range(args.count)]
+    for simulator in simulators:
+        print(simulator.start(), flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for simulator in simulators:
+        simulator.stop()
+        print(f"{simulator.port}: {simulator.commands} commands", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of durations in ns: power of two buckets, each split into linear sub buckets,
+    so every value is kept to within 1/2**(SUB_BITS-1) relative error in constant memory.
+    Recording is an index computation and an increment.
+    """
+    SUB_BITS = 5  # 16 to 32 sub buckets per power of two, about 3% precision
+    HALF = 1 << (SUB_BITS - 1)
+    BUCKETS = (64 << (SUB_BITS - 1)) + (1 << SUB_BITS)
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0  # ns
+        self.max = 0
+
+    def record(self, ns: int):
+        shift = ns.bit_length() - self.SUB_BITS
+        if shift < 0:
+            shift = 0
+        self.counts[(shift << (self.SUB_BITS - 1)) + (ns >> shift)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    @classmethod
+    def highest_value(cls, index: int) -> int:
+        """
+        Largest ns value which falls in bucket index
+        """
+        if index < 2 * cls.HALF:
+            return index
+        shift = (index >> (cls.SUB_BITS - 1)) - 1
+        return ((index - (shift << (cls.SUB_BITS - 1))) << shift) + (1 << shift) - 1
+
+    def percentile(self, p: float) -> int:
+        """
+        :param p: 0 to 100
+        :return: ns, 0 if nothing was recorded
+        """
+        if not self.count:
+            return 0
+        target = max(1, -(-self.count * p // 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self.highest_value(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def copy(self) -> 'LatencyHistogram':
+        res = LatencyHistogram.__new__(LatencyHistogram)
+        res.counts = self.counts[:]
+        res.count, res.total, res.max = self.count, self.total, self.max
+        return res
+
+
+class _Phase:
+    """
+    Context manager which records its duration, one per phase name and reused, so phases of the same name can't nest
+    """
+    __slots__ = ["histogram", "t0"]
+
+    def __init__(self, histogram: LatencyHistogram):
+        self.histogram = histogram
+        self.t0 = 0
+
+    def __enter__(self):
+        self.t0 = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter_ns() - self.t0)
+
+
+class Timings:
+    """
+    Latency histograms of a query by name: the phases of the query loop and the interface calls.
+    One thread records, any thread can read the stats or take a snapshot.
+    """
+
+    def __init__(self):
+        self.histograms = OrderedDict()
+        self._phases = {}
+        self._lock = threading.Lock()  # histograms are added while other threads read them
+
+    def __getitem__(self, name: str) -> LatencyHistogram:
+        return self.histograms[name]
+
+    def __contains__(self, name: str):
+        return name in self.histograms
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        """
+        The histogram of name, created on first use
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms[name] = LatencyHistogram()
+        return histogram
+
+    def record(self, name: str, ns: int):
+        self.histogram(name).record(ns)
+
+    def phase(self, name: str) -> _Phase:
+        """
+        with timings.phase("parse"): ... records the duration of the block
+        """
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = _Phase(self.histogram(name))
+        return phase
+
+    def timed(self, name: str, fn):
+        """
+        :return: fn which records its duration under name
+        """
+        record = self.histogram(name).record
+
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(time.perf_counter_ns() - t0)
+        return wrapper
+
+    def timed_async(self, name: str, fn):
+        """
+        timed() for a coroutine function, the duration includes the waits
+        """
+        record = self.histogram(name).record
+
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter_ns()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                record(time.perf_counter_ns() - t0)
+        return wrapper
+
+    def snapshot(self) -> 'Timings':
+        """
+        Copy of the histograms so far, safe to pickle or read while the query goes on
+        """
+        res = Timings()
+        with self._lock:
+            res.histograms = OrderedDict([(name, histogram.copy()) for name, histogram in self.histograms.items()])
+        return res
+
+    def __getstate__(self):  # phases are rebuilt on demand, e.g. after the worker process sent a copy
+        with self._lock:
+            return {"histograms": OrderedDict([(name, histogram.copy()) for name, histogram in self.histograms.items()])}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.histograms = state["histograms"]
+
+    def stats(self) -> OrderedDict:
+        """
+        :return: name -> count and mean, p50, p99, max in seconds
+        """
+        res = OrderedDict()
+        with self._lock:
+            histograms = list(self.histograms.items())
+        for name, histogram in histograms:
+            res[name] = OrderedDict([("count", histogram.count),
+                                     ("mean", histogram.mean / 1e9),
+                                     ("p50", histogram.percentile(50) / 1e9),
+                                     ("p99", histogram.percentile(99) / 1e9),
+                                     ("max", histogram.max / 1e9)])
+        return res
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.stats(), f, indent=2)
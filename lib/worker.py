@@ -0,0 +1,218 @@
+import queue
+import threading
+import multiprocessing
+from functools import partial
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .log_level import *
+from .interfaces import Serial
+from .results import ResultStore
+
+# the gui process must not be forked, the worker starts from a fresh interpreter
+CONTEXT = multiprocessing.get_context("spawn")
+
+
+class SharedRing:
+    """
+    Single producer, single consumer ring of repetitions in shared memory.
+    The producer bumps the write counter only after a record is fully written,
+    a consumer that falls more than one ring behind loses the overwritten records.
+    """
+    HEADER = 8  # uint64 write counter
+    SIZE = 1024  # repetitions
+
+    def __init__(self, dtype, size=SIZE, name: str = None):
+        """
+        :param dtype: record dtype, one field per result channel
+        :param name: attach to the ring of another process, None to create one
+        """
+        self.dtype = np.dtype(dtype)
+        self.size = size
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None,
+                                              size=self.HEADER + self.dtype.itemsize * size)
+        self._count = np.ndarray((1,), np.uint64, self.shm.buf)
+        self._records = np.ndarray((size,), self.dtype, self.shm.buf, offset=self.HEADER)
+        self._read = 0
+        self.lost = 0
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def push(self, row: dict):
+        i = int(self._count[0])
+        for name in self.dtype.names:
+            self._records[name][i % self.size] = row[name]
+        self._count[0] = i + 1
+
+    def pull(self) -> np.ndarray:
+        """
+        Copy the records written since the last pull
+        """
+        count = int(self._count[0])
+        start = max(self._read, count - self.size)
+        res = self._records[np.arange(start, count) % self.size]
+        # drop what the producer overwrote while we copied
+        skip = max(0, int(self._count[0]) - self.size - start)
+        self.lost += start - self._read + skip
+        self._read = count
+        return res[skip:]
+
+    def close(self, unlink=False):
+        del self._count, self._records
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class RingStore(ResultStore):
+    """
+    ResultStore of the worker process, every repetition is published to a SharedRing for the gui as well
+    """
+
+    def __init__(self, messages, reps: int = None):
+        super().__init__(reps)
+        self.messages = messages
+        self.ring = None
+
+    def append(self, row: dict):
+        super().append(row)
+        if self.ring is None:  # the channels are known by now
+            self.ring = SharedRing(self.dtype())
+            self.messages.put((AcquisitionProcess.RESULTS, self.ring.name, self.dtype().descr, self.capacity))
+        self.ring.push(row)
+
+
+class QueueLog:
+    """
+    Stands in for the main window as the logger of the worker process
+    """
+
+    class _Signal:
+        def __init__(self, messages):
+            self.messages = messages
+
+        def emit(self, message, level=INFO):
+            self.messages.put((AcquisitionProcess.LOG, str(message), level))
+
+    def __init__(self, messages):
+        self.LOG = QueueLog._Signal(messages)
+
+
+def acquire(device_type, name: str, settings: dict, vals: dict, output_name: str, halt_event, messages):
+    """
+    Entry point of the worker process, owns the serial port for the whole query
+    """
+    logger = QueueLog(messages)
+    device = device_type(name)
+    device.halt_event = halt_event
+
+    interface = Serial()
+    try:
+        interface.open_port(**settings)
+    except Exception as e:
+        logger.LOG.emit(e, ERROR)
+        return
+    done = threading.Event()
+
+    def publish_timings():  # the histograms are small, a copy per interval is cheap
+        while not done.wait(AcquisitionProcess.TIMINGS_INTERVAL):
+            timings = device.timings
+            if timings is not None:  # the queue pickles later in its feeder thread, hand it a snapshot
+                messages.put((AcquisitionProcess.TIMINGS, timings.snapshot()))
+    threading.Thread(target=publish_timings, daemon=True).start()
+    try:
+        vals = device.calibrate(interface, vals, logger)
+        messages.put((AcquisitionProcess.VALS, vals))
+        device.RESULT_STORE = partial(RingStore, messages)
+        device.run_query(interface, vals, logger, output_name=output_name)
+    finally:
+        done.set()
+        messages.put((AcquisitionProcess.TIMINGS, device.timings))
+        interface.close()
+
+
+class AcquisitionProcess(threading.Thread):
+    """
+    Runs a query in a worker process which owns the serial port, so parsing and plotting don't share a GIL.
+    This thread stays in the gui process: it hands the port over, copies the published repetitions
+    into device.results and forwards the logs. Halting goes through a shared event (device.halt_event).
+    Only Serial interfaces can be handed over.
+    """
+    LOG = 0
+    RESULTS = 1
+    VALS = 2
+    TIMINGS = 3
+
+    POLL = 0.05  # seconds between ring reads
+    TIMINGS_INTERVAL = 1.0  # seconds between timing updates from the worker
+
+    def __init__(self, device, interface, vals: dict, logger, output_name: str):
+        super().__init__(daemon=True)
+        self.device = device
+        self.interface = interface
+        self.vals = vals
+        self.logger = logger
+        self.output_name = output_name
+
+        self.halt_event = CONTEXT.Event()
+        self.messages = CONTEXT.Queue()
+        self.ring = None
+
+    def run(self):
+        settings = self.interface.settings
+        self.interface.close()
+        self.device.halt_event = self.halt_event
+
+        process = CONTEXT.Process(target=acquire, args=(type(self.device), self.device.name, settings, self.vals,
+                                                        self.output_name, self.halt_event, self.messages), daemon=True)
+        process.start()
+        try:
+            while process.is_alive() or not self.messages.empty():
+                try:
+                    self.handle(self.messages.get(timeout=self.POLL))
+                except queue.Empty:
+                    pass
+                self.pull()
+        finally:
+            process.join()
+            self.release_ring()
+            self.device.halt_event = None
+            self.device.halt = False
+            self.interface.open_port(**settings)
+            if process.exitcode:
+                self.logger.LOG.emit(f"Worker process exited with {process.exitcode}", ERROR)
+            self.device.stop_query.emit()
+
+    def handle(self, message: tuple):
+        if message[0] == self.LOG:
+            self.logger.LOG.emit(message[1], message[2])
+        elif message[0] == self.VALS:
+            self.device.vals = message[1]
+        elif message[0] == self.TIMINGS:
+            self.device.timings = message[1]
+        elif message[0] == self.RESULTS:
+            self.release_ring()
+            self.ring = SharedRing(np.dtype([tuple(f) for f in message[2]]), name=message[1])
+            results = ResultStore(message[3])
+            for name in self.ring.dtype.names:
+                results.add_channel(name, self.ring.dtype[name].shape, self.ring.dtype[name].base)
+            self.device.results = results
+
+    def pull(self):
+        if self.ring is None:
+            return
+        names = self.ring.dtype.names
+        for record in self.ring.pull():
+            self.device.results.append({name: record[name] for name in names})
+
+    def release_ring(self):
+        if self.ring is None:
+            return
+        self.pull()
+        if self.ring.lost:
+            self.logger.LOG.emit(f"{self.ring.lost} repetitions were overwritten before the gui read them", WARNING)
+        self.ring.close(unlink=True)
+        self.ring = None
@@ -0,0 +1,143 @@
+import os
+import time
+import queue
+import threading
+
+import numpy as np
+
+from .results import ResultStore
+
+
+class OutputWriter:
+    """
+    Writes query outputs to one csv file per channel from a background thread.
+    The acquisition thread only hands arrays over, formatting and disk io happen here.
+    Every block handed over becomes one line of its channel file.
+    """
+    FSYNC_NEVER = 0  # leave it to the OS
+    FSYNC_INTERVAL = 1  # at most every fsync_interval seconds
+    FSYNC_ALWAYS = 2  # after every batch of blocks
+
+    QUEUE_SIZE = 256  # blocks waiting to be written, the acquisition blocks when it is full
+    PUT_POLL = 0.5  # seconds, how often a blocked acquisition checks whether the writer thread died
+    FILE_BUFFER = 1 << 20
+
+    MEASURED = 'measured'  # flag of repetitions whose raw samples were read in full, adaptive queries only
+    ROW_CHANNELS = (ResultStore.TIME, 'cide')  # processed values stored in csv
+
+    def __init__(self, file_name: str, fsync=FSYNC_INTERVAL, fsync_interval=5.0, queue_size=QUEUE_SIZE, flag_measured=False):
+        """
+        :param file_name: path with a {channel} placeholder
+        :param flag_measured: write a measured file, 1 for the repetitions that have raw sample lines
+        """
+        self.file_name = file_name
+        self.flag_measured = flag_measured
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+
+        self.files = {}
+        self.formats = {}  # (values per line, integer) -> line format
+        self.error = None
+        self.last_sync = time.monotonic()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, channel: str, block: np.ndarray):
+        """
+        Queue a block for writing, the writer keeps a reference so don't modify it afterwards
+        """
+        self._put((channel, block))
+
+    def write_repetition(self, raw: dict, row: dict, measured=True):
+        """
+        Queue one repetition
+        :param raw: channel name -> raw samples, one csv line per channel
+        :param row: the processed results row, only its start time and cide are stored in csv (a file each)
+        :param measured: False for a searched repetition, raw is stale and not written
+        """
+        if measured:
+            for channel, block in raw.items():
+                self.write(channel, block.copy())
+        for channel in self.ROW_CHANNELS:
+            if channel in row:
+                self.write(channel, np.array([row[channel]]))
+        if self.flag_measured:
+            self.write(self.MEASURED, np.array([int(measured)]))
+
+    def close(self):
+        """
+        Write everything queued, sync and close the files
+        """
+        if self._thread.is_alive():
+            self._put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _put(self, item):
+        while True:  # a full queue only drains while the writer thread runs
+            if self.error is not None:
+                raise self.error
+            if not self._thread.is_alive():
+                self.error = RuntimeError("the output writer thread has stopped")
+                raise self.error
+            try:
+                self._queue.put(item, timeout=self.PUT_POLL)
+                return
+            except queue.Full:
+                pass
+
+    def _run(self):
+        try:
+            running = True
+            while running:
+                batch = [self._queue.get()]
+                while not self._queue.empty():  # take whatever piled up meanwhile
+                    batch.append(self._queue.get_nowait())
+                if batch[-1] is None:
+                    batch.pop()
+                    running = False
+
+                for channel, block in batch:
+                    self._write_block(channel, block)
+                if not running:
+                    self._finish()
+                self._sync(force=not running)
+        except Exception as e:  # reported to the acquisition thread on the next write/close
+            self.error = e
+        finally:
+            for out in self.files.values():
+                out.close()
+
+    def _finish(self):
+        """
+        Called once after the last block, before the final sync
+        """
+        pass
+
+    def _file(self, channel):
+        if channel not in self.files:
+            path = self.file_name.format(channel=channel)
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.files[channel] = open(path, 'a', buffering=self.FILE_BUFFER)
+        return self.files[channel]
+
+    def _write_block(self, channel, block):
+        block = np.asarray(block)
+        key = (block.size, block.dtype.kind in 'iub')
+        if key not in self.formats:
+            self.formats[key] = ','.join(['%d' if key[1] else '%r'] * block.size) + '\n'
+        # one C level format of the whole line, ~2x faster than str() per value
+        self._file(channel).write(self.formats[key] % tuple(block.ravel().tolist()))
+
+    def _sync(self, force=False):
+        for out in self.files.values():
+            out.flush()
+        if self.fsync == self.FSYNC_NEVER:
+            return
+        if force or self.fsync == self.FSYNC_ALWAYS or time.monotonic() - self.last_sync >= self.fsync_interval:
+            for out in self.files.values():
+                os.fsync(out.fileno())
+            self.last_sync = time.monotonic()
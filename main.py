@@ -1,12 +1,21 @@
+import sys
+import argparse
+
+from PyQt5.QtWidgets import QApplication
+
 # from lib.interfaces import *
 from lib.controller import *
 from lib.gui import *
 
 
 def main():
-    app = QApplication(sys.argv)
-    # window = MainWindow(Controller(devices=[CimosDevice(f"device{i}") for i in range(3)], interfaces=[Serial()]))
-    window = MainWindow(Controller(devices=[CimosDevice()], interfaces=[Serial()]))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=1, help="number of boards to drive at once")
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    devices = [CimosDevice()] if args.devices == 1 else [CimosDevice(f"device{i}") for i in range(args.devices)]
+    window = MainWindow(Controller(devices=devices, interfaces=[Serial(), Wifi()]))
     window.show()
     sys.exit(app.exec_())
 
@@ -0,0 +1,69 @@
+"""
+The vectorized crossings of lib.analysis against the per row loops the query used before them
+"""
+import numpy as np
+
+from lib import analysis
+
+
+def cide(sweep, level):
+    for r in range(len(sweep)):
+        if sweep[r] <= level:
+            if r == 0:
+                return 0
+            return (1 / (sweep[r] - sweep[r - 1])) * (level - sweep[r - 1]) + (r - 1)
+    return len(sweep) - 1
+
+
+def calculate_refrence(sweep_data):
+    max_ind = np.argmax(sweep_data)
+    y = (sweep_data[max_ind] + np.min(sweep_data[max_ind:])) // 2
+    for ind, d in enumerate(sweep_data[max_ind:]):
+        if d <= y:
+            if ind == 0:
+                return max_ind
+            return int((1 / (d - sweep_data[max_ind:][ind - 1])) * (y - sweep_data[max_ind:][ind - 1]) + (ind - 1)) + max_ind
+    return len(sweep_data) - 1
+
+
+def sweeps():
+    steps = np.arange(128)
+    rng = np.random.default_rng(0)
+    curves = 5 + 60 / (1 + np.exp((steps - rng.uniform(20, 110, (200, 1))) / rng.uniform(2, 12, (200, 1))))
+    rows = np.rint(curves + rng.normal(0, 1.5, curves.shape)).clip(0).astype(np.int32)
+    fixed = np.stack([
+        np.full(128, 65),  # flat, never falls
+        np.full(128, 3),  # starts below every level
+        np.linspace(0, 65, 128),  # rises, its peak is the last step
+        np.r_[np.full(40, 2), np.full(88, 65) - np.arange(88) // 2],  # minimum before the peak
+        np.r_[np.full(64, 65), np.full(64, 5)],  # a single step from high to low
+    ]).astype(np.int32)
+    return np.concatenate([fixed, rows])
+
+
+def test_crossings_match_the_row_loop():
+    data = sweeps()
+    for level in (4, 35.5, 64, 70):
+        np.testing.assert_allclose(analysis.crossings(data, level), [cide(row, level) for row in data])
+
+
+def test_crossings_with_a_level_per_sweep(monkeypatch):
+    monkeypatch.setattr(analysis, 'CHUNK', 16)  # several blocks, the last one partial
+    data = sweeps()
+    levels = np.random.default_rng(1).uniform(0, 70, len(data))
+    np.testing.assert_allclose(analysis.crossings(data, levels), [cide(row, lv) for row, lv in zip(data, levels)])
+
+
+def test_refrences_match_the_row_loop(monkeypatch):
+    monkeypatch.setattr(analysis, 'CHUNK', 16)
+    data = sweeps()
+    refs, peaks, found = analysis.refrences(data)
+    np.testing.assert_array_equal(refs, [calculate_refrence(row) for row in data])
+    np.testing.assert_array_equal(peaks, data.argmax(axis=1))
+    assert found.all()
+
+
+def test_one_sweep():
+    data = sweeps()
+    assert analysis.crossings(data[10], 35)[0] == cide(data[10], 35)
+    assert analysis.refrences(data[10])[0][0] == calculate_refrence(data[10])
@@ -0,0 +1,89 @@
+"""
+A query stopped in the middle of a batched sweep must not leave the rest of the stream
+to be read as the replies of the next query on the same connection
+"""
+import asyncio
+import threading
+
+import numpy as np
+
+from lib import aio
+from lib.acquisition import CimosAcquisition
+from lib.interfaces import Serial, Wifi
+from lib.simulator import FirmwareSimulator, TcpSimulator
+
+
+class NullLog:
+    class _Signal:
+        def emit(self, message, level=0):
+            pass
+    LOG = _Signal()
+
+
+def query_vals(reps):
+    return {"Measurment Channel": "Left&Right", "Measurment Type": "Capacitance Sweep", "Refrence Value": 64,
+            "CCO Resolution": "000", "Number of Samples": 5, "Repeats": reps, "Repeat Interval": 0, "Stop Time": 0,
+            "Readout": "Binary", "reps": reps}
+
+
+def check_query_again(again, sim):
+    assert again.capabilities == set(sim.capabilities)
+    assert len(again.results) == 2
+    for bit in (' ', '1'):
+        assert np.abs(again.results.view(bit) - sim.curve(np.arange(again.CR_STEPS), bit)).max() < 3
+
+
+def stop_and_query_again(interface, sim):
+    stopped = CimosAcquisition("test_interrupt")
+    stopped.query_stopped = lambda: None
+    threading.Timer(0.3, lambda: setattr(stopped, 'halt', True)).start()
+    stopped.run_query(interface, query_vals(5), NullLog(), finish_query=False, save_config=False)
+    assert len(stopped.results) < 5
+
+    again = CimosAcquisition("test_interrupt")
+    sim.command_latency = {}
+    again.run_query(interface, query_vals(2), NullLog(), finish_query=False, save_config=False)
+    check_query_again(again, sim)
+
+
+async def stop_and_query_again_async(sim):
+    interface = aio.AsyncSerial()
+    await interface.open(sim.port)
+    try:
+        stopped = CimosAcquisition("test_interrupt")
+        asyncio.get_running_loop().call_later(0.3, setattr, stopped, 'halt', True)
+        await aio.run_query(stopped, interface, query_vals(5), NullLog())
+        assert len(stopped.results) < 5
+
+        again = CimosAcquisition("test_interrupt")
+        sim.command_latency = {}
+        await aio.run_query(again, interface, query_vals(2), NullLog())
+        check_query_again(again, sim)
+    finally:
+        await interface.close()
+
+
+def test_wifi_stop_and_query_again():
+    with TcpSimulator(seed=0, noise=0.1, command_latency={'B': 0.003}) as sim:
+        host, port = sim.port.split(':')
+        interface = Wifi()
+        interface.open_host(host, int(port), 1)
+        try:
+            stop_and_query_again(interface, sim)
+        finally:
+            interface.close()
+
+
+def test_serial_stop_and_query_again():
+    with FirmwareSimulator(seed=0, noise=0.1, command_latency={'B': 0.003}) as sim:
+        interface = Serial()
+        interface.open_port(sim.port, 115200, 1)
+        try:
+            stop_and_query_again(interface, sim)
+        finally:
+            interface.close()
+
+
+def test_async_serial_stop_and_query_again():
+    with FirmwareSimulator(seed=0, noise=0.1, command_latency={'B': 0.003}) as sim:
+        asyncio.run(stop_and_query_again_async(sim))
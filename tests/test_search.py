@@ -0,0 +1,73 @@
+"""
+An adaptive query only searches the crossing of the refrence pulse, it has to find the crossing a full sweep finds
+and store every repetition, flagging the ones whose raw samples weren't read
+"""
+import glob
+import os
+
+import numpy as np
+
+from benchmarks.fake import fake_serial
+from lib.acquisition import CimosAcquisition
+from lib.analysis import load_sweeps
+from lib.archive import RunArchive
+from lib.writer import OutputWriter
+
+
+class NullLog:
+    class _Signal:
+        def emit(self, message, level=0):
+            pass
+    LOG = _Signal()
+
+
+def query_vals(reps, search, output_format="CSV"):
+    return {"Measurment Channel": "Right", "Measurment Type": "Capacitance Sweep", "Refrence Value": 64,
+            "CCO Resolution": "000", "Number of Samples": 20, "Repeats": reps, "Repeat Interval": 0, "Stop Time": 0,
+            "Readout": "Binary", "Output Format": output_format, "Search": search, "reps": reps}
+
+
+def run(vals, output_name=None):
+    device = CimosAcquisition("test_search")
+    interface = fake_serial(capabilities="BF", noise=0.5, seed=3)
+    sim = interface.ser.simulator
+    vals['refrence_pulse'] = float(sim.curve(sim.centers['1'], '1'))  # the curve falls through it halfway
+    device.run_query(interface, vals, NullLog(), finish_query=False, save_config=False, output_name=output_name)
+    return device
+
+
+def test_adaptive_crossing_matches_full_sweep():
+    full = run(query_vals(12, "Full"))
+    adaptive = run(query_vals(12, "Adaptive"))
+    assert len(adaptive.results) == len(full.results) == 12
+    # both read their own noisy samples, so a repetition may differ by the noise but not by a step
+    assert np.abs(adaptive.results.view('cide') - full.results.view('cide')).max() <= 1
+    assert abs(adaptive.results.view('cide').mean() - full.results.view('cide').mean()) < CimosAcquisition.SEARCH_TOLERANCE
+
+
+def test_adaptive_archive_stores_every_repetition(tmp_path, monkeypatch):
+    monkeypatch.setattr(CimosAcquisition, 'FULL_SWEEP_EVERY', 5)
+    device = run(query_vals(12, "Adaptive", "Archive"), str(tmp_path / "{channel}_run"))
+
+    path = glob.glob(str(tmp_path / "*.biosa"))[0]
+    stored = RunArchive(path)
+    assert len(stored) == 12
+    np.testing.assert_array_equal(stored.channel('cide'), device.results.view('cide'))
+    measured = np.asarray(stored.channel(OutputWriter.MEASURED))
+    np.testing.assert_array_equal(np.flatnonzero(measured), [0, 5, 10])
+    assert not np.asarray(stored.channel('Right'))[~measured].any()
+
+    sweeps, reps, vals, xlabels = load_sweeps(path)
+    np.testing.assert_array_equal(reps, [0, 5, 10])
+    assert len(sweeps) == 3
+
+
+def test_adaptive_csv_stores_every_repetition(tmp_path, monkeypatch):
+    monkeypatch.setattr(CimosAcquisition, 'FULL_SWEEP_EVERY', 5)
+    run(query_vals(12, "Adaptive"), str(tmp_path / "{channel}_run"))
+
+    def lines(channel):
+        with open(os.path.join(tmp_path, f"{channel}_run.csv")) as f:
+            return f.read().splitlines()
+    assert len(lines('cide')) == len(lines('time')) == 12
+    assert lines(OutputWriter.MEASURED).count('1') == len(lines('Right')) == 3